@@ -1,7 +1,9 @@
 from .orm_signal_handler import orm_signal_handler
+from specifyweb.specify.models import Address
+from specifyweb.specify.stamps import touched
 
 @orm_signal_handler('pre_save', 'Address')
 def at_most_one_primary_address_per_agent(address):
     if address.isprimary and address.agent is not None:
-        address.agent.addresses.all().update(isprimary=False)
+        address.agent.addresses.filter(isprimary=True).update(isprimary=False, **touched(Address))
 
@@ -1,4 +1,6 @@
 from .orm_signal_handler import orm_signal_handler
+from specifyweb.specify.models import Determination
+from specifyweb.specify.stamps import touched
 
 @orm_signal_handler('pre_save', 'Determination')
 def determination_pre_save(det):
@@ -22,4 +24,5 @@ def determination_pre_save(det):
 @orm_signal_handler('pre_save', 'Determination')
 def only_one_determination_iscurrent(determination):
     if determination.iscurrent:
-        determination.collectionobject.determinations.all().update(iscurrent=False)
+        determination.collectionobject.determinations.filter(iscurrent=True).update(
+            iscurrent=False, **touched(Determination))
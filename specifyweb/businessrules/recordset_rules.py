@@ -2,7 +2,7 @@ from .orm_signal_handler import orm_signal_handler
 
 from django.db import connection
 
-from specifyweb.specify import models
+from specifyweb.specify import models, recordset_index
 from specifyweb.specify.models import Recordsetitem
 
 @orm_signal_handler('post_delete')
@@ -24,3 +24,18 @@ def recordset_pre_save(recordset):
 def recordset_pre_delete(recordset):
     cursor = connection.cursor()
     cursor.execute("delete from recordsetitem where recordsetid = %s", [recordset.id])
+
+@orm_signal_handler('pre_save', 'Recordsetitem')
+def recordsetitem_pre_save(item):
+    if item.id is None: return
+    previous = Recordsetitem.objects.filter(id=item.id).values_list('recordset_id', flat=True).first()
+    if previous is not None and previous != item.recordset_id:
+        recordset_index.bump_version(previous)
+
+@orm_signal_handler('post_save', 'Recordsetitem')
+def recordsetitem_post_save(item):
+    recordset_index.bump_version(item.recordset_id)
+
+@orm_signal_handler('post_delete', 'Recordsetitem')
+def recordsetitem_post_delete(item):
+    recordset_index.bump_version(item.recordset_id)
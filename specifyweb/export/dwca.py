@@ -1,4 +1,5 @@
 import os
+import csv
 import errno
 import logging
 import re
@@ -11,7 +12,7 @@ from datetime import date
 from xml.etree import ElementTree as ET
 from xml.dom import minidom
 
-from specifyweb.stored_queries.execution import EphemeralField, query_to_csv
+from specifyweb.stored_queries.execution import EphemeralField, query_to_csv, NEWLINES_TO_SPACES
 from specifyweb.stored_queries.queryfield import QueryField
 from specifyweb.stored_queries.models import session_context
 
@@ -177,7 +178,11 @@ class ConstantField(namedtuple('ConstantField', 'value term')):
         return cls(value=node.attrib['value'], term=node.attrib['term'])
 
 
-def make_dwca(collection, user, definition, output_file, eml=None):
+def make_dwca(collection, user, definition, output_file, eml=None, progress=None):
+    """Write the Darwin Core archive given by 'definition' to
+    'output_file'. If given, 'progress' is called now and then with the
+    number of data files written so far and the total.
+    """
     output_dir = mkdtemp()
     try:
         element_tree = ET.fromstring(definition)
@@ -203,24 +208,34 @@ def make_dwca(collection, user, definition, output_file, eml=None):
             meta_xml.write(prettify(output_node))
 
         core_ids = set()
-        def collect_ids(row):
-            core_ids.add(row[core_stanza.id_field_idx + 1])
-            return True
+
+        total = sum(len(stanza.queries) for stanza in [core_stanza] + extension_stanzas)
+        files_done = 0
+        def file_progress(rows):
+            progress(files_done, total)
 
         with session_context() as session:
             for query in core_stanza.queries:
                 path = os.path.join(output_dir, query.file_name)
                 query_to_csv(session, collection, user, query.tableid, query.get_field_specs(), path,
-                             strip_id=True, row_filter=collect_ids)
+                             strip_id=True, progress=progress and file_progress)
+                files_done += 1
+
+                # The core files are written without a row filter so
+                # that the export can be done by the database server.
+                # The ids are read back from them instead.
+                with open(path, newline='', encoding='utf-8') as f:
+                    core_ids.update(row[core_stanza.id_field_idx] for row in csv.reader(f))
 
             for stanza in extension_stanzas:
                 def filter_ids(row):
-                    return row[stanza.id_field_idx + 1] in core_ids
+                    return str(row[stanza.id_field_idx + 1]).translate(NEWLINES_TO_SPACES) in core_ids
 
                 for query in stanza.queries:
                     path = os.path.join(output_dir, query.file_name)
                     query_to_csv(session, collection, user, query.tableid, query.get_field_specs(), path,
-                                 strip_id=True, row_filter=filter_ids)
+                                 strip_id=True, row_filter=filter_ids, progress=progress and file_progress)
+                    files_done += 1
 
         basename = re.sub(r'\.zip$', '', output_file)
         shutil.make_archive(basename, 'zip', output_dir, logger=logger)
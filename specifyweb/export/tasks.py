@@ -0,0 +1,25 @@
+"""Background job functions of exports. See specifyweb.jobs."""
+import os
+import json
+
+from django.conf import settings
+
+from ..specify.models import Collection
+from ..notifications.models import Message
+
+from .dwca import make_dwca
+from . import feed
+
+def export_dwca(run, collection_id, definition, eml, filename):
+    "Write the Darwin Core archive given by 'definition' to the depository."
+    collection = Collection.objects.get(id=collection_id)
+    path = os.path.join(settings.DEPOSITORY_DIR, filename)
+    make_dwca(collection, run.user, definition, path, eml=eml, progress=run.progress)
+    Message.objects.create(user=run.user, content=json.dumps({
+        'type': 'dwca-export-complete',
+        'file': filename
+    }))
+
+def update_feed(run):
+    "Regenerate all the items of the export feed."
+    feed.update_feed(force=True, notify_user=run.user)
@@ -1,28 +1,24 @@
 import os
 import errno
 import logging
-import traceback
 from zipfile import ZipFile
-from threading import Thread
 from datetime import datetime
 from email.utils import formatdate
-import json
 
 from xml.etree import ElementTree as ET
 
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404, HttpResponseForbidden
 from django.views.decorators.http import require_POST, require_GET
 from django.views.decorators.cache import never_cache
-from django.conf import settings
 
 from ..specify.views import login_maybe_required
 from ..context.app_resource import get_app_resource
-from ..notifications.models import Message
+from ..jobs.queue import enqueue
 from ..specify.models import Spquery
 
-from .dwca import make_dwca, prettify
+from .dwca import prettify
 from .extract_query import extract_query as extract
-from .feed import FEED_DIR, get_feed_resource, update_feed
+from .feed import FEED_DIR, get_feed_resource
 
 logger = logging.getLogger(__name__)
 
@@ -114,28 +110,9 @@ def export(request):
         eml = None
 
     filename = 'dwca_export_%s.zip' % datetime.now().isoformat()
-    path = os.path.join(settings.DEPOSITORY_DIR, filename)
 
-    def do_export():
-        try:
-            make_dwca(collection, user, definition, path, eml=eml)
-        except Exception as e:
-            tb = traceback.format_exc()
-            logger.error('make_dwca failed: %s', tb)
-            Message.objects.create(user=user, content=json.dumps({
-                'type': 'dwca-export-failed',
-                'exception': str(e),
-                'traceback': tb if settings.DEBUG else None,
-            }))
-        else:
-            Message.objects.create(user=user, content=json.dumps({
-                'type': 'dwca-export-complete',
-                'file': filename
-            }))
-
-    thread = Thread(target=do_export)
-    thread.daemon = True
-    thread.start()
+    enqueue(user, 'dwca-export', collection_id=collection.id,
+            definition=definition, eml=eml, filename=filename)
     return HttpResponse('OK', content_type='text/plain')
 
 @login_maybe_required
@@ -144,22 +121,7 @@ def force_update(request):
     if not request.specify_user.is_admin():
         return HttpResponseForbidden()
 
-    user = request.specify_user # I don't want to close over the entire request.
-    def try_update_feed():
-        try:
-            update_feed(force=True, notify_user=user)
-        except Exception as e:
-            tb = traceback.format_exc()
-            logger.error('update_feed failed: %s', tb)
-            Message.objects.create(user=user, content=json.dumps({
-                'type': 'update-feed-failed',
-                'exception': str(e),
-                'traceback': tb if settings.DEBUG else None,
-            }))
-
-    thread = Thread(target=try_update_feed)
-    thread.daemon = True
-    thread.start()
+    enqueue(request.specify_user, 'update-feed')
     return HttpResponse('OK', content_type='text/plain')
 
 @login_maybe_required
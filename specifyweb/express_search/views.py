@@ -150,7 +150,7 @@ def querycbx_search(request, modelname):
 
     fields = [table.get_field(fieldname, strict=True)
               for fieldname in request.GET
-              if fieldname not in ('limit', 'offset', 'forcecollection')]
+              if fieldname not in ('limit', 'offset', 'forcecollection', 'fields', 'inline')]
 
     if 'forcecollection' in request.GET:
         collection = Collection.objects.get(pk=request.GET['forcecollection'])
@@ -180,9 +180,13 @@ def querycbx_search(request, modelname):
     else:
         ids = []
 
-    from specifyweb.specify.api import get_model_or_404, obj_to_data
+    from specifyweb.specify.api import get_model_or_404, obj_to_data, prefetch_for_serialization, \
+        normalize_field_spec, parse_field_list
     specify_model = get_model_or_404(modelname)
-    qs = specify_model.objects.filter(id__in=ids)
+    fields, inline = normalize_field_spec(specify_model,
+                                          parse_field_list(request.GET.get('fields')),
+                                          parse_field_list(request.GET.get('inline')))
+    qs = prefetch_for_serialization(specify_model.objects.filter(id__in=ids), fields, inline)
 
-    results = [obj_to_data(obj) for obj in qs]
+    results = [obj_to_data(obj, fields, inline) for obj in qs]
     return HttpResponse(toJson(results), content_type='application/json')
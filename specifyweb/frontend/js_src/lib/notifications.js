@@ -74,6 +74,24 @@ const renderMessage = {
         $('a', rendered).attr('href',  '/static/depository/' + message.get('file'));
         return rendered;
     },
+    'query-export-failed': message => {
+        const rendered = $('<p>Query export failed. <a download>Exception</a> <a class="retry">Retry.</a></p>');
+        $('a[download]', rendered).attr('href', 'data:application/json:' + JSON.stringify(message.toJSON()));
+        $('a.retry', rendered).click(() => $.post(`/jobs/${message.get('job_id')}/retry/`));
+        return rendered;
+    },
+    'job-progress': message => {
+        const total = message.get('total');
+        const done = total == null ? message.get('done') : `${message.get('done')} of ${total}`;
+        const rendered = $(`<p>Background job ${message.get('jobtype')} in progress: ${done}. <a>Cancel.</a></p>`);
+        $('a', rendered).click(() => $.post(`/jobs/${message.get('job_id')}/cancel/`));
+        return rendered;
+    },
+    'job-cancelled': message => {
+        const rendered = $(`<p>Background job ${message.get('jobtype')} cancelled. <a>Retry.</a></p>`);
+        $('a', rendered).click(() => $.post(`/jobs/${message.get('job_id')}/retry/`));
+        return rendered;
+    },
     default: message => JSON.stringify(message.toJSON())
 };
 
@@ -0,0 +1,40 @@
+import json
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.jobs.worker import WorkerPool
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs, e.g. query exports, until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency',
+                            help='JSON object of the number of workers per job type, '
+                            'overriding the JOB_CONCURRENCY setting')
+        parser.add_argument('--shutdown-timeout', type=float, default=60,
+                            help='seconds to wait for running jobs when stopping')
+
+    def handle(self, **options):
+        concurrency = settings.JOB_CONCURRENCY
+        if options['concurrency'] is not None:
+            try:
+                concurrency = json.loads(options['concurrency'])
+            except ValueError as e:
+                raise CommandError("bad concurrency: %s" % e)
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        pool = WorkerPool(concurrency).start()
+        self.stdout.write("worker pool %s running %s" % (pool.name, concurrency))
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write("stopping worker pool %s" % pool.name)
+        pool.stop(options['shutdown_timeout'])
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jobtype', models.CharField(max_length=64)),
+                ('arguments', models.TextField()),
+                ('status', models.CharField(db_index=True, default='queued', max_length=16)),
+                ('cancelrequested', models.BooleanField(default=False)),
+                ('attempts', models.IntegerField(default=0)),
+                ('maxattempts', models.IntegerField(default=3)),
+                ('worker', models.CharField(max_length=128, null=True)),
+                ('progress', models.IntegerField(null=True)),
+                ('progresstotal', models.IntegerField(null=True)),
+                ('error', models.TextField(null=True)),
+                ('timestampcreated', models.DateTimeField(auto_now_add=True)),
+                ('timestampstarted', models.DateTimeField(null=True)),
+                ('timestampfinished', models.DateTimeField(null=True)),
+                ('heartbeat', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import models
+from ..specify.models import Specifyuser
+
+class Job(models.Model):
+    """A unit of background work, e.g. a query export, waiting for or
+    being run by a worker. See specifyweb.jobs.queue.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    # Null for maintenance jobs enqueued by the system itself.
+    user = models.ForeignKey(Specifyuser, on_delete=models.CASCADE, null=True)
+    jobtype = models.CharField(max_length=64)
+    arguments = models.TextField()
+    status = models.CharField(max_length=16, default=QUEUED, db_index=True)
+    cancelrequested = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+    maxattempts = models.IntegerField(default=3)
+    worker = models.CharField(max_length=128, null=True)
+    progress = models.IntegerField(null=True)
+    progresstotal = models.IntegerField(null=True)
+    error = models.TextField(null=True)
+    timestampcreated = models.DateTimeField(auto_now_add=True)
+    timestampstarted = models.DateTimeField(null=True)
+    timestampfinished = models.DateTimeField(null=True)
+    heartbeat = models.DateTimeField(null=True)
@@ -0,0 +1,220 @@
+"""A job queue kept in the database.
+
+Long running work, e.g. exporting query results or building Darwin
+Core archives, is enqueued as a Job row and run by a pool of workers
+(see specifyweb.jobs.worker). Workers claim jobs with an atomic
+update, so several pools, possibly in different processes, can share
+the queue. A running job is kept alive by its worker's heartbeat; jobs
+whose worker has died are put back in the queue or failed after
+'maxattempts' tries.
+
+A job type is implemented by a function taking a JobRun followed by the
+job's arguments as keyword arguments. The function may call
+JobRun.progress, which records the progress, tells the user about it
+with a notification message now and then and raises JobCancelled if
+the job has been cancelled.
+"""
+from datetime import datetime, timedelta
+from time import time
+import json
+import logging
+import traceback
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from ..notifications.models import Message
+
+from .models import Job
+
+# The functions implementing each job type.
+JOB_HANDLERS = {
+    'query-export': 'specifyweb.stored_queries.tasks.export_query',
+    'dwca-export': 'specifyweb.export.tasks.export_dwca',
+    'update-feed': 'specifyweb.export.tasks.update_feed',
+    'rebalance-tree': 'specifyweb.specify.tasks.rebalance_tree',
+}
+
+# Seconds between checks of a running job for cancellation.
+CHECK_INTERVAL = 5
+
+# Seconds between progress notifications of a running job.
+PROGRESS_MESSAGE_INTERVAL = 60
+
+# Seconds without a heartbeat after which a running job's worker is
+# considered dead.
+STALE_AFTER = 180
+
+class JobCancelled(Exception):
+    pass
+
+def enqueue(user, jobtype, **arguments):
+    """Add a job of 'jobtype' for 'user' to the queue and return it.
+    The 'arguments' are passed to the job's function and have to be
+    JSON serializable. Jobs the system enqueues for itself have no
+    user and send no messages.
+    """
+    if jobtype not in JOB_HANDLERS:
+        raise ValueError("unknown job type: %s" % jobtype)
+    job = Job.objects.create(user=user, jobtype=jobtype, arguments=json.dumps(arguments))
+    logger.info("enqueued %s job %d", jobtype, job.id)
+    wake_workers(jobtype)
+    return job
+
+def wake_workers(jobtype):
+    """Make the in-process workers of 'jobtype' look for the job once
+    the enqueuing transaction has committed it.
+    """
+    if settings.RUN_JOBS_IN_WEB_PROCESS:
+        from .worker import in_process_pool
+        transaction.on_commit(lambda: in_process_pool().wake(jobtype))
+
+def claim(jobtype, worker):
+    """Mark the oldest queued job of 'jobtype' as run by 'worker' and
+    return it, or return None if there is none.
+    """
+    candidates = Job.objects.filter(jobtype=jobtype, status=Job.QUEUED) \
+                            .order_by('id').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        now = datetime.now()
+        # Only one worker's update matches the queued status.
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1,
+            timestampstarted=now, heartbeat=now)
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+def cancel(job):
+    """Cancel 'job'. A queued job is cancelled immediately. A running
+    job is stopped by its worker the next time it reports progress.
+    Returns False if the job has already finished.
+    """
+    if Job.objects.filter(id=job.id, status=Job.QUEUED).update(
+            status=Job.CANCELLED, timestampfinished=datetime.now()):
+        return True
+    return bool(Job.objects.filter(id=job.id, status=Job.RUNNING).update(cancelrequested=True))
+
+def retry(job):
+    """Put a failed or cancelled 'job' back in the queue. Returns False
+    if the job is queued, running or has succeeded.
+    """
+    retried = Job.objects.filter(id=job.id, status__in=(Job.FAILED, Job.CANCELLED)).update(
+        status=Job.QUEUED, cancelrequested=False, attempts=0, worker=None, error=None,
+        progress=None, progresstotal=None, timestampstarted=None, timestampfinished=None)
+    if retried:
+        wake_workers(job.jobtype)
+    return bool(retried)
+
+def heartbeat(worker):
+    "Record that the jobs run by 'worker' are still alive."
+    Job.objects.filter(worker=worker, status=Job.RUNNING).update(heartbeat=datetime.now())
+
+def requeue_stale():
+    """Put running jobs whose worker has stopped sending heartbeats back
+    in the queue, or fail them if they have used up their attempts.
+    """
+    cutoff = datetime.now() - timedelta(seconds=STALE_AFTER)
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat__lt=cutoff)
+
+    for job in stale.filter(attempts__lt=F('maxattempts')):
+        if stale.filter(id=job.id).update(status=Job.QUEUED, worker=None):
+            logger.warning("requeued %s job %d of dead worker %s", job.jobtype, job.id, job.worker)
+
+    for job in stale.filter(attempts__gte=F('maxattempts')):
+        error = "worker %s stopped responding" % job.worker
+        if stale.filter(id=job.id).update(status=Job.FAILED, error=error,
+                                          timestampfinished=datetime.now()):
+            logger.error("%s job %d failed: %s", job.jobtype, job.id, error)
+            notify_failed(job, error)
+
+class JobRun(object):
+    "The view of a running job given to the job's function."
+
+    def __init__(self, job):
+        self.job = job
+        self.user = job.user
+        self.last_check = time()
+        self.last_message = time()
+        self.message = None
+
+    def progress(self, done, total=None):
+        """Report that 'done' of 'total' steps of the job are done.
+        Raises JobCancelled if the job has been cancelled or taken from
+        this worker.
+        """
+        now = time()
+        if now - self.last_check < CHECK_INTERVAL:
+            return
+        self.last_check = now
+
+        alive = Job.objects.filter(id=self.job.id, worker=self.job.worker, status=Job.RUNNING,
+                                   cancelrequested=False) \
+                           .update(progress=done, progresstotal=total, heartbeat=datetime.now())
+        if not alive:
+            raise JobCancelled()
+
+        if self.user is not None and now - self.last_message >= PROGRESS_MESSAGE_INTERVAL:
+            self.last_message = now
+            self.clear_message()
+            self.message = Message.objects.create(user=self.user, content=json.dumps({
+                'type': 'job-progress',
+                'job_id': self.job.id,
+                'jobtype': self.job.jobtype,
+                'done': done,
+                'total': total,
+            }))
+
+    def clear_message(self):
+        "Delete the last progress message, which is out of date."
+        if self.message is not None:
+            Message.objects.filter(id=self.message.id).delete()
+            self.message = None
+
+def run_job(job):
+    """Run the claimed 'job' and record the outcome. Failures are
+    reported to the user with a '<jobtype>-failed' message.
+    """
+    run = JobRun(job)
+    logger.info("running %s job %d, attempt %d", job.jobtype, job.id, job.attempts)
+    try:
+        handler = import_string(JOB_HANDLERS[job.jobtype])
+        handler(run, **json.loads(job.arguments))
+    except JobCancelled:
+        logger.info("%s job %d cancelled", job.jobtype, job.id)
+        if finish(job, Job.CANCELLED) and job.user_id is not None:
+            Message.objects.create(user=job.user, content=json.dumps({
+                'type': 'job-cancelled',
+                'job_id': job.id,
+                'jobtype': job.jobtype,
+            }))
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.error('%s job %d failed: %s', job.jobtype, job.id, tb)
+        if finish(job, Job.FAILED, error=tb):
+            notify_failed(job, str(e), tb)
+    else:
+        finish(job, Job.SUCCEEDED)
+        logger.info("%s job %d finished", job.jobtype, job.id)
+    finally:
+        run.clear_message()
+
+def finish(job, status, error=None):
+    """Record the outcome of 'job' unless it has been taken from its
+    worker in the meantime. Returns True if it was recorded.
+    """
+    return bool(Job.objects.filter(id=job.id, worker=job.worker, status=Job.RUNNING).update(
+        status=status, error=error, timestampfinished=datetime.now()))
+
+def notify_failed(job, exception, tb=None):
+    if job.user_id is None:
+        return
+    Message.objects.create(user=job.user, content=json.dumps({
+        'type': '%s-failed' % job.jobtype,
+        'job_id': job.id,
+        'exception': exception,
+        'traceback': tb if settings.DEBUG else None,
+    }))
@@ -0,0 +1,137 @@
+import json
+from datetime import datetime, timedelta
+
+from django.test import override_settings
+
+from specifyweb.specify.api_tests import ApiTests
+from specifyweb.notifications.models import Message
+from .models import Job
+from . import queue
+from .worker import WorkerPool
+
+def succeed(run, value):
+    run.progress(1, 1)
+
+def fail(run):
+    raise Exception("job failed")
+
+def check_cancelled(run):
+    Job.objects.filter(id=run.job.id).update(cancelrequested=True)
+    run.last_check = 0
+    run.progress(0)
+
+TEST_HANDLERS = dict(queue.JOB_HANDLERS,
+                     succeed='specifyweb.jobs.tests.succeed',
+                     fail='specifyweb.jobs.tests.fail',
+                     check_cancelled='specifyweb.jobs.tests.check_cancelled')
+
+@override_settings(RUN_JOBS_IN_WEB_PROCESS=False)
+class JobQueueTests(ApiTests):
+    def setUp(self):
+        super(JobQueueTests, self).setUp()
+        self.handlers = queue.JOB_HANDLERS
+        queue.JOB_HANDLERS = TEST_HANDLERS
+
+    def tearDown(self):
+        queue.JOB_HANDLERS = self.handlers
+        super(JobQueueTests, self).tearDown()
+
+    def messages(self):
+        return [json.loads(m.content) for m in Message.objects.filter(user=self.specifyuser)]
+
+    def test_enqueue_unknown_type(self):
+        with self.assertRaises(ValueError):
+            queue.enqueue(self.specifyuser, 'no-such-job')
+
+    def test_claim_in_order_once(self):
+        first = queue.enqueue(self.specifyuser, 'succeed', value=1)
+        second = queue.enqueue(self.specifyuser, 'succeed', value=2)
+
+        claimed = queue.claim('succeed', 'worker-a')
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertEqual(claimed.worker, 'worker-a')
+        self.assertEqual(claimed.attempts, 1)
+
+        self.assertEqual(queue.claim('succeed', 'worker-b').id, second.id)
+        self.assertIsNone(queue.claim('succeed', 'worker-b'))
+        self.assertIsNone(queue.claim('fail', 'worker-b'))
+
+    def test_run_succeeds(self):
+        queue.enqueue(self.specifyuser, 'succeed', value=1)
+        job = queue.claim('succeed', 'worker')
+        queue.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertIsNotNone(job.timestampfinished)
+
+    def test_run_fails_and_retry(self):
+        queue.enqueue(self.specifyuser, 'fail')
+        job = queue.claim('fail', 'worker')
+        queue.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("job failed", job.error)
+        self.assertEqual([m['type'] for m in self.messages()], ['fail-failed'])
+
+        self.assertTrue(queue.retry(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Job.QUEUED, 0, None))
+        self.assertFalse(queue.retry(job))
+
+    def test_cancel_queued(self):
+        job = queue.enqueue(self.specifyuser, 'succeed', value=1)
+        self.assertTrue(queue.cancel(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertIsNone(queue.claim('succeed', 'worker'))
+
+    def test_cancel_running(self):
+        queue.enqueue(self.specifyuser, 'check_cancelled')
+        job = queue.claim('check_cancelled', 'worker')
+        queue.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual([m['type'] for m in self.messages()], ['job-cancelled'])
+        self.assertFalse(queue.cancel(job))
+
+    def test_requeue_stale(self):
+        queue.enqueue(self.specifyuser, 'succeed', value=1)
+        job = queue.claim('succeed', 'dead-worker')
+        stale = datetime.now() - timedelta(seconds=queue.STALE_AFTER + 10)
+        Job.objects.filter(id=job.id).update(heartbeat=stale)
+
+        queue.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIsNone(job.worker)
+
+        job = queue.claim('succeed', 'dead-worker')
+        Job.objects.filter(id=job.id).update(heartbeat=stale, attempts=job.maxattempts)
+        queue.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual([m['type'] for m in self.messages()], ['succeed-failed'])
+
+    def test_system_job_without_messages(self):
+        job = queue.enqueue(None, 'fail')
+        queue.run_job(queue.claim('fail', 'worker'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertFalse(Message.objects.exists())
+
+    def test_finish_ignored_after_requeue(self):
+        queue.enqueue(self.specifyuser, 'succeed', value=1)
+        job = queue.claim('succeed', 'slow-worker')
+        Job.objects.filter(id=job.id).update(status=Job.QUEUED, worker=None)
+        self.assertFalse(queue.finish(job, Job.SUCCEEDED))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_wake_job_type(self):
+        pool = WorkerPool({'succeed': 2, 'fail': 1})
+        pool.wake('succeed')
+        self.assertTrue(pool.wakeups['succeed'].is_set())
+        self.assertFalse(pool.wakeups['fail'].is_set())
+        pool.wake()
+        self.assertTrue(pool.wakeups['fail'].is_set())
@@ -0,0 +1,9 @@
+from django.conf.urls import url
+
+from . import views
+
+urlpatterns = [
+    url(r'^$', views.get_jobs),
+    url(r'^(?P<job_id>\d+)/cancel/$', views.cancel),
+    url(r'^(?P<job_id>\d+)/retry/$', views.retry),
+]
@@ -0,0 +1,50 @@
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.cache import never_cache
+
+from ..specify.views import login_maybe_required
+from ..specify.api import toJson
+
+from .models import Job
+from . import queue
+
+def job_to_data(job):
+    return dict(
+        job_id=job.id,
+        jobtype=job.jobtype,
+        status=job.status,
+        cancelrequested=job.cancelrequested,
+        attempts=job.attempts,
+        progress=job.progress,
+        progresstotal=job.progresstotal,
+        timestampcreated=job.timestampcreated,
+        timestampstarted=job.timestampstarted,
+        timestampfinished=job.timestampfinished,
+    )
+
+def get_job(request, job_id):
+    try:
+        return Job.objects.get(id=job_id, user=request.specify_user)
+    except Job.DoesNotExist:
+        raise Http404()
+
+@require_GET
+@login_maybe_required
+@never_cache
+def get_jobs(request):
+    jobs = Job.objects.filter(user=request.specify_user).order_by('-id')[:100]
+    return HttpResponse(toJson([job_to_data(job) for job in jobs]), content_type='application/json')
+
+@require_POST
+@login_maybe_required
+def cancel(request, job_id):
+    if not queue.cancel(get_job(request, job_id)):
+        return HttpResponseBadRequest('job has already finished')
+    return HttpResponse('OK', content_type='text/plain')
+
+@require_POST
+@login_maybe_required
+def retry(request, job_id):
+    if not queue.retry(get_job(request, job_id)):
+        return HttpResponseBadRequest('only failed or cancelled jobs can be retried')
+    return HttpResponse('OK', content_type='text/plain')
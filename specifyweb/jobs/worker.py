@@ -0,0 +1,104 @@
+"""A pool of threads running the jobs of the queue.
+
+Every job type gets as many threads as the JOB_CONCURRENCY setting
+allows, so that e.g. a few large Darwin Core archives can't hold up
+query exports. The pool is either run by the run_jobs management
+command or, if RUN_JOBS_IN_WEB_PROCESS is set, started within the web
+app by the WSGI script, or else when a job is enqueued.
+"""
+from uuid import uuid4
+import os
+import socket
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import queue
+
+# Seconds between checks of the queue by idle workers.
+POLL_INTERVAL = 10
+
+# Seconds between heartbeats of the running jobs.
+HEARTBEAT_INTERVAL = 30
+
+class WorkerPool(object):
+    def __init__(self, concurrency=None, name=None):
+        self.concurrency = settings.JOB_CONCURRENCY if concurrency is None else concurrency
+        self.name = name or '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid4().hex[:8])
+        self.stopping = threading.Event()
+        # One event per job type, so that waking the workers of one
+        # type can't be swallowed by the workers of another.
+        self.wakeups = {jobtype: threading.Event() for jobtype in self.concurrency}
+        self.threads = []
+
+    def start(self):
+        queue.requeue_stale()
+        for jobtype, count in self.concurrency.items():
+            for i in range(count):
+                self.spawn(self.work, jobtype)
+        self.spawn(self.beat)
+        logger.info("worker pool %s started: %s", self.name, self.concurrency)
+        return self
+
+    def spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def wake(self, jobtype=None):
+        "Make the idle workers of 'jobtype', or of all types, check the queue now."
+        for wakeup_jobtype, wakeup in self.wakeups.items():
+            if jobtype is None or jobtype == wakeup_jobtype:
+                wakeup.set()
+
+    def stop(self, timeout=None):
+        """Stop the workers once their current jobs are done. Jobs still
+        running after 'timeout' seconds are requeued by another pool
+        when their heartbeat goes stale.
+        """
+        self.stopping.set()
+        self.wake()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def work(self, jobtype):
+        wakeup = self.wakeups[jobtype]
+        while not self.stopping.is_set():
+            close_old_connections()
+            # Cleared before looking at the queue, so a wake up that
+            # comes while claiming isn't lost.
+            wakeup.clear()
+            try:
+                job = queue.claim(jobtype, self.name)
+            except Exception:
+                logger.exception("claiming %s job failed", jobtype)
+                job = None
+
+            if job is None:
+                wakeup.wait(POLL_INTERVAL)
+            else:
+                queue.run_job(job)
+
+    def beat(self):
+        while not self.stopping.wait(HEARTBEAT_INTERVAL):
+            close_old_connections()
+            try:
+                queue.heartbeat(self.name)
+                queue.requeue_stale()
+            except Exception:
+                logger.exception("heartbeat of worker pool %s failed", self.name)
+
+_pool = None
+_lock = threading.Lock()
+
+def in_process_pool():
+    "Return the worker pool of this process, starting it if necessary."
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = WorkerPool().start()
+        return _pool
@@ -92,6 +92,7 @@ def run_query(collection, user, query_json):
                               for field in sorted(spquery['fields'],
                                                   key=lambda f: f['position'])]
 
-    query_result = run_ephemeral_query(collection, user, spquery)
+    # Reports run the same queries again and again, see result_cache.
+    query_result = run_ephemeral_query(collection, user, spquery, use_result_cache=True)
 
     return {'fields': report_fields, 'rows': query_result['results']}
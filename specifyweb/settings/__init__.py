@@ -185,6 +185,7 @@ INSTALLED_APPS = (
     'specifyweb.workbench',
     'specifyweb.notifications',
     'specifyweb.export',
+    'specifyweb.jobs',
     'specifyweb.raven_placeholder' if RAVEN_CONFIG is None else 'raven.contrib.django.raven_compat',
 )
 
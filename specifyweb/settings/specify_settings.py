@@ -67,3 +67,45 @@ DEPOSITORY_DIR = '/home/specify/specify_depository'
 NOTIFICATION_TTL_DAYS = 7
 
 DISABLE_AUDITING = False
+
+# Query results exported to CSV files can be written by the database
+# server with SELECT ... INTO OUTFILE instead of being passed through
+# the web app. This requires the FILE privilege for the master user
+# and a directory that the server may write to (see the
+# secure_file_priv server variable) and that the web app sees at the
+# same path, i.e. the database runs on the same host or the directory
+# is shared. Exports fall back to the usual path if it isn't possible.
+EXPORT_SELECT_INTO_OUTFILE = False
+EXPORT_OUTFILE_DIR = None
+
+# How query columns of tree ranks, e.g. the family of a taxon, are
+# resolved. 'ancestors' joins every ancestor up to the root of the
+# tree and picks the one at the rank. 'nodenumber' joins the node of
+# the rank whose node number interval contains the node, a single join
+# per rank, but relies on the tree's node numbers being up to date.
+TREE_RANK_JOIN_STRATEGY = 'ancestors'
+
+# Spacing of the node numbers given to tree nodes when a tree is
+# renumbered. With 1 the numbers are dense and every insert or move
+# shifts the node numbers of all the nodes after it. With a larger gap
+# most inserts and moves of small subtrees only update the nodes
+# concerned. When a gap runs out the numbers are shifted as usual and
+# the tree is renumbered by a background job. The node numbers of the
+# largest tree times the gap have to fit in a 32 bit integer.
+TREE_NODENUMBER_GAP = 1
+
+# Exports and tree renumbering are run as background jobs kept in the
+# database (see specifyweb.jobs). This is the number of jobs of each
+# type that a worker pool runs at the same time.
+JOB_CONCURRENCY = {
+    'query-export': 2,
+    'dwca-export': 1,
+    'update-feed': 1,
+    'rebalance-tree': 1,
+}
+
+# Whether the web app runs a worker pool itself. If not, the jobs are
+# left for worker processes started with 'manage.py run_jobs', which
+# keeps long exports from taking threads and memory of the web
+# server. With this set, every web server process runs a pool.
+RUN_JOBS_IN_WEB_PROCESS = False
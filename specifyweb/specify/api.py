@@ -1,14 +1,22 @@
-from urllib.parse import urlencode
 import json
 import re
 import logging
+import binascii
+import hashlib
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import defaultdict, namedtuple
+from copy import deepcopy
+from functools import lru_cache
+from operator import attrgetter
 logger = logging.getLogger(__name__)
 
 from django import forms
-from django.db import transaction
-from django.http import (HttpResponse, HttpResponseBadRequest,
+from django.db import connection, transaction
+from django.db.models import F, Q, Value, IntegerField
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
                          Http404, HttpResponseNotAllowed, QueryDict)
 from django.core.exceptions import ObjectDoesNotExist, FieldError
+from django.utils.http import parse_etags
 from django.db.models.fields.related import ForeignKey
 from django.db.models.fields import DateTimeField, FieldDoesNotExist, FloatField, DecimalField
 # from django.utils.deprecation import CallableBool
@@ -17,6 +25,8 @@ from . import models
 from .autonumbering import autonumber_and_save, AutonumberOverflowException
 from .filter_by_col import filter_by_collection
 from .auditlog import auditlog
+from . import recordset_index
+from .streaming import STREAM_FORMATS, stream_rows, stream_objects, streaming_response
 
 # Regex matching api uris for extracting the model name and id number.
 URI_RE = re.compile(r'^/api/specify/(\w+)/($|(\d+))')
@@ -96,8 +106,18 @@ def resource_dispatch(request, model, id):
 
     # Dispatch on the request type.
     if request.method == 'GET':
-        data = get_resource(model, id, request.GET.get('recordsetid', None))
-        resp = HttpResponse(toJson(data), content_type='application/json')
+        recordsetid = request.GET.get('recordsetid', None)
+        fields = parse_field_list(request.GET.get('fields'))
+        inline = parse_field_list(request.GET.get('inline'))
+        # The record set info is not covered by the ETag.
+        etag = resource_etag(model, id, fields, inline) if recordsetid is None else None
+        if etag is not None and etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH')):
+            resp = HttpResponseNotModified()
+        else:
+            data = get_resource(model, id, recordsetid, fields, inline)
+            resp = HttpResponse(toJson(data), content_type='application/json')
+        if etag is not None:
+            resp['ETag'] = etag
 
     elif request.method == 'PUT':
         data = json.load(request)
@@ -139,11 +159,39 @@ class GetCollectionForm(forms.Form):
 
     orderby = forms.CharField(required=False)
 
+    # Page through the items using the opaque 'next' cursor of the
+    # previous page instead of 'offset'. An empty cursor requests the
+    # first page.
+    cursor = forms.CharField(required=False)
+
+    # How to compute 'total_count': 'exact' runs a COUNT(*),
+    # 'estimate' asks the database for its row estimate and 'none'
+    # skips it.
+    count = forms.ChoiceField(choices=(('exact', 'exact'), ('estimate', 'estimate'), ('none', 'none')),
+                              required=False)
+
+    # Stream the requested items as a JSON document or as newline
+    # delimited JSON, which omits the meta data, instead of
+    # building the response in memory.
+    stream = forms.ChoiceField(choices=STREAM_FORMATS, required=False)
+
+    # Comma separated names of the fields to include in the items.
+    fields = forms.CharField(required=False)
+
+    # Comma separated dotted paths of the dependent objects to nest
+    # in the items. Those left out are represented by URIs.
+    inline = forms.CharField(required=False)
+
     defaults = dict(
         domainfilter=None,
         limit=0,
         offset=0,
         orderby=None,
+        cursor=None,
+        count='exact',
+        stream=None,
+        fields=None,
+        inline=None,
     )
 
     def clean_limit(self):
@@ -154,6 +202,32 @@ class GetCollectionForm(forms.Form):
         offset = self.cleaned_data['offset']
         return 0 if offset is None else offset
 
+    def clean_cursor(self):
+        if 'cursor' not in self.data:
+            return None
+        try:
+            return decode_cursor(self.cleaned_data['cursor'])
+        except ValueError:
+            raise forms.ValidationError("invalid cursor")
+
+    def clean_fields(self):
+        return parse_field_list(self.data.get('fields'))
+
+    def clean_inline(self):
+        return parse_field_list(self.data.get('inline'))
+
+    def clean_count(self):
+        return self.cleaned_data['count'] or 'exact'
+
+    def clean(self):
+        cleaned_data = super(GetCollectionForm, self).clean()
+        cursor = cleaned_data.get('cursor')
+        if cursor is not None and cleaned_data.get('stream'):
+            raise forms.ValidationError("cursor and stream cannot be combined")
+        if cursor and cursor.orderby != (cleaned_data.get('orderby') or None):
+            raise forms.ValidationError("cursor does not match orderby")
+        return cleaned_data
+
 def collection_dispatch(request, model):
     """Handles requests related to collections of resources.
 
@@ -167,6 +241,9 @@ def collection_dispatch(request, model):
             return HttpResponseBadRequest(toJson(control_params.errors),
                                           content_type='application/json')
         try:
+            if control_params.cleaned_data['stream']:
+                return stream_collection(request.specify_collection, model,
+                                         control_params.cleaned_data, request.GET)
             data = get_collection(request.specify_collection, model,
                                   control_params.cleaned_data, request.GET)
         except (FilterError, OrderByError) as e:
@@ -203,54 +280,155 @@ def get_object_or_404(model, *args, **kwargs):
         model = get_model_or_404(model)
     return get_object(model, *args, **kwargs)
 
-def get_resource(name, id, recordsetid=None):
+def get_resource(name, id, recordsetid=None, fields=None, inline=None):
     """Return a dict of the fields from row 'id' in model 'name'.
 
     If given a recordset id, the data will be suplemented with
     data about the resource's relationship to the given record set.
+
+    The data can be limited to the given 'fields' and nested
+    dependent objects 'inline' as for obj_to_data.
     """
-    obj = get_object_or_404(name, id=int(id))
-    data = obj_to_data(obj)
+    model = get_model_or_404(name)
+    fields, inline = normalize_field_spec(model, fields, inline)
+    objs = model.objects.filter(id=int(id))
+    if fields is not None or inline is not None:
+        objs = prefetch_for_serialization(objs, fields, inline)
+    obj = get_object_or_404(objs)
+    data = obj_to_data(obj, fields, inline)
     if recordsetid is not None:
         data['recordset_info'] = get_recordset_info(obj, recordsetid)
     return data
 
+@lru_cache(maxsize=None)
+def etag_plan(model):
+    """Return a list of (lookup, tableid) for each relationship path
+    from the Django model 'model' to the records whose state goes into
+    the serialized data of an instance, or None if some of them have
+    no version or timestampmodified to tell their state by.
+
+    The paths cover the dependent objects obj_to_data inlines, the
+    collecting events and paleo contexts it may inline, the domain
+    objects that decide whether they are, and the loan preparations
+    that determine whether a preparation is on loan.
+    """
+    paths = []
+
+    def add_path(model, lookup):
+        paths.append((model, lookup))
+        if model.__name__ in EMBEDDING_DOMAINS:
+            domain_model, domain_lookup = model, lookup
+            for name in EMBEDDING_DOMAINS[model.__name__].split('__'):
+                domain_model = domain_model._meta.get_field(name).related_model
+                domain_lookup += name + '__'
+                paths.append((domain_model, domain_lookup))
+        if model is models.Preparation:
+            paths.append((models.Loanpreparation, lookup + 'loanpreparations__'))
+
+    def walk(model, lookup, path_models):
+        add_path(model, lookup)
+        for field in model._meta.get_fields():
+            if field.one_to_many:
+                name = field.get_accessor_name()
+            elif field.many_to_one or (field.one_to_one and not field.auto_created):
+                name = field.name
+            else:
+                continue
+
+            spfield = model.specify_model.get_field(name)
+            embeddable = (model.__name__, name) in EMBEDDABLE_FIELDS
+            if not embeddable and (spfield is None or not spfield.dependent):
+                continue
+            if field.related_model in path_models:
+                continue
+            walk(field.related_model, lookup + name + '__', path_models | {field.related_model})
+
+    walk(model, '', {model})
+
+    plan = []
+    for path_model, lookup in paths:
+        try:
+            path_model._meta.get_field('version')
+            path_model._meta.get_field('timestampmodified')
+        except FieldDoesNotExist:
+            return None
+        plan.append((lookup[:-len('__')], path_model.specify_model.tableId))
+    return plan
+
+def resource_etag(name, id, fields=None, inline=None):
+    """Return a strong ETag for the serialized data of the resource
+    with 'id' in model 'name', limited to 'fields' and 'inline' as for
+    get_resource, or None if it can't be computed.
+
+    The tag is a hash of the table ids, ids, versions and modification
+    stamps of the resource and every record obj_to_data draws on,
+    fetched with a single indexed query, so that an unchanged resource
+    is answered without serializing it. Saves through the API bump the
+    version. Writes that change records without saving them, like tree
+    renumbering and business rules updating siblings, advance
+    timestampmodified instead (see stamps.touched).
+    """
+    model = get_model_or_404(name)
+    plan = None if model is models.Specifyuser else etag_plan(model)
+    if plan is None:
+        # Specifyuser's isadmin comes from tables outside the graph.
+        return None
+
+    def branch(lookup, tableid):
+        prefix = lookup + '__' if lookup else ''
+        return model.objects.filter(id=int(id)).order_by().annotate(
+            _tableid=Value(tableid, output_field=IntegerField()),
+            _id=F(prefix + 'id'),
+            _version=F(prefix + 'version'),
+            _stamp=F(prefix + 'timestampmodified'),
+        ).values_list('_tableid', '_id', '_version', '_stamp')
+
+    branches = [branch(*path) for path in plan]
+    rows = list(branches[0].union(*branches[1:], all=True))
+    if not rows:
+        return None
+    fields, inline = normalize_field_spec(model, fields, inline)
+    state = sorted(repr(tuple(row)) for row in rows)
+    state.extend(repr(None if names is None else sorted(names)) for names in (fields, inline))
+    return '"%s"' % hashlib.md5('\n'.join(state).encode()).hexdigest()
+
+def etag_matches(etag, if_none_match):
+    """Does 'etag' satisfy the value of an If-None-Match header? The
+    tags are compared weakly, as If-None-Match requires.
+    """
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or strip_weak(etag) in (strip_weak(e) for e in etags)
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
 def get_recordset_info(obj, recordsetid):
     """Return a dict of info about how the resource 'obj' is related to
     the recordset with id 'recordsetid'.
     """
-    # Queryset of record set items in the given record set with
-    # the additional condition that they match the resource's table.
-    rsis = models.Recordsetitem.objects.filter(
-        recordset__id=recordsetid, recordset__dbtableid=obj.specify_model.tableId)
+    # The cached index of the record set's items is validated against
+    # the record set's version and then searched in memory.
+    index = recordset_index.get_index(recordsetid)
 
-    # Get the one which points to the resource 'obj'.
-    try:
-        rsi = rsis.get(recordid=obj.id)
-    except models.Recordsetitem.DoesNotExist:
+    # The record set must exist and match the resource's table.
+    if index is None or index.dbtableid != obj.specify_model.tableId:
         return None
 
-    # Querysets for the recordset items before and after the one in question.
-    prev_rsis = rsis.filter(recordid__lt=obj.id).order_by('-recordid')
-    next_rsis = rsis.filter(recordid__gt=obj.id).order_by('recordid')
+    # Find the position of the item which points to the resource 'obj'.
+    position = index.position(obj.id)
+    if position is None:
+        return None
+    i, prev_id, next_id = position
 
     # Build URIs for the previous and the next recordsetitem, if present.
-    try:
-        prev = uri_for_model(obj.__class__, prev_rsis[0].recordid)
-    except IndexError:
-        prev = None
-
-    try:
-        next = uri_for_model(obj.__class__, next_rsis[0].recordid)
-    except IndexError:
-        next = None
-
     return {
-        'recordsetid': rsi.recordset_id,
-        'total_count': rsis.count(),
-        'index': prev_rsis.count(),
-        'previous': prev,
-        'next': next
+        'recordsetid': int(recordsetid),
+        'total_count': len(index.ids),
+        'index': i,
+        'previous': None if prev_id is None else uri_for_model(obj.__class__, prev_id),
+        'next': None if next_id is None else uri_for_model(obj.__class__, next_id),
         }
 
 @transaction.atomic
@@ -263,24 +441,29 @@ def post_resource(collection, agent, name, data, recordsetid=None):
     data - a dict of the data for the resource to be created.
     recordsetid - created resource will be added to the given recordset (optional)
     """
+    [(__, data)] = resolve_fk_uris([(name, data)])
     obj = create_obj(collection, agent, name, data)
 
     if recordsetid is not None:
         # add the resource to the record set
-        try:
-            recordset = models.Recordset.objects.get(id=recordsetid)
-        except models.Recordset.DoesNotExist as e:
-            raise RecordSetException(e)
-
-        if recordset.dbtableid != obj.specify_model.tableId:
-            # the resource is not of the right kind to go in the recordset
-            raise RecordSetException(
-                "expected %s, got %s when adding object to recordset",
-                (models.models_by_tableid[recordset.dbtableid], obj.__class__))
-
+        recordset = get_recordset(recordsetid)
+        check_recordset_table(recordset, obj)
         recordset.recordsetitems.create(recordid=obj.id)
     return obj
 
+def get_recordset(recordsetid):
+    try:
+        return models.Recordset.objects.get(id=recordsetid)
+    except models.Recordset.DoesNotExist as e:
+        raise RecordSetException(e)
+
+def check_recordset_table(recordset, obj):
+    if recordset.dbtableid != obj.specify_model.tableId:
+        # the resource is not of the right kind to go in the recordset
+        raise RecordSetException(
+            "expected %s, got %s when adding object to recordset",
+            (models.models_by_tableid[recordset.dbtableid], obj.__class__))
+
 def set_field_if_exists(obj, field, value):
     """Where 'obj' is a Django model instance, a resource object, check
     if a field named 'field' exists and set it to 'value' if so. Do nothing otherwise.
@@ -426,6 +609,73 @@ def reorder_fields_for_embedding(cls, data):
         yield (key, data[key])
 
 
+def resolve_fk_uris(items):
+    """Where 'items' is a list of (model, data) pairs, return a copy of
+    it in which the URIs of independent related objects in each 'data'
+    dict, and in the data of the dependent resources nested in it, are
+    replaced with the objects themselves, fetching them with one query
+    per related model instead of one per reference. The given data is
+    left unchanged.
+
+    URIs that cannot be resolved are left in place so that
+    handle_fk_fields reports them when the data is saved.
+    """
+    items = [(model, deepcopy(data)) for model, data in items]
+    refs = defaultdict(list)
+    for model, data in (resource for item in items for resource in nested_resources(*item)):
+        for field_name, val in data.items():
+            if not isinstance(val, str):
+                continue
+            try:
+                field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if not field.many_to_one or (model.__name__, field_name) in EMBEDDABLE_FIELDS:
+                continue
+            spfield = model.specify_model.get_field(field_name)
+            if spfield is None or spfield.dependent:
+                continue
+            uri = parse_uri(val)
+            if uri is None or uri[1] is None or uri[0] != field.related_model.__name__.lower():
+                continue
+            refs[field.related_model].append((data, field_name, int(uri[1])))
+
+    for related_model, model_refs in refs.items():
+        related_objs = related_model.objects.in_bulk({id for __, __, id in model_refs})
+        for data, field_name, id in model_refs:
+            if id in related_objs:
+                data[field_name] = related_objs[id]
+
+    return items
+
+def nested_resources(model, data):
+    """Yield (model, data) pairs for the resource data 'data' of 'model'
+    and for the resources nested in it.
+    """
+    if isinstance(model, str):
+        try:
+            model = get_model_or_404(model)
+        except Http404:
+            return
+    if not hasattr(data, 'items'):
+        return
+
+    yield model, data
+    for field_name, val in data.items():
+        if not isinstance(val, (dict, list)):
+            continue
+        try:
+            field = model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            continue
+        if not field.is_relation:
+            continue
+        if isinstance(val, dict) and (field.many_to_one or field.one_to_one):
+            yield from nested_resources(field.related_model, val)
+        elif isinstance(val, list) and field.one_to_many:
+            for rel_data in val:
+                yield from nested_resources(field.related_model, rel_data)
+
 def handle_fk_fields(collection, agent, obj, data, checkchanges = False):
     """Where 'obj' is a Django model instance and 'data' is a dict,
     set foreign key fields in the object from the provided data.
@@ -565,6 +815,7 @@ def delete_obj(agent, obj, version=None, parent_obj=None):
       
 @transaction.atomic
 def put_resource(collection, agent, name, id, version, data):
+    [(__, data)] = resolve_fk_uris([(name, data)])
     return update_obj(collection, agent, name, id, version, data)
 
 def update_obj(collection, agent, name, id, version, data, parent_obj=None):
@@ -632,36 +883,42 @@ def parse_uri(uri):
         groups = match.groups()
         return (groups[0], groups[2])
 
-def obj_to_data(obj):
+def obj_to_data(obj, fields=None, inline=None):
     """Return a (potentially nested) dictionary of the fields of the
     Django model instance 'obj'.
+
+    If 'fields' is given, only those fields are included. If 'inline'
+    is given, only the dependent objects along those dotted
+    relationship paths are nested, and the other dependents are
+    represented by URIs like independent ones.
     """
-    # Get regular and *-to-one fields.
-    fields = obj._meta.get_fields()
-    if isinstance(obj, models.Specifyuser):
-        # block out password field from users table
-        fields = [f for f in fields if f.name != 'password']
+    data = get_serializer(obj.__class__, fields, inline).serialize(obj)
+    add_special_fields(obj, data, fields)
+    return data
 
-    data = dict((field.name, field_to_val(obj, field))
-                for field in fields
-                if not (field.auto_created or field.one_to_many or field.many_to_many))
-    # Get *-to-many fields.
-    data.update(dict((ro.get_accessor_name(), to_many_to_data(obj, ro))
-                     for ro in obj._meta.get_fields()
-                     if ro.one_to_many))
-    # Add a meta data field with the resource's URI.
-    data['resource_uri'] = uri_for_model(obj.__class__.__name__.lower(), obj.id)
-    # Special cases
+# Computed fields which cost queries of their own and are only
+# included in sparse fieldsets if they are asked for.
+OPTIONAL_SPECIAL_FIELDS = frozenset(('isonloan', 'isadmin'))
+
+def add_special_fields(obj, data, fields=None):
+    """Add the computed fields some resources carry in addition to
+    their model fields to the serialized 'data' of 'obj'. The fields
+    computed from nested data are only added if it is present.
+    """
     if isinstance(obj, models.Preparation):
-        data['isonloan'] = obj.isonloan()
+        if fields is None or 'isonloan' in fields:
+            data['isonloan'] = obj.isonloan()
     elif isinstance(obj, models.Specifyuser):
-        data['isadmin'] = obj.is_admin()
+        if fields is None or 'isadmin' in fields:
+            data['isadmin'] = obj.is_admin()
     elif isinstance(obj, models.Collectionobject):
-        dets = data['determinations']
-        currDets = [det['resource_uri'] for det in dets if det['iscurrent']] if dets is not None else []
+        dets = data.get('determinations')
+        if not isinstance(dets, list): return
+        currDets = [det['resource_uri'] for det in dets if det['iscurrent']]
         data['currentdetermination'] = currDets[0] if len(currDets) > 0 else None;
     elif isinstance(obj, models.Loan):
-        preps = data['loanpreparations']
+        preps = data.get('loanpreparations')
+        if not isinstance(preps, list): return
         items = 0
         quantities = 0
         unresolvedItems = 0
@@ -680,40 +937,174 @@ def obj_to_data(obj):
         data['unresolvedItems'] = unresolvedQuantities
         data['resolvedPreps'] = items - unresolvedItems
         data['resolvedItems'] = quantities - unresolvedQuantities
-    return data
 
-def to_many_to_data(obj, rel):
-    """Return the URI or nested data of the 'rel' collection
-    depending on if the field is included in the 'inlined_fields' global.
+# *-to-one fields which is_dependent_field() may find to be dependent
+# depending on the collection or discipline of the particular object.
+EMBEDDABLE_FIELDS = {
+    ('Collectionobject', 'collectingevent'),
+    ('Collectionobject', 'paleocontext'),
+    ('Collectingevent', 'paleocontext'),
+    ('Locality', 'paleocontext'),
+}
+
+class ModelSerializer(object):
+    """The fields of a Django model resolved once into the accessors
+    obj_to_data applies to each instance.
+
+    Walking _meta.get_fields() and consulting the datamodel for every
+    field of every object dominates the cost of serializing large
+    result sets, so it is done here once per model and the results
+    are kept as a list of (key, accessor) pairs.
     """
-    parent_model = rel.model.specify_model
-    field_name = rel.get_accessor_name()
-    field = parent_model.get_field(field_name)
-    if field is not None and field.dependent:
-        objs = getattr(obj, field_name)
-        return [obj_to_data(o) for o in objs.all()]
-
-    collection_uri = uri_for_model(rel.related_model)
-    return collection_uri + '?' + urlencode([(rel.field.name.lower(), str(obj.id))])
-
-def field_to_val(obj, field):
-    """Return the value or nested data or URI for the given field which should
-    be either a regular field or a *-to-one field.
-    """
-    if field.many_to_one or (field.one_to_one and not field.auto_created):
-        if is_dependent_field(obj, field.name):
-            related_obj = getattr(obj, field.name)
-            if related_obj is None: return None
-            return obj_to_data(related_obj)
-        related_id = getattr(obj, field.name + '_id')
+    def __init__(self, model, fields=None, inline=None):
+        self.model = model
+        self.uri_prefix = uri_for_model(model)
+        accessors = [
+            (name, accessor)
+            for name, accessor in (
+                field_accessor(model, field, inline)
+                for field in model._meta.get_fields()
+                if not (field.auto_created or field.one_to_many or field.many_to_many))
+            # block out password field from users table
+            if not (model is models.Specifyuser and name == 'password')
+        ] + [
+            to_many_accessor(model, ro, inline)
+            for ro in model._meta.get_fields()
+            if ro.one_to_many
+        ]
+        if fields is not None:
+            wanted = fields | inline_names(inline or ()) | {'id'}
+            accessors = [(name, accessor) for name, accessor in accessors if name in wanted]
+        self.accessors = accessors
+
+    def serialize(self, obj):
+        """Return the dictionary of the model fields of 'obj' along
+        with its resource URI.
+        """
+        data = {name: accessor(obj) for name, accessor in self.accessors}
+        # Add a meta data field with the resource's URI.
+        data['resource_uri'] = self.uri_prefix + '%d/' % obj.id
+        return data
+
+def field_accessor(model, field, inline_paths=None):
+    """Return the key and a function computing the value or nested
+    data or URI for the given field which should be either a regular
+    field or a *-to-one field.
+    """
+    name = field.name
+    if not (field.many_to_one or (field.one_to_one and not field.auto_created)):
+        return name, attrgetter(name)
+
+    subtree = None if inline_paths is None else inline_subtree(inline_paths, name)
+
+    def inline(obj):
+        related_obj = getattr(obj, name)
+        if related_obj is None: return None
+        return obj_to_data(related_obj, inline=subtree)
+
+    attname = field.attname
+    uri_prefix = uri_for_model(field.related_model)
+
+    def uri(obj):
+        related_id = getattr(obj, attname)
         if related_id is None: return None
-        return uri_for_model(field.related_model, related_id)
-    else:
-        return getattr(obj, field.name)
+        return uri_prefix + '%d/' % int(related_id)
+
+    if inline_paths is not None and name not in inline_names(inline_paths):
+        return name, uri
+
+    spfield = model.specify_model.get_field(name)
+    if spfield is not None and spfield.dependent:
+        return name, inline
+
+    if (model.__name__, name) in EMBEDDABLE_FIELDS:
+        def embeddable(obj):
+            return inline(obj) if is_dependent_field(obj, name) else uri(obj)
+        return name, embeddable
+
+    return name, uri
+
+def to_many_accessor(model, rel, inline_paths=None):
+    """Return the key and a function computing the URI or nested data
+    of the 'rel' collection depending on whether the field is dependent
+    and is to be inlined.
+    """
+    field_name = rel.get_accessor_name()
+    field = model.specify_model.get_field(field_name)
+    if field is not None and field.dependent and (
+            inline_paths is None or field_name in inline_names(inline_paths)):
+        subtree = None if inline_paths is None else inline_subtree(inline_paths, field_name)
+        def inline(obj):
+            return [obj_to_data(o, inline=subtree) for o in getattr(obj, field_name).all()]
+        return field_name, inline
+
+    collection_uri = uri_for_model(rel.related_model) + '?' + rel.field.name.lower() + '='
+    def uri(obj):
+        return collection_uri + str(obj.id)
+    return field_name, uri
+
+@lru_cache(maxsize=1024)
+def get_serializer(model, fields=None, inline=None):
+    """Return the cached ModelSerializer for the Django model 'model'."""
+    return ModelSerializer(model, fields, inline)
 
 def get_collection(logged_in_collection, model, control_params=GetCollectionForm.defaults, params={}):
     """Return a list of structured data for the objects from 'model'
     subject to the request 'params'."""
+    objs = filter_collection(logged_in_collection, model, control_params, params)
+    fields, inline = normalize_field_spec(objs.model, control_params['fields'], control_params['inline'])
+    if control_params['cursor'] is not None:
+        try:
+            return objs_to_data_by_cursor(objs, control_params['cursor'], control_params['orderby'],
+                                          control_params['limit'], control_params['count'], fields, inline)
+        except FieldError as e:
+            raise OrderByError(e)
+    if control_params['orderby']:
+        try:
+            objs = objs.order_by(control_params['orderby'])
+        except FieldError as e:
+            raise OrderByError(e)
+    try:
+        return objs_to_data(objs, control_params['offset'], control_params['limit'], control_params['count'],
+                            fields, inline)
+    except FieldError as e:
+        raise OrderByError(e)
+
+def stream_collection(logged_in_collection, model, control_params, params={}):
+    """Return a StreamingHttpResponse of the structured data for the
+    objects from 'model' subject to the request 'params'.
+
+    The objects are encoded as they are read from the database, so
+    memory use does not grow with the size of the collection.
+    """
+    objs = filter_collection(logged_in_collection, model, control_params, params)
+    fields, inline = normalize_field_spec(objs.model, control_params['fields'], control_params['inline'])
+    try:
+        if control_params['orderby']:
+            objs = objs.order_by(control_params['orderby'])
+        # Compile the query now so a bad orderby is reported
+        # before the response starts.
+        objs.values('id').query.sql_with_params()
+    except FieldError as e:
+        raise OrderByError(e)
+
+    offset, limit = control_params['offset'], control_params['limit']
+    if control_params['stream'] == 'json':
+        meta = {'limit': limit,
+                'offset': offset,
+                'total_count': count_objs(objs, control_params['count'])}
+        head, tail = '{"meta": %s, "objects": [' % toJson(meta), ']}'
+    else:
+        # Newline delimited JSON has no place for the meta data.
+        head, tail = None, None
+
+    objs = objs[offset:] if limit == 0 else objs[offset:offset + limit]
+    items = (obj_to_data(o, fields, inline) for o in stream_objects(objs, fields, inline))
+    return streaming_response(items, control_params['stream'], JsonEncoder(), head, tail)
+
+def filter_collection(logged_in_collection, model, control_params=GetCollectionForm.defaults, params={}):
+    """Return the queryset of the objects from 'model' subject to
+    the request 'params'."""
     if isinstance(model, str):
         model = get_model_or_404(model)
 
@@ -735,32 +1126,297 @@ def get_collection(logged_in_collection, model, control_params=GetCollectionForm
         raise FilterError(e)
     if control_params['domainfilter'] == 'true':
         objs = filter_by_collection(objs, logged_in_collection)
-    if control_params['orderby']:
-        try:
-            objs = objs.order_by(control_params['orderby'])
-        except FieldError as e:
-            raise OrderByError(e)
-    try:
-        return objs_to_data(objs, control_params['offset'], control_params['limit'])
-    except FieldError as e:
-        raise OrderByError(e)
+    return objs
 
-def objs_to_data(objs, offset=0, limit=20):
+def objs_to_data(objs, offset=0, limit=20, count='exact', fields=None, inline=None):
     """Return a collection structure with a list of the data of given objects
     and collection meta data.
     """
-    total_count = objs.count()
+    total_count = count_objs(objs, count)
 
+    objs = prefetch_for_serialization(objs, fields, inline)
     if limit == 0:
         objs = objs[offset:]
     else:
         objs = objs[offset:offset + limit]
 
-    return {'objects': [obj_to_data(o) for o in objs],
+    return {'objects': [obj_to_data(o, fields, inline) for o in objs],
             'meta': {'limit': limit,
                      'offset': offset,
                      'total_count': total_count}}
 
+class Cursor(namedtuple('Cursor', 'orderby value id')):
+    """Position in a collection ordered by 'orderby' and then id: the
+    orderby value and id of the last item of the previous page.
+    """
+    __slots__ = ()
+
+    FIRST_PAGE = ()
+
+def encode_cursor(orderby, value, id):
+    return urlsafe_b64encode(toJson([orderby, value, id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Return the Cursor encoded in the string 'cursor', or
+    Cursor.FIRST_PAGE if it is empty. Raises ValueError if it is
+    malformed.
+    """
+    if cursor == '':
+        return Cursor.FIRST_PAGE
+    try:
+        orderby, value, id = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(e)
+    if not isinstance(id, int) or not (orderby is None or isinstance(orderby, str)):
+        raise ValueError("malformed cursor")
+    return Cursor(orderby, value, id)
+
+def objs_to_data_by_cursor(objs, cursor, orderby=None, limit=20, count='exact', fields=None, inline=None):
+    """Return a collection structure with a page of the data of the
+    given objects following 'cursor' in the order of 'orderby' and id.
+
+    Unlike offset paging, the cost of a page does not grow with its
+    depth because the database seeks directly to the position the
+    cursor records. The meta data carries the cursor for the next
+    page, or null if this is the last one.
+    """
+    total_count = count_objs(objs, count)
+
+    if orderby:
+        descending = orderby.startswith('-')
+        key = orderby.lstrip('-')
+        objs = objs.annotate(_cursor_key=F(key)).order_by(orderby, '-id' if descending else 'id')
+    else:
+        descending = False
+        objs = objs.order_by('id')
+
+    if cursor:
+        objs = objs.filter(keyset_filter(key if orderby else None, descending, cursor.value, cursor.id))
+
+    objs = prefetch_for_serialization(objs, fields, inline)
+    objs = list(objs) if limit == 0 else list(objs[:limit + 1])
+
+    if limit != 0 and len(objs) > limit:
+        objs = objs[:limit]
+        last = objs[-1]
+        next_cursor = encode_cursor(orderby or None, last._cursor_key if orderby else None, last.id)
+    else:
+        next_cursor = None
+
+    return {'objects': [obj_to_data(o, fields, inline) for o in objs],
+            'meta': {'limit': limit,
+                     'next': next_cursor,
+                     'total_count': total_count}}
+
+def keyset_filter(key, descending, value, id):
+    """Return a Q object selecting the rows which follow the one with
+    the given 'value' of 'key' and 'id' when ordered by 'key' and id.
+
+    MySQL sorts nulls before everything else, so they come first in
+    ascending order and last in descending order.
+    """
+    if key is None:
+        return Q(id__lt=id) if descending else Q(id__gt=id)
+
+    is_null = Q(**{key + '__isnull': True})
+    if descending:
+        if value is None:
+            return is_null & Q(id__lt=id)
+        return (Q(**{key + '__lt': value})
+                | Q(**{key: value}) & Q(id__lt=id)
+                | is_null)
+    else:
+        if value is None:
+            return is_null & Q(id__gt=id) | ~is_null
+        return (Q(**{key + '__gt': value})
+                | Q(**{key: value}) & Q(id__gt=id))
+
+def count_objs(objs, count='exact'):
+    """Return the number of objects in the queryset 'objs' according
+    to the 'count' control parameter: exactly, estimated, or None.
+    """
+    if count == 'none':
+        return None
+    if count == 'estimate':
+        return estimate_count(objs)
+    return objs.count()
+
+def estimate_count(objs):
+    """Return the database's estimate of the number of rows in the
+    queryset 'objs', which is far cheaper than counting large tables.
+
+    An unfiltered table's size comes from the row count in the table
+    statistics. Otherwise the optimizer's estimate for the query is
+    read from EXPLAIN when the plan reads only the model's table.
+    Falls back to an exact count for queries that join other tables
+    and on databases other than MySQL.
+    """
+    if connection.vendor != 'mysql':
+        return objs.count()
+
+    with connection.cursor() as cursor:
+        if not objs.query.where:
+            cursor.execute(
+                "select table_rows from information_schema.tables "
+                "where table_schema = database() and table_name = %s",
+                [objs.model._meta.db_table])
+            row = cursor.fetchone()
+            return None if row is None else int(row[0])
+
+        sql, params = objs.values('id').query.sql_with_params()
+        cursor.execute("explain " + sql, params)
+        columns = [col[0].lower() for col in cursor.description]
+        plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # The plan has a row per table read. A single row for the model's own
+    # table estimates the number of results; with joins or subqueries no
+    # one row does, so count instead.
+    if len(plan) != 1 or plan[0].get('table') != objs.model._meta.db_table:
+        return objs.count()
+    row, = plan
+    filtered = row.get('filtered')
+    rows = row['rows'] or 0
+    return int(rows * (100 if filtered is None else float(filtered)) / 100)
+
+# is_dependent_field() looks up these domain objects to decide whether
+# collecting events and paleo contexts are embedded. Joining them up
+# front keeps that check from costing a query per object.
+EMBEDDING_DOMAINS = {
+    'Collectionobject': 'collection__discipline',
+    'Collectingevent': 'discipline',
+    'Locality': 'discipline',
+}
+
+@lru_cache(maxsize=1024)
+def serialization_plan(model, inline=None):
+    """Return a pair of lists of select_related and prefetch_related
+    lookups which load everything obj_to_data inlines for instances
+    of the Django model 'model', limited to the relationship paths
+    in 'inline' if it is given.
+
+    Dependent *-to-one fields reachable from the root through other
+    *-to-one fields are joined. Dependent *-to-many fields and
+    everything below them are prefetched, costing one query per
+    relationship regardless of the number of objects.
+    """
+    select, prefetch = [], []
+
+    def plan(model, inline, prefix, joinable, path_models):
+        names = None if inline is None else inline_names(inline)
+        if joinable and model.__name__ in EMBEDDING_DOMAINS and (
+                names is None or any((model.__name__, name) in EMBEDDABLE_FIELDS for name in names)):
+            select.append(prefix + EMBEDDING_DOMAINS[model.__name__])
+
+        for field in model._meta.get_fields():
+            if field.one_to_many:
+                name = field.get_accessor_name()
+            elif field.many_to_one or (field.one_to_one and not field.auto_created):
+                name = field.name
+            else:
+                continue
+
+            if names is not None and name not in names:
+                continue
+
+            spfield = model.specify_model.get_field(name)
+            if spfield is None or not spfield.dependent:
+                continue
+
+            related_model = field.related_model
+            if related_model in path_models:
+                # Don't chase cycles in the dependency graph.
+                continue
+
+            lookup = prefix + name
+            subtree = None if inline is None else inline_subtree(inline, name)
+            if field.one_to_many or not joinable:
+                prefetch.append(lookup)
+                plan(related_model, subtree, lookup + '__', False, path_models | {related_model})
+            else:
+                select.append(lookup)
+                plan(related_model, subtree, lookup + '__', True, path_models | {related_model})
+
+    plan(model, inline, '', True, {model})
+    logger.debug("serialization plan for %s inlining %s: select %s, prefetch %s",
+                 model.__name__, inline, select, prefetch)
+    return select, prefetch
+
+def prefetch_for_serialization(objs, fields=None, inline=None):
+    """Return the queryset 'objs' augmented to load the dependent
+    objects obj_to_data will inline in a fixed number of queries.
+
+    If 'fields' is given, only the columns obj_to_data will need
+    to serialize those fields are selected.
+    """
+    select, prefetch = serialization_plan(objs.model, inline)
+    if fields is not None:
+        objs = objs.only(*selected_columns(objs.model, fields, inline, select))
+    if select:
+        # select_related() with no arguments follows every
+        # foreign key, so only call it with a nonempty plan.
+        objs = objs.select_related(*select)
+    if prefetch:
+        objs = objs.prefetch_related(*prefetch)
+    return objs
+
+def selected_columns(model, fields, inline, select):
+    """Return the names of the concrete fields of 'model' needed to
+    serialize 'fields' and 'inline' and to join the 'select' lookups.
+    """
+    names = set(fields) | inline_names(inline or ()) | {'id'}
+    names.update(lookup.split('__', 1)[0] for lookup in select)
+    columns = []
+    for name in names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete:
+            columns.append(name)
+    return columns
+
+def inline_names(inline):
+    """Return the names of the relationships at the top level of the
+    set of dotted relationship paths 'inline'.
+    """
+    return frozenset(path.split('.', 1)[0] for path in inline)
+
+def inline_subtree(inline, name):
+    """Return the paths in 'inline' below the relationship 'name'."""
+    prefix = name + '.'
+    return frozenset(path[len(prefix):] for path in inline if path.startswith(prefix))
+
+def parse_field_list(value):
+    """Parse the value of a 'fields' or 'inline' parameter, where None
+    means the parameter is absent.
+    """
+    return None if value is None else frozenset(name for name in value.split(',') if name)
+
+def normalize_field_spec(model, fields=None, inline=None):
+    """Return 'fields' and 'inline' for the Django model 'model' with the
+    names it doesn't have dropped.
+    """
+    if inline is not None:
+        inline = frozenset(path for path in inline if inline_path_exists(model, path.split('.')))
+    if fields is not None:
+        names = {name for name, accessor in get_serializer(model).accessors}
+        fields = frozenset(fields & (names | OPTIONAL_SPECIAL_FIELDS))
+    return fields, inline
+
+def inline_path_exists(model, names):
+    for name in names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if not field.is_relation or field.many_to_many:
+            return False
+        spfield = model.specify_model.get_field(name)
+        if not ((spfield is not None and spfield.dependent) or (model.__name__, name) in EMBEDDABLE_FIELDS):
+            return False
+        model = field.related_model
+    return True
+
 def uri_for_model(model, id=None):
     """Given a Django model and optionally an id, return a URI
     for the collection or resource (if an id is given).
@@ -776,6 +1432,7 @@ class RowsForm(forms.Form):
     fields = forms.CharField(required=True)
     distinct = forms.CharField(required=False)
     limit = forms.IntegerField(required=False)
+    stream = forms.ChoiceField(choices=STREAM_FORMATS, required=False)
 
 def rows(request, model_name):
     form = RowsForm(request.GET)
@@ -797,5 +1454,7 @@ def rows(request, model_name):
     limit = form.cleaned_data['limit']
     if limit:
         query = query[:limit]
+    if form.cleaned_data['stream']:
+        return streaming_response(stream_rows(query), form.cleaned_data['stream'], JsonEncoder())
     data = list(query)
     return HttpResponse(toJson(data), content_type='application/json')
@@ -1,10 +1,12 @@
+import json
 from unittest import skip
 
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from django.db.models import Max
 from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from specifyweb.specify import api, models
+from specifyweb.specify import api, bulk, models, streaming
 
 class MainSetupTearDown:
     def setUp(self):
@@ -197,6 +199,38 @@ class RecordSetTests(ApiTests):
             self.assertEqual(info['next'], None if i == len(self.collectionobjects) - 1 else \
                                  api.uri_for_model('collectionobject', self.collectionobjects[i+1].id))
 
+    def test_recordset_index_invalidation(self):
+        for co in self.collectionobjects[:3]:
+            self.recordset.recordsetitems.create(recordid=co.id)
+        co = self.collectionobjects[2]
+        self.assertEqual(api.get_recordset_info(co, self.recordset.id)['total_count'], 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            info = api.get_recordset_info(co, self.recordset.id)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(info['index'], 2)
+
+        self.recordset.recordsetitems.create(recordid=self.collectionobjects[3].id)
+        info = api.get_recordset_info(co, self.recordset.id)
+        self.assertEqual(info['total_count'], 4)
+        self.assertEqual(info['next'], api.uri_for_model('collectionobject', self.collectionobjects[3].id))
+
+        self.recordset.recordsetitems.filter(recordid=self.collectionobjects[1].id).delete()
+        info = api.get_recordset_info(co, self.recordset.id)
+        self.assertEqual(info['index'], 1)
+        self.assertEqual(info['previous'], api.uri_for_model('collectionobject', self.collectionobjects[0].id))
+
+        # Repoints that leave the count, highest item id and sum of the
+        # record ids unchanged.
+        items = {item.recordid: item for item in self.recordset.recordsetitems.all()}
+        for old, new in ((0, 1), (3, 2)):
+            item = items[self.collectionobjects[old].id]
+            item.recordid = self.collectionobjects[new].id
+            item.save()
+        self.assertEqual(api.get_recordset_info(self.collectionobjects[0], self.recordset.id), None)
+        info = api.get_recordset_info(self.collectionobjects[1], self.recordset.id)
+        self.assertEqual(info['index'], 0)
+
     def test_no_recordset_info(self):
         info = api.get_recordset_info(self.collectionobjects[0], self.recordset.id)
         self.assertEqual(info, None)
@@ -231,6 +265,329 @@ class RecordSetTests(ApiTests):
         with self.assertRaises(models.Recordset.DoesNotExist) as cm:
             recordset = models.Recordset.objects.get(id=self.recordset.id)
 
+class SerializationPlanTests(ApiTests):
+    def test_plan_follows_dependent_fields(self):
+        select, prefetch = api.serialization_plan(models.Collectionobject)
+        self.assertIn('collectionobjectattribute', select)
+        self.assertIn('collection__discipline', select)
+        self.assertIn('determinations', prefetch)
+        self.assertIn('preparations', prefetch)
+        self.assertIn('preparations__preparationattachments', prefetch)
+        self.assertNotIn('cataloger', select + prefetch)
+
+    def test_collection_query_count_independent_of_rows(self):
+        for co in self.collectionobjects:
+            for i in range(2):
+                co.determinations.create(iscurrent=False, number1=i)
+
+        def count_queries(limit):
+            with CaptureQueriesContext(connection) as queries:
+                data = api.objs_to_data(models.Collectionobject.objects.all(), limit=limit)
+            self.assertEqual(len(data['objects']), limit)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(len(self.collectionobjects)))
+
+    def test_cached_serializer_matches_field_walk(self):
+        from .management.commands.benchmark_serialization import walk_obj_to_data
+        self.collectionobjects[0].determinations.create(iscurrent=True)
+        for obj in [self.collectionobjects[0], self.collectingevent, self.collection, self.specifyuser]:
+            self.assertEqual(api.obj_to_data(obj), walk_obj_to_data(obj))
+
+    def test_cached_serializer_embedded_collecting_event(self):
+        co = self.collectionobjects[0]
+        co.collectingevent = self.collectingevent
+        co.save()
+        self.assertEqual(api.obj_to_data(co)['collectingevent'],
+                         api.uri_for_model('collectingevent', self.collectingevent.id))
+
+        self.collection.isembeddedcollectingevent = True
+        self.collection.save()
+        co = models.Collectionobject.objects.get(id=co.id)
+        self.assertEqual(api.obj_to_data(co)['collectingevent']['id'], self.collectingevent.id)
+
+class CursorPaginationTests(ApiTests):
+    def get_pages(self, params):
+        ids, cursor = [], ''
+        while cursor is not None:
+            form = api.GetCollectionForm(dict(params, cursor=cursor, limit='2'))
+            self.assertTrue(form.is_valid(), form.errors)
+            data = api.get_collection(self.collection, 'collectionobject', form.cleaned_data, {})
+            self.assertLessEqual(len(data['objects']), 2)
+            ids.extend(obj['id'] for obj in data['objects'])
+            cursor = data['meta']['next']
+        return ids
+
+    def test_pages_by_id(self):
+        self.assertEqual(self.get_pages({}), sorted(co.id for co in self.collectionobjects))
+
+    def test_pages_by_orderby(self):
+        self.collectionobjects[3].catalognumber = None
+        self.collectionobjects[3].save()
+        expected = list(models.Collectionobject.objects.order_by('-catalognumber', '-id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages({'orderby': '-catalognumber'}), expected)
+        expected = list(models.Collectionobject.objects.order_by('catalognumber', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages({'orderby': 'catalognumber'}), expected)
+
+    def test_cursor_must_match_orderby(self):
+        cursor = api.encode_cursor('catalognumber', 'num-1', self.collectionobjects[1].id)
+        self.assertFalse(api.GetCollectionForm({'cursor': cursor, 'orderby': 'id'}).is_valid())
+        self.assertFalse(api.GetCollectionForm({'cursor': 'garbage'}).is_valid())
+
+    def test_skip_count(self):
+        form = api.GetCollectionForm({'count': 'none'})
+        self.assertTrue(form.is_valid())
+        data = api.get_collection(self.collection, 'collectionobject', form.cleaned_data, {})
+        self.assertEqual(data['meta']['total_count'], None)
+        self.assertEqual(len(data['objects']), len(self.collectionobjects))
+
+    def test_estimate_count_with_join(self):
+        # A filter through a relation joins another table, so no single
+        # row of the plan estimates the result and the count is exact.
+        objs = models.Collectionobject.objects.filter(collection__discipline=self.discipline)
+        self.assertEqual(api.estimate_count(objs), len(self.collectionobjects))
+
+class StreamingEncodeTests(TestCase):
+    def test_json_array(self):
+        items = [{'a': 1}, {'b': [1, 2]}, None]
+        encoded = ''.join(streaming.encode_json_array(iter(items), api.JsonEncoder()))
+        self.assertEqual(json.loads(encoded), items)
+        self.assertEqual(''.join(streaming.encode_json_array(iter([]), api.JsonEncoder())), '[]')
+
+    def test_json_array_embedded(self):
+        encoded = ''.join(streaming.encode_json_array(iter([1, 2]), api.JsonEncoder(), '{"objects": [', ']}'))
+        self.assertEqual(json.loads(encoded), {'objects': [1, 2]})
+
+    def test_ndjson(self):
+        items = [{'a': 1}, {'b': 'x\ny'}]
+        lines = ''.join(streaming.encode_ndjson(iter(items), api.JsonEncoder())).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], items)
+
+class StreamingViewTests(ApiTests):
+    def request(self, path, **params):
+        request = RequestFactory().get(path, params)
+        request.specify_collection = self.collection
+        return request
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_stream_collection_json(self):
+        response = api.collection_dispatch(
+            self.request('/api/specify/collectionobject/', stream='json', limit=0, orderby='-catalognumber'),
+            'collectionobject')
+        data = json.loads(self.content(response))
+        self.assertEqual(data['meta']['total_count'], len(self.collectionobjects))
+        self.assertEqual([obj['catalognumber'] for obj in data['objects']],
+                         sorted((co.catalognumber for co in self.collectionobjects), reverse=True))
+
+    def test_stream_collection_ndjson(self):
+        response = api.collection_dispatch(
+            self.request('/api/specify/collectionobject/', stream='ndjson', limit=2, offset=1, orderby='id'),
+            'collectionobject')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        objects = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([obj['id'] for obj in objects], [co.id for co in self.collectionobjects[1:3]])
+
+    def test_stream_rows(self):
+        # The uncommitted records of the test are seen, as the rows are
+        # read on the test's own connection.
+        response = api.rows(self.request('/api/specify_rows/collectionobject/',
+                                         fields='catalognumber', stream='json'),
+                            'collectionobject')
+        self.assertEqual(json.loads(self.content(response)),
+                         [[co.catalognumber] for co in self.collectionobjects])
+
+    def test_stream_rows_empty(self):
+        rows = streaming.stream_rows(models.Collectionobject.objects.none().values_list('id'))
+        self.assertEqual(list(rows), [])
+
+class BulkApiTests(ApiTests):
+    def co_data(self, catalognumber, collection=None):
+        return {'collection': api.uri_for_model('collection', collection or self.collection.id),
+                'catalognumber': catalognumber}
+
+    def test_bulk_create_and_update(self):
+        co = self.collectionobjects[0]
+        update = api.get_resource('collectionobject', co.id)
+        update['catalognumber'] = 'updated'
+        result = bulk.bulk_save(self.collection, self.agent, [
+            ('collectionobject', self.co_data('bulk-1')),
+            ('collectionobject', self.co_data('bulk-2')),
+            ('collectionobject', update)])
+        self.assertTrue(result['committed'])
+        self.assertEqual([r['status'] for r in result['results']], [201, 201, 200])
+        self.assertEqual(models.Collectionobject.objects.filter(catalognumber__startswith='bulk-').count(), 2)
+        self.assertEqual(models.Collectionobject.objects.get(id=co.id).catalognumber, 'updated')
+
+    def test_bulk_item_errors(self):
+        bad_collection = models.Collection.objects.latest('id').id + 100
+        result = bulk.bulk_save(self.collection, self.agent, [
+            ('collectionobject', self.co_data('bulk-1')),
+            ('collectionobject', self.co_data('bulk-2', bad_collection))])
+        self.assertTrue(result['committed'])
+        self.assertEqual([r['status'] for r in result['results']], [201, 404])
+        self.assertEqual(models.Collectionobject.objects.filter(catalognumber__startswith='bulk-').count(), 1)
+
+    def test_bulk_programming_error(self):
+        # Inline data for an independent field is a bug in the client
+        # code, not a per-item error, so it aborts the whole batch.
+        bad = self.co_data('bulk-2')
+        bad['collection'] = {'collectionname': 'inline'}
+        with self.assertRaises(AssertionError):
+            bulk.bulk_save(self.collection, self.agent, [
+                ('collectionobject', self.co_data('bulk-1')),
+                ('collectionobject', bad)])
+        self.assertEqual(models.Collectionobject.objects.filter(catalognumber__startswith='bulk-').count(), 0)
+
+    def test_bulk_data_not_modified(self):
+        data = self.co_data('bulk-1')
+        bulk.bulk_save(self.collection, self.agent, [('collectionobject', data)])
+        self.assertEqual(data, self.co_data('bulk-1'))
+
+    def test_bulk_atomic(self):
+        bad_collection = models.Collection.objects.latest('id').id + 100
+        result = bulk.bulk_save(self.collection, self.agent, [
+            ('collectionobject', self.co_data('bulk-1')),
+            ('collectionobject', self.co_data('bulk-2', bad_collection))], atomic=True)
+        self.assertFalse(result['committed'])
+        self.assertEqual(models.Collectionobject.objects.filter(catalognumber__startswith='bulk-').count(), 0)
+
+    def test_bulk_recordset(self):
+        recordset = models.Recordset.objects.create(
+            collectionmemberid=self.collection.id,
+            dbtableid=models.Collectionobject.specify_model.tableId,
+            name="Test recordset",
+            type=0,
+            specifyuser=self.specifyuser)
+        result = bulk.bulk_save(self.collection, self.agent, [
+            ('collectionobject', self.co_data('bulk-%d' % i)) for i in range(3)], recordset.id)
+        ids = {r['data']['id'] for r in result['results']}
+        self.assertEqual(set(recordset.recordsetitems.values_list('recordid', flat=True)), ids)
+
+    def test_resolve_fk_uris(self):
+        items = [('collectionobject', self.co_data('bulk-%d' % i)) for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            resolved = api.resolve_fk_uris(items)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(all(data['collection'] == self.collection for __, data in resolved))
+        self.assertTrue(all(isinstance(data['collection'], str) for __, data in items))
+
+    def test_resolve_nested_fk_uris(self):
+        data = self.co_data('nested')
+        data['determinations'] = [
+            {'iscurrent': i == 0, 'determiner': api.uri_for_model('agent', self.agent.id)}
+            for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            [(__, resolved)] = api.resolve_fk_uris([('collectionobject', data)])
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(det['determiner'] == self.agent for det in resolved['determinations']))
+        self.assertTrue(all(isinstance(det['determiner'], str) for det in data['determinations']))
+
+        obj = api.post_resource(self.collection, self.agent, 'collectionobject', data)
+        self.assertEqual(obj.determinations.filter(determiner=self.agent).count(), 3)
+
+class ETagTests(ApiTests):
+    def get(self, id, model='collectionobject', **headers):
+        request = RequestFactory().get('/api/specify/%s/%d/' % (model, id), **headers)
+        return api.resource_dispatch(request, model, str(id))
+
+    def test_not_modified(self):
+        co = self.collectionobjects[0]
+        response = self.get(co.id)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(co.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Only the versions are read, nothing is serialized.
+        self.assertEqual(len(queries), 1)
+
+    def test_etag_follows_dependents(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co.id)['ETag']
+        self.assertEqual(etag, self.get(co.id)['ETag'])
+
+        co.determinations.create(iscurrent=True)
+        self.assertEqual(self.get(co.id, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_follows_business_rule_updates(self):
+        co = self.collectionobjects[0]
+        det = co.determinations.create(iscurrent=True)
+        etag = self.get(det.id, 'determination')['ETag']
+
+        # Making another determination current clears the flag on this
+        # one without bumping its version.
+        co.determinations.create(iscurrent=True)
+        response = self.get(det.id, 'determination', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(json.loads(response.content.decode())['iscurrent'])
+
+    def test_etag_follows_fields(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co.id)['ETag']
+        request = RequestFactory().get('/api/specify/collectionobject/%d/' % co.id,
+                                       {'fields': 'catalognumber'}, HTTP_IF_NONE_MATCH=etag)
+        response = api.resource_dispatch(request, 'collectionobject', str(co.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_strong_etag_compared_weakly(self):
+        co = self.collectionobjects[0]
+        etag = self.get(co.id)['ETag']
+        self.assertEqual(self.get(co.id, HTTP_IF_NONE_MATCH='W/' + etag).status_code, 304)
+
+    def test_no_etag_with_recordset(self):
+        co = self.collectionobjects[0]
+        recordset = models.Recordset.objects.create(
+            collectionmemberid=self.collection.id,
+            dbtableid=models.Collectionobject.specify_model.tableId,
+            name="Test recordset",
+            type=0,
+            specifyuser=self.specifyuser)
+        request = RequestFactory().get('/api/specify/collectionobject/%d/' % co.id,
+                                       {'recordsetid': recordset.id})
+        response = api.resource_dispatch(request, 'collectionobject', str(co.id))
+        self.assertFalse(response.has_header('ETag'))
+
+class SparseFieldsetTests(ApiTests):
+    def test_fields(self):
+        co = self.collectionobjects[0]
+        data = api.get_resource('collectionobject', co.id, fields=frozenset(['catalognumber', 'nosuchfield']))
+        self.assertEqual(set(data.keys()), {'id', 'catalognumber', 'resource_uri'})
+        self.assertEqual(data['catalognumber'], co.catalognumber)
+
+    def test_inline(self):
+        co = self.collectionobjects[0]
+        co.determinations.create(iscurrent=True)
+        data = api.get_resource('collectionobject', co.id, inline=frozenset())
+        self.assertEqual(data['determinations'],
+                         api.uri_for_model('determination') + '?collectionobject=%d' % co.id)
+        self.assertNotIn('currentdetermination', data)
+
+        data = api.get_resource('collectionobject', co.id, inline=frozenset(['determinations']))
+        self.assertEqual(len(data['determinations']), 1)
+        self.assertEqual(data['preparations'],
+                         api.uri_for_model('preparation') + '?collectionobject=%d' % co.id)
+        self.assertEqual(data['currentdetermination'], data['determinations'][0]['resource_uri'])
+
+    def test_collection(self):
+        form = api.GetCollectionForm({'fields': 'catalognumber', 'inline': 'determinations'})
+        self.assertTrue(form.is_valid(), form.errors)
+        data = api.get_collection(self.collection, 'collectionobject', form.cleaned_data, {})
+        self.assertEqual(len(data['objects']), len(self.collectionobjects))
+        for obj in data['objects']:
+            self.assertEqual(set(obj.keys()),
+                             {'id', 'catalognumber', 'determinations', 'currentdetermination', 'resource_uri'})
+
+    def test_plan_follows_inline(self):
+        select, prefetch = api.serialization_plan(models.Collectionobject, frozenset(['determinations']))
+        self.assertEqual(prefetch, ['determinations'])
+        self.assertEqual(select, [])
+
 class ApiRelatedFieldsTests(ApiTests):
     def test_get_to_many_uris_with_regular_othersidename(self):
         data = api.get_resource('collectingevent', self.collectingevent.id)
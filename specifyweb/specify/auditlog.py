@@ -1,4 +1,6 @@
+from contextlib import contextmanager
 from time import time
+import threading
 import logging
 logger = logging.getLogger(__name__)
 import re
@@ -20,6 +22,7 @@ class AuditLog(object):
     _auditing = None
     _lastCheck = None
     _checkInterval = 900
+    _batch = threading.local()
     
     def isAuditingFlds(self):
         return self.isAuditing() and self._auditingFlds
@@ -53,7 +56,35 @@ class AuditLog(object):
         return log_obj
         
     def insert(self, obj, agent, parent_record=None):
-        return self._log(auditcodes.INSERT, obj, agent, parent_record)
+        pending = getattr(self._batch, 'pending', None)
+        if pending is None:
+            return self._log(auditcodes.INSERT, obj, agent, parent_record)
+        log_obj = self._make_log(auditcodes.INSERT, obj, agent, parent_record)
+        if log_obj is not None:
+            pending.append(log_obj)
+        return log_obj
+
+    @contextmanager
+    def batched_inserts(self):
+        """Defer the insert log entries made by this thread in the block
+        and write them with a single statement at its end.
+
+        Yields the list of pending entries so callers can discard the
+        ones belonging to work that was rolled back.
+        """
+        if getattr(self._batch, 'pending', None) is not None:
+            # Already batching further up the stack.
+            yield self._batch.pending
+            return
+
+        pending = self._batch.pending = []
+        try:
+            yield pending
+        finally:
+            self._batch.pending = None
+        if pending:
+            logger.info("inserting %d entries into auditlog", len(pending))
+            Spauditlog.objects.bulk_create(pending)
 
     def remove(self, obj, agent, parent_record=None):
         log_obj = self._log(auditcodes.REMOVE, obj, agent, parent_record)
@@ -79,8 +110,14 @@ class AuditLog(object):
         return log_obj
         
     def _log(self, action, obj, agent, parent_record):
-        if self.isAuditing():
+        log_obj = self._make_log(action, obj, agent, parent_record)
+        if log_obj is not None:
             logger.info("inserting into auditlog: %s", [action, obj, agent, parent_record])
+            log_obj.save(force_insert=True)
+        return log_obj
+
+    def _make_log(self, action, obj, agent, parent_record):
+        if self.isAuditing():
             assert obj.id is not None, "attempt to add object with null id to audit log"
             parentId = parent_record and parent_record.id
             parentTbl = parent_record and parent_record.specify_model.tableId
@@ -91,7 +128,7 @@ class AuditLog(object):
                     parentId = scopeObj.id
                     parentTbl = scopeObj.specify_model.tableId
                 
-            return Spauditlog.objects.create(
+            return Spauditlog(
                 action=action,
                 parentrecordid=parentId,
                 parenttablenum=parentTbl,
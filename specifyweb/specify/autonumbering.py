@@ -2,28 +2,24 @@ import logging
 logger = logging.getLogger(__name__)
 
 from .lock_tables import lock_tables
-from .models import Splocalecontaineritem as Item
 from .models import Collectionobject
-from .uiformatters import get_uiformatter, AutonumberOverflowException
+from .uiformatters import get_registry, AutonumberOverflowException
 
 def autonumber_and_save(collection, user, obj):
-    filters = dict(container__discipline=collection.discipline,
-                   container__name=obj.__class__.__name__.lower(),
-                   format__isnull=False)
+    registry = get_registry(collection, user)
+    tablename = obj.__class__.__name__.lower()
 
-    formatter_names = list(
-        Item.objects
-        .filter(**filters)
-        .exclude(container__name='collectionobject', name='catalognumber')
-        .values_list('format', flat=True)
-    )
+    formatter_names = [
+        format for fieldname, format in registry.formats_for_table(tablename).items()
+        if (tablename, fieldname) != ('collectionobject', 'catalognumber')
+    ]
 
     if obj.__class__ is Collectionobject:
         formatter_names.append(collection.catalognumformatname)
 
     logger.debug("formatters for %s: %s", obj, formatter_names)
 
-    uiformatters = [get_uiformatter(collection, user, f) for f in formatter_names]
+    uiformatters = [registry.get(f) for f in formatter_names]
     logger.debug("uiformatters for %s: %s", obj, uiformatters)
 
     autonumber_fields = [(formatter, vals)
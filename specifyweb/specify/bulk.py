@@ -0,0 +1,131 @@
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from django import forms
+from django.db import transaction, IntegrityError, DataError
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotAllowed, Http404)
+
+from specifyweb.businessrules.exceptions import BusinessRuleException
+
+from . import api, models, recordset_index
+from .auditlog import auditlog
+
+# Exceptions that fail a single item of a batch, with the HTTP status
+# reported for it. Anything else aborts the whole batch.
+ITEM_ERRORS = (
+    (Http404, 404),
+    (api.StaleObjectException, 409),
+    (api.MissingVersionException, 400),
+    (api.RecordSetException, 400),
+    (BusinessRuleException, 400),
+    (IntegrityError, 400),
+    (DataError, 400),
+)
+
+ITEM_EXCEPTIONS = tuple(exc for exc, status in ITEM_ERRORS)
+
+class BulkForm(forms.Form):
+    # Roll back the whole batch if any item fails.
+    atomic = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false')),
+                               required=False)
+
+    # Created resources will be added to the given recordset.
+    recordsetid = forms.IntegerField(required=False)
+
+def bulk_dispatch(request, model=None):
+    """Handles requests to create or update many resources at once.
+
+    The request body is a JSON array of resources of 'model', or when
+    no model is given, of {"model": <name>, "data": <resource>} objects.
+    Resources with an id are updated, the others are created.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    form = BulkForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(api.toJson(form.errors), content_type='application/json')
+
+    try:
+        items = json.load(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(e)
+
+    if not isinstance(items, list):
+        return HttpResponseBadRequest("expected a list of resources")
+    if model is None:
+        if not all(isinstance(item, dict) and 'model' in item and 'data' in item for item in items):
+            return HttpResponseBadRequest('expected a list of {"model": ..., "data": ...} objects')
+        items = [(item['model'], item['data']) for item in items]
+    else:
+        items = [(model, item) for item in items]
+
+    if not all(isinstance(data, dict) for __, data in items):
+        return HttpResponseBadRequest("expected resource data objects")
+
+    try:
+        result = bulk_save(request.specify_collection, request.specify_user_agent, items,
+                           form.cleaned_data['recordsetid'], form.cleaned_data['atomic'] == 'true')
+    except api.RecordSetException as e:
+        return HttpResponseBadRequest(e)
+    return HttpResponse(api.toJson(result), content_type='application/json')
+
+def bulk_save(collection, agent, items, recordsetid=None, atomic=False):
+    """Create or update the resources given by the list of (model, data)
+    pairs 'items' in a single transaction.
+
+    Each item is saved in a savepoint of its own, so that an item that
+    fails is rolled back and reported without affecting the others,
+    unless 'atomic' is true, in which case any failure rolls back the
+    whole batch.
+
+    Related objects referenced by URI are fetched for all the items at
+    once. The audit log entries and record set items of created
+    resources are written in batches at the end. The resources
+    themselves are saved one at a time because the business rules and
+    autonumbering hook into each save and the ids of new resources
+    are needed for their dependents.
+    """
+    results = []
+    with transaction.atomic():
+        items = api.resolve_fk_uris(items)
+        recordset = None if recordsetid is None else api.get_recordset(recordsetid)
+        recordsetitems = []
+
+        with auditlog.batched_inserts() as pending_logs:
+            for model, data in items:
+                logs_mark, rsis_mark = len(pending_logs), len(recordsetitems)
+                try:
+                    with transaction.atomic():
+                        if 'id' in data:
+                            obj = api.update_obj(collection, agent, model, data['id'], data.get('version'), data)
+                            status = 200
+                        else:
+                            obj = api.create_obj(collection, agent, model, data)
+                            if recordset is not None:
+                                api.check_recordset_table(recordset, obj)
+                                recordsetitems.append(models.Recordsetitem(recordset=recordset, recordid=obj.id))
+                            status = 201
+                except ITEM_EXCEPTIONS as e:
+                    logger.info("bulk save of %s failed: %s", model, e)
+                    del pending_logs[logs_mark:]
+                    del recordsetitems[rsis_mark:]
+                    results.append({'status': item_status(e), 'error': str(e)})
+                else:
+                    results.append({'status': status, 'data': api.obj_to_data(obj)})
+
+            committed = not (atomic and any('error' in result for result in results))
+            if committed:
+                models.Recordsetitem.objects.bulk_create(recordsetitems)
+                if recordsetitems:
+                    recordset_index.bump_version(recordset.id)
+            else:
+                del pending_logs[:]
+                transaction.set_rollback(True)
+
+    return {'committed': committed, 'results': results}
+
+def item_status(exception):
+    return next(status for exc, status in ITEM_ERRORS if isinstance(exception, exc))
@@ -4,20 +4,37 @@ import os
 from django.conf import settings
 
 class Datamodel(object):
+    _tables = []
+    _tables_by_name = {}
+    _tables_by_id = {}
+
+    @property
+    def tables(self):
+        return self._tables
+
+    @tables.setter
+    def tables(self, tables):
+        # Index the tables by lower case name and by id. The first
+        # table wins if there are duplicates.
+        self._tables = tables
+        self._tables_by_name = {}
+        self._tables_by_id = {}
+        for table in tables:
+            self._tables_by_name.setdefault(table.name.lower(), table)
+            self._tables_by_id.setdefault(table.tableId, table)
+
     def get_table(self, tablename, strict=False):
         tablename = tablename.lower()
-        for table in self.tables:
-            if table.name.lower() == tablename:
-                return table
-        if strict:
+        table = self._tables_by_name.get(tablename)
+        if table is None and strict:
             raise Exception("No table with name: %r" % tablename)
+        return table
 
     def get_table_by_id(self, table_id, strict=False):
-        for table in self.tables:
-            if table.tableId == table_id:
-                return table
-        if strict:
+        table = self._tables_by_id.get(table_id)
+        if table is None and strict:
             raise Exception("No table with id: %d" % table_id)
+        return table
 
     def reverse_relationship(self, relationship):
         if hasattr(relationship, 'otherSideName'):
@@ -27,6 +44,7 @@ class Datamodel(object):
 
 class Table(object):
     system = False
+    _field_index = None
 
     @property
     def name(self):
@@ -38,12 +56,25 @@ class Table(object):
 
     def get_field(self, fieldname, strict=False):
         fieldname = fieldname.lower()
-        for field in self.fields + self.relationships + [self.idField]:
-            if field.name.lower() == fieldname:
-                return field
-        if strict:
+        if self._field_index is None:
+            self._field_index = self._index_fields()
+        field = self._field_index.get(fieldname)
+        if field is None and strict:
             raise Exception("Field %s not in table %s. " % (fieldname, self.name) +
                             "Fields: %s" % [f.name for f in self.fields + self.relationships])
+        return field
+
+    def _index_fields(self):
+        # Map lower case names to fields. As with the scan this
+        # replaces, fields shadow relationships of the same name.
+        index = {}
+        for field in self.fields + self.relationships + [self.idField]:
+            index.setdefault(field.name.lower(), field)
+        return index
+
+    def add_relationship(self, relationship):
+        self.relationships.append(relationship)
+        self._field_index = None
 
     @property
     def attachments_field(self):
@@ -152,7 +183,7 @@ def add_collectingevents_to_locality(datamodel):
     rel.otherSideName = 'locality'
 
     datamodel.get_table('collectingevent').get_field('locality').otherSideName = 'collectingEvents'
-    datamodel.get_table('locality').relationships.append(rel)
+    datamodel.get_table('locality').add_relationship(rel)
 
 def flag_dependent_fields(datamodel):
     for name in dependent_fields:
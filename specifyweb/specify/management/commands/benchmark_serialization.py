@@ -0,0 +1,86 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify import api
+
+def walk_obj_to_data(obj):
+    """Serialize 'obj' by walking its model meta data field by field
+    the way obj_to_data did before serializers were cached per model.
+    Used as the baseline of the benchmark.
+    """
+    fields = obj._meta.get_fields()
+    if isinstance(obj, api.models.Specifyuser):
+        fields = [f for f in fields if f.name != 'password']
+
+    data = dict((field.name, walk_field_to_val(obj, field))
+                for field in fields
+                if not (field.auto_created or field.one_to_many or field.many_to_many))
+    data.update(dict((ro.get_accessor_name(), walk_to_many_to_data(obj, ro))
+                     for ro in obj._meta.get_fields()
+                     if ro.one_to_many))
+    data['resource_uri'] = api.uri_for_model(obj.__class__.__name__.lower(), obj.id)
+    api.add_special_fields(obj, data)
+    return data
+
+def walk_to_many_to_data(obj, rel):
+    field_name = rel.get_accessor_name()
+    field = rel.model.specify_model.get_field(field_name)
+    if field is not None and field.dependent:
+        return [walk_obj_to_data(o) for o in getattr(obj, field_name).all()]
+
+    return api.uri_for_model(rel.related_model) + '?%s=%d' % (rel.field.name.lower(), obj.id)
+
+def walk_field_to_val(obj, field):
+    if field.many_to_one or (field.one_to_one and not field.auto_created):
+        if api.is_dependent_field(obj, field.name):
+            related_obj = getattr(obj, field.name)
+            if related_obj is None: return None
+            return walk_obj_to_data(related_obj)
+        related_id = getattr(obj, field.name + '_id')
+        if related_id is None: return None
+        return api.uri_for_model(field.related_model, related_id)
+    else:
+        return getattr(obj, field.name)
+
+class Command(BaseCommand):
+    help = 'Times obj_to_data against a field by field meta data walk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='name of the table to serialize, e.g. collectionobject')
+        parser.add_argument('--limit', type=int, default=100,
+                            help='number of records to serialize')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='number of timed passes over the records')
+
+    def handle(self, **options):
+        try:
+            model = getattr(api.models, options['model'].capitalize())
+        except AttributeError:
+            raise CommandError("no such table: %s" % options['model'])
+
+        # Load everything up front so only serialization is timed.
+        objs = list(api.prefetch_for_serialization(model.objects.all())[:options['limit']])
+        if not objs:
+            raise CommandError("no %s records to serialize" % model.__name__)
+
+        if [walk_obj_to_data(o) for o in objs] != [api.obj_to_data(o) for o in objs]:
+            raise CommandError("serializations differ")
+
+        walk = self.time(walk_obj_to_data, objs, options['repeat'])
+        cached = self.time(api.obj_to_data, objs, options['repeat'])
+
+        self.stdout.write("%d %s records, best of %d passes" % (len(objs), model.__name__, options['repeat']))
+        self.stdout.write("field walk:        %8.1f us/record" % (walk * 1e6 / len(objs)))
+        self.stdout.write("cached serializer: %8.1f us/record" % (cached * 1e6 / len(objs)))
+        self.stdout.write("speedup:           %8.2fx" % (walk / cached))
+
+    def time(self, serialize, objs, repeat):
+        best = None
+        for _ in range(repeat):
+            start = default_timer()
+            for obj in objs:
+                serialize(obj)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,98 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from . import models
+
+# Number of record sets whose indexes are kept in memory.
+CACHE_SIZE = 64
+
+class RecordSetIndex(namedtuple('RecordSetIndex', 'dbtableid stamp ids')):
+    """The sorted record ids of the items of a record set.
+
+    'stamp' is the version of the record set when the ids were read.
+    The version is bumped whenever an item is saved or deleted, so
+    a change to the record set is detected by reading a single row.
+    """
+    __slots__ = ()
+
+    def position(self, recordid):
+        """Return a tuple (index, previous, next) for 'recordid' where
+        'index' is the number of items with smaller record ids and
+        'previous' and 'next' are the neighboring record ids or None.
+        Returns None if the record is not in the record set.
+        """
+        ids = self.ids
+        i = bisect_left(ids, recordid)
+        if i == len(ids) or ids[i] != recordid:
+            return None
+        j = bisect_right(ids, recordid)
+        return (i,
+                ids[i - 1] if i > 0 else None,
+                ids[j] if j < len(ids) else None)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def get_stamp(recordsetid):
+    """Return (dbtableid, version) of the record set with 'recordsetid',
+    or None if it doesn't exist.
+    """
+    rows = models.Recordset.objects.filter(id=recordsetid).values_list('dbtableid', 'version')
+    for dbtableid, version in rows:
+        return dbtableid, version
+    return None
+
+def bump_version(recordsetid):
+    """Record that the items of the record set with 'recordsetid' have
+    changed. Writes that bypass the model signals, e.g. bulk_create,
+    have to call this themselves.
+    """
+    models.Recordset.objects.filter(id=recordsetid).update(
+        version=Coalesce(F('version'), Value(0)) + 1)
+
+def get_index(recordsetid):
+    """Return the RecordSetIndex of the record set with 'recordsetid',
+    or None if it doesn't exist.
+
+    The index is cached and only read again when the record set's
+    items have changed since.
+    """
+    recordsetid = int(recordsetid)
+    current = get_stamp(recordsetid)
+    if current is None:
+        invalidate(recordsetid)
+        return None
+    dbtableid, stamp = current
+
+    with _lock:
+        index = _cache.get(recordsetid)
+        if index is not None and index.stamp == stamp and index.dbtableid == dbtableid:
+            _cache.move_to_end(recordsetid)
+            return index
+
+    logger.debug("reading index of recordset %d", recordsetid)
+    ids = array('q', models.Recordsetitem.objects.filter(recordset_id=recordsetid)
+                .order_by('recordid').values_list('recordid', flat=True))
+    index = RecordSetIndex(dbtableid, stamp, ids)
+
+    with _lock:
+        _cache[recordsetid] = index
+        _cache.move_to_end(recordsetid)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+def invalidate(recordsetid):
+    with _lock:
+        _cache.pop(int(recordsetid), None)
+
+def clear():
+    with _lock:
+        _cache.clear()
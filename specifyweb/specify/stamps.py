@@ -0,0 +1,37 @@
+"""Modification stamps for writes that change records without saving
+them through the API, which would bump their versions.
+
+Resource ETags are computed from the version and timestampmodified of
+the records. Bulk updates, like tree renumbering or business rules
+clearing a flag on sibling records, must not bump versions, as that
+would make clients holding the records fail their next save with a
+conflict. They advance timestampmodified instead.
+
+The new stamp is at least a second past the old one, so that a record
+changed twice within a second doesn't get the same stamp again.
+"""
+
+from datetime import timedelta
+
+from django.db.models import F
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.functions import Coalesce, Greatest, Now
+
+def touched(model):
+    """Return the keyword arguments for QuerySet.update() which advance
+    the timestampmodified of the updated records of 'model', if it has
+    one.
+    """
+    try:
+        model._meta.get_field('timestampmodified')
+    except FieldDoesNotExist:
+        return {}
+    return {'timestampmodified': Greatest(
+        Now(), Coalesce(F('timestampmodified') + timedelta(seconds=1), Now()))}
+
+def touch_sql(alias):
+    """Return an SQL assignment which advances the timestampmodified of
+    the table with 'alias' in an UPDATE statement.
+    """
+    return ("{0}.timestampmodified = greatest(now(), coalesce({0}.timestampmodified + interval 1 second, now()))"
+            .format(alias))
@@ -0,0 +1,96 @@
+from array import array
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.http import StreamingHttpResponse
+from MySQLdb.cursors import SSCursor
+
+# Number of rows fetched from the server at a time.
+CHUNK_SIZE = 2000
+
+STREAM_FORMATS = (('json', 'json'), ('ndjson', 'ndjson'))
+
+def stream_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Yield the rows of the values_list() 'queryset' as tuples,
+    converted the same way Django converts them when the queryset
+    is evaluated.
+
+    The rows are read with an unbuffered server side cursor on Django's
+    own connection, so the whole result is never held in memory. No
+    other query can be run on the connection until all the rows have
+    been read or the generator is closed.
+    """
+    compiler = queryset.query.get_compiler(using=queryset.db)
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        return
+
+    connection = connections[queryset.db]
+    connection.ensure_connection()
+    # MySQLdb's SSCursor fetches the rows from the server as they are
+    # read, where Django's cursors buffer the whole result.
+    cursor = connection.connection.cursor(SSCursor)
+    try:
+        cursor.execute(sql, params)
+
+        def chunks():
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows: return
+                yield rows
+
+        yield from compiler.results_iter(results=chunks(), tuple_expected=True)
+    finally:
+        cursor.close()
+
+def stream_objects(queryset, fields=None, inline=None, chunk_size=CHUNK_SIZE):
+    """Yield the objects of 'queryset' in order, loading them a chunk
+    at a time with what is needed to serialize 'fields' and 'inline'.
+
+    The ids are read first, into a compact array, as the connection
+    can't load objects while rows are still being streamed.
+    """
+    from .api import prefetch_for_serialization
+
+    ids = array('q', (id for id, in stream_rows(queryset.values_list('id'), chunk_size)))
+    objs = prefetch_for_serialization(queryset.model.objects.all(), fields, inline)
+    chunk = []
+    for id in ids:
+        chunk.append(id)
+        if len(chunk) == chunk_size:
+            yield from load_chunk(objs, chunk)
+            chunk = []
+    if chunk:
+        yield from load_chunk(objs, chunk)
+
+def load_chunk(objs, ids):
+    by_id = objs.in_bulk(ids)
+    return (by_id[id] for id in ids if id in by_id)
+
+def encode_json_array(items, encoder, head='[', tail=']'):
+    """Yield the JSON array of 'items' a piece at a time. The array can
+    be embedded in a larger document with 'head' and 'tail'.
+    """
+    yield head
+    first = True
+    for item in items:
+        yield encoder.encode(item) if first else ',' + encoder.encode(item)
+        first = False
+    yield tail
+
+def encode_ndjson(items, encoder):
+    """Yield 'items' as newline delimited JSON."""
+    for item in items:
+        yield encoder.encode(item) + '\n'
+
+def streaming_response(items, format, encoder, head='[', tail=']'):
+    """Return a StreamingHttpResponse encoding 'items' as a JSON array,
+    wrapped in 'head' and 'tail', or as newline delimited JSON
+    depending on 'format'.
+    """
+    if format == 'ndjson':
+        return StreamingHttpResponse(encode_ndjson(items, encoder),
+                                     content_type='application/x-ndjson')
+    return StreamingHttpResponse(encode_json_array(items, encoder, head, tail),
+                                 content_type='application/json')
@@ -0,0 +1,17 @@
+"""Background job functions of the specify app. See specifyweb.jobs."""
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import transaction
+
+from . import tree_extras
+
+def rebalance_tree(run, table):
+    """Renumber the tree in 'table', restoring the gaps between the node
+    numbers that inserts and moves have used up.
+    """
+    with transaction.atomic():
+        tree_extras.renumber_tree(table)
+        tree_extras.validate_tree_numbering(table)
+        tree_extras.validate_tree_intervals(table)
+    logger.info("rebalanced %s tree", table)
@@ -2,7 +2,23 @@ from django.test import TestCase
 from specifyweb.specify.models import datamodel
 
 class DatamodelTests(TestCase):
-    pass
+    def test_get_table_case_insensitive(self):
+        table = datamodel.get_table('CollectionObject')
+        self.assertIs(table, datamodel.get_table('collectionobject'))
+        self.assertIs(table, datamodel.get_table_by_id(table.tableId))
+        self.assertIsNone(datamodel.get_table('nosuchtable'))
+        with self.assertRaises(Exception):
+            datamodel.get_table('nosuchtable', strict=True)
+
+    def test_get_field_case_insensitive(self):
+        table = datamodel.get_table('collectionobject')
+        self.assertEqual(table.get_field('CatalogNumber').name, 'catalogNumber')
+        self.assertIs(table.get_field(table.idFieldName), table.idField)
+        self.assertIsNone(table.get_field('nosuchfield'))
+
+    def test_added_relationship_indexed(self):
+        self.assertEqual(datamodel.get_table('locality').get_field('collectingevents').relatedModelName,
+                         'collectingEvent')
 
 
 def make_attachments_field_dependent_test(table):
@@ -0,0 +1,128 @@
+import threading
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+
+from specifyweb.specify import models
+from specifyweb.specify.api_tests import ApiTests, MainSetupTearDown
+from specifyweb.specify.tree_extras import renumber_tree, validate_tree_numbering, \
+    validate_tree_intervals, TreeNumberingOverflow, MAX_NODENUMBER
+from specifyweb.specify.tasks import rebalance_tree
+
+def validate(table):
+    validate_tree_numbering(table)
+    validate_tree_intervals(table)
+
+class GappedTreeSetup(MainSetupTearDown):
+    def setUp(self):
+        super(GappedTreeSetup, self).setUp()
+        self.continent_rank = self.geographytreedef.treedefitems.create(name="Continent", rankid="100")
+        self.country_rank = self.geographytreedef.treedefitems.create(name="Country", rankid="200")
+        self.earth = self.add_node("Earth", self.geographytreedef.treedefitems.get(rankid=0), None)
+        self.europe = self.add_node("Europe", self.continent_rank, self.earth)
+        self.france = self.add_node("France", self.country_rank, self.europe)
+        renumber_tree('geography')
+
+    def add_node(self, name, rank, parent):
+        return models.Geography.objects.create(
+            name=name, definition=self.geographytreedef, definitionitem=rank, parent=parent)
+
+    def numbers(self, node):
+        node = models.Geography.objects.get(id=node.id)
+        return node.nodenumber, node.highestchildnodenumber
+
+@override_settings(TREE_NODENUMBER_GAP=16, RUN_JOBS_IN_WEB_PROCESS=False)
+class GappedNodeNumberTests(GappedTreeSetup, ApiTests):
+    def test_renumber_leaves_gaps(self):
+        self.assertEqual(self.numbers(self.earth), (16, 63))
+        self.assertEqual(self.numbers(self.europe), (32, 63))
+        self.assertEqual(self.numbers(self.france), (48, 63))
+        validate('geography')
+
+    def test_insert_into_gap(self):
+        asia = self.add_node("Asia", self.continent_rank, self.earth)
+        nodenumber, highestchildnodenumber = self.numbers(asia)
+        self.assertTrue(16 < nodenumber <= highestchildnodenumber < 32)
+        self.assertEqual(self.numbers(self.europe), (32, 63))
+        self.assertEqual(self.numbers(self.france), (48, 63))
+        validate('geography')
+
+    def test_move_into_gap(self):
+        asia = self.add_node("Asia", self.continent_rank, self.earth)
+        france = models.Geography.objects.get(id=self.france.id)
+        france.parent = asia
+        france.save()
+
+        asia_numbers = self.numbers(asia)
+        nodenumber, highestchildnodenumber = self.numbers(france)
+        self.assertTrue(asia_numbers[0] < nodenumber <= highestchildnodenumber <= asia_numbers[1])
+        self.assertEqual(self.numbers(self.europe), (32, 63))
+        validate('geography')
+
+    def test_exhausted_gap(self):
+        continents = [self.add_node("Continent %d" % i, self.continent_rank, self.earth) for i in range(20)]
+        validate('geography')
+        nodenumbers = [self.numbers(c)[0] for c in continents + [self.europe]]
+        self.assertEqual(len(set(nodenumbers)), len(nodenumbers))
+
+        rebalance_tree(None, 'geography')
+        nodes = models.Geography.objects.order_by('nodenumber')
+        self.assertEqual([n.nodenumber for n in nodes], [16 * (i + 1) for i in range(len(nodes))])
+
+    def test_shift_overflow(self):
+        # Leave no gap under Earth, so that the insert has to shift the
+        # following nodes past the largest node number.
+        models.Geography.objects.filter(id=self.earth.id).update(highestchildnodenumber=MAX_NODENUMBER - 20)
+        models.Geography.objects.filter(id=self.europe.id).update(nodenumber=17)
+        with self.assertRaises(TreeNumberingOverflow), transaction.atomic():
+            self.add_node("Asia", self.continent_rank, self.earth)
+        self.assertEqual(self.numbers(self.europe), (17, 63))
+        self.assertEqual(self.numbers(self.france), (48, 63))
+
+    @override_settings(TREE_NODENUMBER_GAP=1)
+    def test_dense_numbering(self):
+        renumber_tree('geography')
+        self.assertEqual(self.numbers(self.earth), (1, 3))
+        asia = self.add_node("Asia", self.continent_rank, self.earth)
+        self.assertEqual(self.numbers(asia), (2, 2))
+        self.assertEqual(self.numbers(self.europe), (3, 4))
+        validate('geography')
+
+    def test_renumber_overflow(self):
+        with override_settings(TREE_NODENUMBER_GAP=MAX_NODENUMBER // 3):
+            with self.assertRaises(TreeNumberingOverflow):
+                renumber_tree('geography')
+        self.assertEqual(self.numbers(self.earth), (16, 63))
+
+@override_settings(TREE_NODENUMBER_GAP=16, RUN_JOBS_IN_WEB_PROCESS=False)
+class ConcurrentGappedInsertTests(GappedTreeSetup, TransactionTestCase):
+    def test_concurrent_inserts_under_parent(self):
+        # The second insert takes its snapshot before the first one
+        # commits and then waits for the lock on the parent.
+        snapshot_taken = threading.Event()
+        errors = []
+
+        def second_insert():
+            try:
+                with transaction.atomic():
+                    models.Geography.objects.count()
+                    snapshot_taken.set()
+                    self.add_node("Asia", self.continent_rank, self.earth)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                snapshot_taken.set()
+                connection.close()
+
+        thread = threading.Thread(target=second_insert)
+        with transaction.atomic():
+            africa = self.add_node("Africa", self.continent_rank, self.earth)
+            thread.start()
+            snapshot_taken.wait(10)
+        thread.join(30)
+
+        self.assertEqual(errors, [])
+        asia = models.Geography.objects.get(name="Asia")
+        africa_numbers, asia_numbers = self.numbers(africa), self.numbers(asia)
+        self.assertTrue(africa_numbers[1] < asia_numbers[0] or asia_numbers[1] < africa_numbers[0])
+        validate('geography')
@@ -0,0 +1,46 @@
+from xml.etree import ElementTree
+
+from django.test import TestCase
+
+from specifyweb.specify.uiformatters import formatter_from_node, NumericField, AlphaNumField
+
+ACCESSION_FORMAT = """
+<format system="false" name="AccessionNumber" class="edu.ku.brc.specify.datamodel.Accession" fieldname="accessionNumber">
+  <field type="year" size="4" value="YEAR" byyear="true"/>
+  <field type="separator" size="1" value="-"/>
+  <field type="alphanumeric" size="2" value="AA"/>
+  <field type="separator" size="1" value="-"/>
+  <field type="numeric" size="3" inc="true"/>
+</format>
+"""
+
+class UIFormatterTests(TestCase):
+    def setUp(self):
+        self.formatter = formatter_from_node(ElementTree.XML(ACCESSION_FORMAT), 'AccessionNumber')
+
+    def test_from_node(self):
+        self.assertEqual(self.formatter.model_name, 'Accession')
+        self.assertEqual(self.formatter.field_name, 'accessionNumber')
+        self.assertEqual(len(self.formatter.fields), 5)
+
+    def test_parse(self):
+        self.assertEqual(self.formatter.parse('2020-AB-012'), ('2020', '-', 'AB', '-', '012'))
+        self.assertEqual(self.formatter.parse('YEAR-AB-###'), ('YEAR', '-', 'AB', '-', '###'))
+        with self.assertRaises(ValueError):
+            self.formatter.parse('2020-AB-12')
+
+    def test_parse_pattern_is_compiled_once(self):
+        self.assertIs(self.formatter.parse_pattern(), self.formatter.parse_pattern())
+
+    def test_needs_autonumber(self):
+        self.assertTrue(self.formatter.needs_autonumber(self.formatter.parse('YEAR-AB-###')))
+        self.assertFalse(self.formatter.needs_autonumber(self.formatter.parse('2020-AB-012')))
+
+    def test_equal_fields_of_different_types_keep_their_patterns(self):
+        numeric = NumericField(size=3)
+        alphanum = AlphaNumField(size=3, value='###', inc=False, by_year=False)
+        self.assertEqual(numeric, alphanum)
+        self.assertNotEqual(alphanum.value_regexp(), numeric.value_regexp())
+        self.assertIsNot(numeric.patterns(), alphanum.patterns())
+        self.assertFalse(numeric.patterns()[1].match('AB1'))
+        self.assertTrue(alphanum.patterns()[1].match('AB1'))
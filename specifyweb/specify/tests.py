@@ -3,6 +3,8 @@ from django.conf import settings
 
 from .api_tests import *
 from .test_load_datamodel import *
+from .test_uiformatters import *
+from .test_tree_extras import *
 
 if settings.TEST_RUNNER == 'selenium_testsuite_runner.SeleniumTestSuiteRunner':
     from .selenium_tests import *
@@ -1,16 +1,18 @@
 import re
+import json
 from contextlib import contextmanager
 import logging
 logger = logging.getLogger(__name__)
 
 
-from django.db import models, connection
-from django.db.models import F, Q, ProtectedError
+from django.db import models, connection, transaction
+from django.db.models import F, Q, Max, ProtectedError
 from django.conf import settings
 
 from specifyweb.businessrules.exceptions import BusinessRuleException
 
 from  .auditcodes import TREE_MERGE, TREE_SYNONYMIZE, TREE_UNSYNONYMIZE
+from .stamps import touched, touch_sql
 
 @contextmanager
 def validate_node_numbers(table):
@@ -92,19 +94,34 @@ class Tree(models.Model):
 
 
 
+# Largest value of the nodenumber columns, which are signed INTs.
+MAX_NODENUMBER = 2**31 - 1
+
+class TreeNumberingOverflow(Exception):
+    pass
+
 def open_interval(model, parent_node_number, size):
     """Open a space of given size in a tree model under the given parent.
     The insertion point will be directly after the parent_node_number.
     Returns the instertion point.
+
+    Raises TreeNumberingOverflow if the shifted node numbers would not
+    fit in the columns, which MySQL would otherwise clamp silently.
     """
+    highest = model.objects.aggregate(highest=Max('highestchildnodenumber'))['highest']
+    if highest is not None and highest + size > MAX_NODENUMBER:
+        raise TreeNumberingOverflow(
+            "no room for {} more node numbers in {}".format(size, model._meta.db_table))
+
     # All intervals to the right of parent node get shifted right by size.
     model.objects.filter(nodenumber__gt=parent_node_number).update(
         nodenumber=F('nodenumber')+size,
         highestchildnodenumber=F('highestchildnodenumber')+size,
+        **touched(model)
     )
     # All intervals containing the insertion point get expanded by size.
     model.objects.filter(nodenumber__lte=parent_node_number, highestchildnodenumber__gte=parent_node_number)\
-        .update(highestchildnodenumber=F('highestchildnodenumber')+size)
+        .update(highestchildnodenumber=F('highestchildnodenumber')+size, **touched(model))
 
     return parent_node_number + 1
 
@@ -115,19 +132,93 @@ def move_interval(model, old_node_number, old_highest_child_node_number, new_nod
     """
     delta = new_node_number - old_node_number
     model.objects.filter(nodenumber__gte=old_node_number, nodenumber__lte=old_highest_child_node_number)\
-        .update(nodenumber=F('nodenumber')+delta, highestchildnodenumber=F('highestchildnodenumber')+delta)
+        .update(nodenumber=F('nodenumber')+delta, highestchildnodenumber=F('highestchildnodenumber')+delta,
+                **touched(model))
 
 def close_interval(model, node_number, size):
     """Close a gap where an interval was removed."""
     # All intervals containing the gap get reduced by size.
     model.objects.filter(nodenumber__lte=node_number, highestchildnodenumber__gte=node_number)\
-        .update(highestchildnodenumber=F('highestchildnodenumber')-size)
+        .update(highestchildnodenumber=F('highestchildnodenumber')-size, **touched(model))
     # All intervals to the right of node_number get shifted left by size.
     model.objects.filter(nodenumber__gt=node_number).update(
         nodenumber=F('nodenumber')-size,
         highestchildnodenumber=F('highestchildnodenumber')-size,
+        **touched(model)
     )
 
+def free_interval(model, parent):
+    """Return (first, last) of the unused node numbers directly after
+    the parent's nodenumber, up to the next node or the end of the
+    parent's interval. The interval is empty if last < first.
+
+    The next node is found with a locking read. A plain read could see
+    a snapshot from before a concurrent insert under the same parent
+    committed, and hand out the same numbers again.
+    """
+    following = model.objects.select_for_update().filter(nodenumber__gt=parent.nodenumber) \
+                             .order_by('nodenumber').values_list('nodenumber', flat=True).first()
+    last = parent.highestchildnodenumber
+    if following is not None:
+        last = min(last, following - 1)
+    return parent.nodenumber + 1, last
+
+def allot_interval(model, parent, size):
+    """Return (nodenumber, highestchildnodenumber) of an interval of at
+    least 'size' unused node numbers under 'parent', or None if the gap
+    after the parent's nodenumber is too small. Only a fraction of the
+    spare room is given to the new interval, leaving the rest of the
+    gap for further nodes inserted under the parent.
+    """
+    first, last = free_interval(model, parent)
+    available = last - first + 1
+    if available < size:
+        return None
+    # The upper end of the gap is taken so that the free numbers stay
+    # directly after the parent's nodenumber.
+    length = size + (available - size) // 4
+    return last - length + 1, last
+
+def insert_interval(model, parent, size):
+    """Return (nodenumber, highestchildnodenumber) of an interval of at
+    least 'size' node numbers for a child of 'parent'.
+
+    With dense numbering, the numbers of all the following nodes are
+    shifted to make room. With gapped numbering (TREE_NODENUMBER_GAP > 1)
+    the interval is taken from the gap after the parent's nodenumber,
+    touching no other nodes. Only if the gap is too small is room made
+    by shifting, and the tree is scheduled to be renumbered with new
+    gaps.
+    """
+    gap = settings.TREE_NODENUMBER_GAP
+    if gap <= 1:
+        insertion_point = open_interval(model, parent.nodenumber, size)
+        return insertion_point, insertion_point + size - 1
+
+    interval = allot_interval(model, parent, size)
+    if interval is None:
+        logger.info('no node numbers left under %s, shifting the following nodes', parent)
+        open_interval(model, parent.nodenumber, size + 2 * gap)
+        request_rebalance(model._meta.db_table)
+        parent = model.objects.select_for_update().get(id=parent.id)
+        interval = allot_interval(model, parent, size)
+    return interval
+
+def request_rebalance(table):
+    """Schedule a background job renumbering the tree in 'table' with
+    the configured gaps, unless one is already waiting.
+    """
+    from specifyweb.jobs.models import Job
+    from specifyweb.jobs.queue import enqueue
+    arguments = {'table': table}
+
+    def enqueue_once():
+        if not Job.objects.filter(jobtype='rebalance-tree', status=Job.QUEUED,
+                                  arguments=json.dumps(arguments)).exists():
+            enqueue(None, 'rebalance-tree', **arguments)
+
+    transaction.on_commit(enqueue_once)
+
 def adding_node(node):
     logger.info('adding node %s', node)
     model = type(node)
@@ -135,8 +226,7 @@ def adding_node(node):
     if parent.accepted_id is not None:
         raise BusinessRuleException('Adding node "{node.fullname}" to synonymized parent "{parent.fullname}".'
                                     .format(node=node, parent=parent))
-    insertion_point = open_interval(model, parent.nodenumber, 1)
-    node.highestchildnodenumber = node.nodenumber = insertion_point
+    node.nodenumber, node.highestchildnodenumber = insert_interval(model, parent, 1)
 
 def moving_node(to_save):
     logger.info('moving node %s', to_save)
@@ -148,6 +238,25 @@ def moving_node(to_save):
         raise BusinessRuleException('Moving node "{node.fullname}" to synonymized parent "parent.fullname".'
                                     .format(node=to_save, parent=new_parent))
 
+    if settings.TREE_NODENUMBER_GAP > 1:
+        # The subtree is moved into the gap under the new parent and
+        # its old numbers are left unused. Only the numbers up to its
+        # last node need room, the gaps after the moved nodes are
+        # trimmed to the interval they get.
+        last = model.objects.select_for_update().filter(
+            nodenumber__gte=current.nodenumber,
+            nodenumber__lte=current.highestchildnodenumber,
+        ).order_by('-nodenumber').values_list('nodenumber', flat=True).first()
+        nodenumber, highestchildnodenumber = insert_interval(model, new_parent, last - current.nodenumber + 1)
+        current = model.objects.get(id=current.id)
+        move_interval(model, current.nodenumber, current.highestchildnodenumber, nodenumber)
+        model.objects.filter(nodenumber__gte=nodenumber, nodenumber__lte=highestchildnodenumber,
+                             highestchildnodenumber__gt=highestchildnodenumber) \
+                     .update(highestchildnodenumber=highestchildnodenumber, **touched(model))
+        to_save.nodenumber = nodenumber
+        to_save.highestchildnodenumber = highestchildnodenumber
+        return
+
     insertion_point = open_interval(model, new_parent.nodenumber, size)
     # node interval will have moved if it is to the right of the insertion point
     # so fetch again
@@ -196,7 +305,7 @@ def merge(node, into, agent):
             related_model_name, field_name = re.search(r"'(\w+)\.(\w+)'$", e.args[0]).groups()
             related_model = getattr(models, related_model_name)
             assert related_model != model or field_name != 'parent', 'children were added during merge'
-            related_model.objects.filter(**{field_name: node}).update(**{field_name: target})
+            related_model.objects.filter(**{field_name: node}).update(**{field_name: target}, **touched(related_model))
 
     assert False, "failed to move all referrences to merged tree node"
 
@@ -215,16 +324,16 @@ def synonymize(node, into, agent):
     if node.children.count() > 0:
         raise BusinessRuleException('Synonymizing node "{node.fullname}" which has children.'
                                     .format(node=node))
-    node.acceptedchildren.update(**{node.accepted_id_attr().replace('_id', ''): target})
+    node.acceptedchildren.update(**{node.accepted_id_attr().replace('_id', ''): target}, **touched(model))
     #assuming synonym can't be synonymized
     mutation_log(TREE_SYNONYMIZE, node, agent, node.parent,
                  [{'field_name': 'acceptedid','old_value': None, 'new_value': target.id},
                   {'field_name': 'isaccepted','old_value': True, 'new_value': False}])
 
     if model._meta.db_table == 'taxon':
-        node.determinations.update(preferredtaxon=target)
         from .models import Determination
-        Determination.objects.filter(preferredtaxon=node).update(preferredtaxon=target)
+        node.determinations.update(preferredtaxon=target, **touched(Determination))
+        Determination.objects.filter(preferredtaxon=node).update(preferredtaxon=target, **touched(Determination))
 
 def unsynonymize(node, agent):
     logger.info('unsynonmizing %s', node)
@@ -238,7 +347,8 @@ def unsynonymize(node, agent):
                   {'field_name': 'isaccepted','old_value': False, 'new_value': True}])
 
     if model._meta.db_table == 'taxon':
-        node.determinations.update(preferredtaxon=F('taxon'))
+        from .models import Determination
+        node.determinations.update(preferredtaxon=F('taxon'), **touched(Determination))
 
 EMPTY = "''"
 TRUE = "true"
@@ -339,10 +449,13 @@ def set_fullnames(table, depth, reverse=False):
         "set {set_expr}\n"
         "where t{root}.parentid is null\n"
         "and t0.acceptedid is null\n"
+        # Only the nodes whose fullname changes are written, and stamped.
+        "and not (t0.fullname <=> {fullname})\n"
     ).format(
         root=depth-1,
         table=table,
-        set_expr="t0.fullname = {}".format(fullname_expr(depth, reverse)),
+        fullname=fullname_expr(depth, reverse),
+        set_expr="t0.fullname = {}, {}".format(fullname_expr(depth, reverse), touch_sql('t0')),
         parent_joins=parent_joins(table, depth),
         definition_joins=definition_joins(table, depth),
     )
@@ -400,6 +513,22 @@ def validate_tree_numbering(table):
     assert not_nested_count == 0, \
         "found {} nodenumbers not nested by parent".format(not_nested_count)
 
+def validate_tree_intervals(table):
+    """Check that the interval of every node lies within its parent's.
+    With gapped numbering the intervals may extend past the last
+    descendant. This is a full scan of the tree, so it is done when
+    the tree is repaired or renumbered rather than on every save.
+    """
+    cursor = connection.cursor()
+    cursor.execute((
+        "select count(*) from {table} t left join {table} p on t.parentid = p.{table}id\n"
+        "where t.highestchildnodenumber < t.nodenumber\n"
+        "or t.highestchildnodenumber > p.highestchildnodenumber\n"
+    ).format(table=table))
+    bad_interval_count, = cursor.fetchone()
+    assert bad_interval_count == 0, \
+        "found {} highestchildnodenumbers outside of the parent's interval".format(bad_interval_count)
+
 def path_expr(table, depth):
     return CONCAT([ID(table, i) for i in reversed(list(range(depth)))], ',')
 
@@ -416,15 +545,27 @@ def print_paths(table, depth):
     print(sql)
 
 def renumber_tree(table):
+    """Number the nodes of the tree in 'table' from scratch, leaving
+    TREE_NODENUMBER_GAP - 1 unused numbers after every node.
+    """
     logger.info('renumbering tree')
+    gap = max(1, settings.TREE_NODENUMBER_GAP)
     cursor = connection.cursor()
 
+    cursor.execute("select count(*) from {}".format(table))
+    node_count, = cursor.fetchone()
+    if (node_count + 1) * gap - 1 > MAX_NODENUMBER:
+        raise TreeNumberingOverflow(
+            "{} nodes in {} do not fit in the node numbers with TREE_NODENUMBER_GAP = {}"
+            .format(node_count, table, gap))
+
     # make sure rankids are set correctly
     cursor.execute((
         "update {table} t\n"
         "join {table}treedefitem d on t.{table}treedefitemid = d.{table}treedefitemid\n"
-        "set t.rankid = d.rankid\n"
-    ).format(table=table))
+        "set t.rankid = d.rankid, {touch}\n"
+        "where not (t.rankid <=> d.rankid)\n"
+    ).format(table=table, touch=touch_sql('t')))
 
     # make sure there are no cycles
     cursor.execute((
@@ -452,31 +593,43 @@ def renumber_tree(table):
         "          {parent_joins}\n"
         "          order by path) p\n"
         ") r on t.{table}id = r.id\n"
-        # Set the highestchildnodenumber to be the same as the
-        # nodenumber.  This is correct for leaves, and interior nodes
-        # will be adjusted in the next step.
-        "set t.nodenumber = r.nn, t.highestchildnodenumber = r.nn\n"
+        "set t.nodenumber = r.nn * {gap}, {touch}\n"
+        "where not (t.nodenumber <=> r.nn * {gap})\n"
     ).format(
         table=table,
+        gap=gap,
+        touch=touch_sql('t'),
         path=path_expr(table, depth),
         parent_joins=parent_joins(table, depth),
     ))
 
+    # Set the highestchildnodenumber of the leaves to the end of their
+    # gap.
+    cursor.execute((
+        "update {table} t\n"
+        "left join {table} c on c.parentid = t.{table}id\n"
+        "set t.highestchildnodenumber = t.nodenumber + {gap} - 1, {touch}\n"
+        "where c.{table}id is null\n"
+        "and not (t.highestchildnodenumber <=> t.nodenumber + {gap} - 1)\n"
+    ).format(table=table, gap=gap, touch=touch_sql('t')))
+
     # Adjust the highestchildnodenumbers working from the penultimate
     # rank downward towards the roots. The highest rank cannot have
-    # any children, so all nodes there correctly have
-    # highestchildnodenumber = nodenumber as set in the previous step.
-    # Interior nodes are updated by inner joining against their
-    # children so that nodes with no children are not updated leaving
-    # highestchildnodenumber = nodenumber.
+    # any children, so all nodes there correctly have the
+    # highestchildnodenumber set in the previous step. Interior nodes
+    # are updated by inner joining against their children so that
+    # nodes with no children are not updated, keeping their gap.
+    # Only the nodes whose numbers change are written, and stamped, so
+    # that renumbering an already numbered tree changes nothing.
     for rank in ranks[1:]:
         cursor.execute((
             "update {table} t join (\n"
             "   select max(highestchildnodenumber) as hcnn, parentid\n"
             "   from {table} where rankid > %(rank)s group by parentid\n"
             ") as sub on sub.parentid = t.{table}id\n"
-            "set highestchildnodenumber = hcnn where rankid = %(rank)s\n"
-        ).format(table=table), {'rank': rank})
+            "set highestchildnodenumber = hcnn, {touch}\n"
+            "where rankid = %(rank)s and not (highestchildnodenumber <=> hcnn)\n"
+        ).format(table=table, touch=touch_sql('t')), {'rank': rank})
 
     # Clear the BadNodes and UpdateNodes flags.
     from .models import datamodel, Sptasksemaphore
@@ -273,3 +273,4 @@ def repair_tree(request, tree):
     table = tree_model.name.lower()
     tree_extras.renumber_tree(table)
     tree_extras.validate_tree_numbering(table)
+    tree_extras.validate_tree_intervals(table)
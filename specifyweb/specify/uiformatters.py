@@ -1,8 +1,10 @@
 import re, logging
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from functools import wraps
+from time import time
 from xml.etree import ElementTree
-from xml.sax.saxutils import quoteattr
 from django.db import connection
+from django.db.models import signals
 
 from datetime import date
 logger = logging.getLogger(__name__)
@@ -10,23 +12,79 @@ logger = logging.getLogger(__name__)
 from specifyweb.context.app_resource import get_app_resource
 
 from .filter_by_col import filter_by_collection
+from .models import Spappresourcedata, Splocalecontaineritem
+
+# Seconds a registry is used before it is read again, to pick up
+# changes made by other processes. Changes made by this process clear
+# the registries immediately.
+REGISTRY_TTL = 300
+
+# UIFormatterRegistry instances keyed by (collection id, user id).
+_registries = {}
+
+class UIFormatterRegistry(object):
+    """The UI formatters available in a collection and user context,
+    parsed once from the UIFormatters app resource and indexed by
+    formatter name and by the (table, field) they are set on in the
+    schema configuration of the collection's discipline.
+    """
+    def __init__(self, collection, user):
+        self.created = time()
+        xml, __ = get_app_resource(collection, user, "UIFormatters")
+        self.by_name = {}
+        for node in ElementTree.XML(xml).iter('format'):
+            name = node.attrib.get('name')
+            if name is not None and name not in self.by_name:
+                self.by_name[name] = formatter_from_node(node, name)
+
+        self.field_formats = defaultdict(dict)
+        for table, field, format in Splocalecontaineritem.objects.filter(
+                container__discipline=collection.discipline,
+                format__isnull=False
+        ).values_list('container__name', 'name', 'format'):
+            self.field_formats[table.lower()].setdefault(field.lower(), format)
+
+    def get(self, formatter_name):
+        return self.by_name.get(formatter_name)
+
+    def formats_for_table(self, tablename):
+        "Returns a dict of field names to the formats set on them."
+        return self.field_formats.get(tablename.lower(), {})
+
+    def for_field(self, tablename, fieldname):
+        format = self.formats_for_table(tablename).get(fieldname.lower())
+        return format and self.get(format)
+
+def get_registry(collection, user):
+    key = (collection.id, user and user.id)
+    registry = _registries.get(key)
+    if registry is None or time() - registry.created > REGISTRY_TTL:
+        registry = _registries[key] = UIFormatterRegistry(collection, user)
+    return registry
+
+def clear_registries(sender=None, **kwargs):
+    _registries.clear()
+
+for model in (Spappresourcedata, Splocalecontaineritem):
+    signals.post_save.connect(clear_registries, sender=model)
+    signals.post_delete.connect(clear_registries, sender=model)
 
 def get_uiformatter(collection, user, formatter_name):
-    xml, __ = get_app_resource(collection, user, "UIFormatters")
-    node = ElementTree.XML(xml).find('.//format[@name=%s]' % quoteattr(formatter_name))
-    if node is None: return None
+    return get_registry(collection, user).get(formatter_name)
+
+def formatter_from_node(node, formatter_name):
     external = node.find('external')
     if external is not None:
         name = external.text.split('.')[-1]
         if name == 'CatalogNumberUIFieldFormatter':
-            return UIFormatter('CollectionObject', 'CatalogNumber', [CNNField()], formatter_name)
+            return UIFormatter('CollectionObject', 'CatalogNumber', (CNNField(),), formatter_name)
         else:
             return None
     else:
         return UIFormatter(
             model_name = node.attrib['class'].split('.')[-1],
             field_name = node.attrib['fieldname'],
-            fields = list(map(new_field, node.findall('field'))),
+            fields = tuple(map(new_field, node.findall('field'))),
             format_name = formatter_name,
         )
 
@@ -74,14 +132,33 @@ def get_autonumber_group_filter(model, collection, format_name):
         return default
 
 
+def cached_on_instance(method):
+    """Decorates a method without arguments so it is only evaluated
+    once per instance. Formatters and fields compare equal by value
+    regardless of their type, so they can't be keys of a shared cache.
+    """
+    attr = '_cached_' + method.__name__
+    @wraps(method)
+    def wrapper(self):
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            result = self.__dict__[attr] = method(self)
+            return result
+    return wrapper
+
 class UIFormatter(namedtuple('UIFormatter', "model_name field_name fields format_name")):
 
     def parse_regexp(self):
         regexp = ''.join('(%s)' % f.wild_or_value_regexp() for f in self.fields)
         return '^%s$' % regexp
 
+    @cached_on_instance
+    def parse_pattern(self):
+        return re.compile(self.parse_regexp())
+
     def parse(self, value):
-        match = re.match(self.parse_regexp(), value)
+        match = self.parse_pattern().match(value)
         if match is None:
             raise ValueError("value doesn't match formatter")
         return match.groups()
@@ -187,8 +264,14 @@ class Field(namedtuple("Field", "size value inc by_year")):
 
     def is_wild(self, value):
         logger.debug("%s checking if value %s is wild", self, value)
-        return (re.match("^%s$" % self.wild_regexp(), value) and not
-                re.match("^%s$" % self.value_regexp(), value))
+        wild_pattern, value_pattern = self.patterns()
+        return (wild_pattern.match(value) and not
+                value_pattern.match(value))
+
+    @cached_on_instance
+    def patterns(self):
+        return (re.compile("^%s$" % self.wild_regexp()),
+                re.compile("^%s$" % self.value_regexp()))
 
     def wild_or_value_regexp(self):
         if self.can_autonumber():
@@ -10,6 +10,10 @@ urlpatterns = [
     url(r'^specify/(?P<model>\w+)/$', views.collection),
     url(r'^specify_rows/(?P<model>\w+)/$', views.rows),
 
+    # create or update many resources in one request
+    url(r'^specify_bulk/(?P<model>\w+)/$', views.bulk),
+    url(r'^specify_bulk/$', views.bulk),
+
     url(r'^delete_blockers/(?P<model>\w+)/(?P<id>\d+)/$', views.delete_blockers),
 
     # this url always triggers a 500 for testing purposes
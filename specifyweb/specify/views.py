@@ -10,6 +10,7 @@ from django.db import router
 
 from .specify_jar import specify_jar
 from . import api, models
+from .bulk import bulk_dispatch
 
 if settings.ANONYMOUS_USER:
     login_maybe_required = lambda func: func
@@ -52,6 +53,7 @@ def api_view(dispatch_func):
 
 resource = api_view(api.resource_dispatch)
 collection = api_view(api.collection_dispatch)
+bulk = api_view(bulk_dispatch)
 
 def raise_error(request):
     raise Exception('This error is a test. You may now return to your regularly '
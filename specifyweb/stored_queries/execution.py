@@ -1,30 +1,56 @@
 import os
-import re
+import io
+import gzip
+import shutil
 import logging
 import json
 import csv
-import xml.dom.minidom
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element, SubElement
 
+from array import array
 from collections import namedtuple
+from itertools import islice
 from datetime import datetime
+from uuid import uuid4
 
 from django.conf import settings
 
-from sqlalchemy.sql.expression import asc, desc, insert, literal
+from sqlalchemy import func, types
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.expression import asc, desc, insert, literal, literal_column, distinct as sql_distinct, \
+    case, cast, or_, bindparam
 
 from ..specify.models import Collection
 from ..notifications.models import Message
 
-from . import models
+from . import models, plan_cache, result_cache, result_sessions
 from .queryfield import QueryField
 from .format import ObjectFormatter
 from .query_construct import QueryConstruct
+from .select_into_outfile import SelectIntoOutfile
 
 
 logger = logging.getLogger(__name__)
 
 SORT_TYPES = [None, asc, desc]
 
+# Exported rows are fetched from the database and written to the
+# file in batches of this many.
+EXPORT_BATCH_SIZE = 2000
+
+# Size in bytes of the write buffer of export files.
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# Translation table replacing line breaks in exported values with spaces.
+NEWLINES_TO_SPACES = str.maketrans('\r\n', '  ')
+
+# Queries expected to return at least this many rows evaluate their
+# aggregated to-many fields as grouped derived tables.
+GROUPED_AGGREGATION_MIN_ROWS = 1000
+
+PAGE_IDS_PARAM = 'page_ids'
+
 def set_group_concat_max_len(session):
     """The default limit on MySQL group concat function is quite
     small. This function increases it for the database connection for
@@ -106,7 +132,7 @@ def field_specs_from_json(json_fields):
     return [QueryField.from_spqueryfield(ephemeral_field_from_json(data))
             for data in sorted(json_fields, key=lambda field: field['position'])]
 
-def do_export(spquery, collection, user, filename, exporttype, host):
+def do_export(spquery, collection, user, filename, exporttype, host, progress=None):
     """Executes the given deserialized query definition, sending the
     to a file, and creates "export completed" message when finished.
 
@@ -123,10 +149,11 @@ def do_export(spquery, collection, user, filename, exporttype, host):
         field_specs = field_specs_from_json(spquery['fields'])
         if exporttype == 'csv':
             query_to_csv(session, collection, user, tableid, field_specs, path,
-                         recordsetid=recordsetid, add_header=True, strip_id=True)
+                         recordsetid=recordsetid, add_header=True, strip_id=True,
+                         compress=filename.endswith('.gz'), progress=progress)
         elif exporttype == 'kml':
             query_to_kml(session, collection, user, tableid, field_specs, path, spquery['captions'], host,
-                         recordsetid=recordsetid, add_header=True, strip_id=False)
+                         recordsetid=recordsetid, add_header=True, strip_id=False, progress=progress)
 
     Message.objects.create(user=user, content=json.dumps({
         'type': 'query-export-complete',
@@ -149,36 +176,165 @@ def stored_query_to_csv(query_id, collection, user, path):
         query_to_csv(session, collection, user, tableid, field_specs, path)
 
 def query_to_csv(session, collection, user, tableid, field_specs, path,
-                 recordsetid=None, add_header=False, strip_id=False, row_filter=None):
+                 recordsetid=None, add_header=False, strip_id=False, row_filter=None,
+                 compress=False, batch_size=EXPORT_BATCH_SIZE, progress=None):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs and send the results to a CSV file at the given
     file path.
 
+    compress = if True, the file is written gzip compressed.
+
+    batch_size = the number of rows fetched from the database and
+    written to the file at a time.
+
+    progress = if given, called with the number of rows written so far
+    after every batch.
+
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True)
+    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True,
+                            grouped_aggregation=use_grouped_aggregation(session, recordsetid=recordsetid))
 
     logger.debug('query_to_csv starting')
 
-    with open(path, 'w', newline='', encoding='utf-8') as f:
+    header = None
+    if add_header:
+        header = [fs.fieldspec.to_stringid() for fs in field_specs if fs.display]
+        if not strip_id:
+            header = ['id'] + header
+
+    if row_filter is None and not compress:
+        directory = outfile_directory(session)
+        if directory is not None and query_to_csv_outfile(session, query, path, directory, header, strip_id):
+            logger.debug('query_to_csv finished using select into outfile')
+            return
+
+    with open_export_file(path, compress) as f:
         csv_writer = csv.writer(f)
-        if add_header:
-            header = [fs.fieldspec.to_stringid() for fs in field_specs if fs.display]
-            if not strip_id:
-                header = ['id'] + header
+        if header is not None:
             csv_writer.writerow(header)
 
-        for row in query.yield_per(1):
-            if row_filter is not None and not row_filter(row): continue
-            encoded = [
-                re.sub('\r|\n', ' ', str(f))
-                for f in (row[1:] if strip_id else row)
-            ]
-            csv_writer.writerow(encoded)
+        write_csv_rows(csv_writer, query.yield_per(batch_size), strip_id, row_filter, batch_size, progress)
 
     logger.debug('query_to_csv finished')
 
+def outfile_directory(session):
+    """Return the directory to write exports to with SELECT ... INTO
+    OUTFILE, or None if that is not enabled or not allowed by the
+    database server.
+
+    The directory has to be on the database server and be visible to
+    the web app at the same path, i.e. the server is on the same host
+    or the directory is shared.
+    """
+    directory = settings.EXPORT_OUTFILE_DIR
+    if not settings.EXPORT_SELECT_INTO_OUTFILE or directory is None or not os.path.isdir(directory):
+        return None
+
+    # NULL means the server does not allow writing files at all and ''
+    # means it allows writing them anywhere.
+    secure_file_priv = session.execute("SELECT @@secure_file_priv").scalar()
+    if secure_file_priv is None:
+        logger.info("select into outfile is disabled by the server")
+        return None
+    if secure_file_priv != '':
+        allowed, directory = os.path.realpath(secure_file_priv), os.path.realpath(directory)
+        if os.path.commonpath([allowed, directory]) != allowed:
+            logger.info("%s is outside secure_file_priv: %s", directory, secure_file_priv)
+            return None
+    return directory
+
+def csv_field(expr, only_field=False):
+    """Return an SQL expression formatting expr the way write_csv_rows
+    writes a value with the default csv dialect: line breaks replaced
+    with spaces, NULL written as None, and the value enclosed in quotes
+    with embedded quotes doubled if it contains a comma or a quote. A
+    row with a single empty field is written as "".
+    """
+    value = func.replace(func.replace(func.coalesce(cast(expr, types.CHAR), 'None'), '\r', ' '), '\n', ' ')
+    quoted = func.concat('"', func.replace(value, '"', '""'), '"')
+    whens = [(or_(func.locate(',', value) > 0, func.locate('"', value) > 0), quoted)]
+    if only_field:
+        whens.insert(0, (value == '', '""'))
+    return case(whens, else_=value)
+
+def query_to_csv_outfile(session, query, path, directory, header=None, strip_id=False):
+    """Have the database server write the results of query to a file in
+    directory with SELECT ... INTO OUTFILE, then write header and the
+    results to path. The file is the same as query_to_csv would write
+    in Python.
+
+    Returns False, leaving nothing at path, if the server could not
+    write the results or they could not be read back.
+    """
+    exprs = [column['expr'] for column in query.column_descriptions]
+    if strip_id:
+        exprs = exprs[1:]
+    select = query.with_entities(*[csv_field(expr, len(exprs) == 1) for expr in exprs]).statement
+
+    outfile = os.path.join(directory, 'specify_export_%s.csv' % uuid4().hex)
+    part = path + '.part'
+    try:
+        session.execute(SelectIntoOutfile(select, outfile, fields_terminated_by=',', enclosed_by='',
+                                          optionally_enclosed=False, escaped_by='',
+                                          lines_terminated_by='\r\n', character_set='utf8mb4'))
+
+        with open(part, 'wb') as f:
+            if header is not None:
+                header_line = io.StringIO(newline='')
+                csv.writer(header_line).writerow(header)
+                f.write(header_line.getvalue().encode('utf-8'))
+            with open(outfile, 'rb') as results:
+                shutil.copyfileobj(results, f, EXPORT_BUFFER_SIZE)
+        os.replace(part, path)
+    except (DBAPIError, OSError) as e:
+        logger.warning("select into outfile export failed, exporting in python instead: %s", e)
+        if os.path.exists(part):
+            os.remove(part)
+        return False
+    finally:
+        if os.path.exists(outfile):
+            try:
+                os.remove(outfile)
+            except OSError as e:
+                logger.warning("could not remove select into outfile results: %s", e)
+    return True
+
+def open_export_file(path, compress=False, buffer_size=EXPORT_BUFFER_SIZE):
+    """Open the file at path for writing UTF-8 text through a buffer
+    of buffer_size bytes, gzip compressing it if compress is True.
+    """
+    if compress:
+        return io.TextIOWrapper(io.BufferedWriter(gzip.GzipFile(path, 'wb', compresslevel=6), buffer_size),
+                                encoding='utf-8', newline='')
+    return open(path, 'w', newline='', encoding='utf-8', buffering=buffer_size)
+
+def write_csv_rows(csv_writer, rows, strip_id=False, row_filter=None, batch_size=EXPORT_BATCH_SIZE,
+                   progress=None):
+    """Write rows with csv_writer a batch at a time, replacing the line
+    breaks in the values with spaces. The id in the first column of
+    each row is left out if strip_id is True, and rows for which
+    row_filter returns False are skipped. If given, progress is called
+    with the number of rows read after every batch.
+    """
+    rows = iter(rows)
+    start = 1 if strip_id else 0
+    done = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        done += len(batch)
+        if row_filter is not None:
+            batch = [row for row in batch if row_filter(row)]
+        csv_writer.writerows(
+            [str(value).translate(NEWLINES_TO_SPACES) for value in row[start:]]
+            for row in batch
+        )
+        if progress is not None:
+            progress(done)
+
 def row_has_geocoords(coord_cols, row):
     """Assuming single point
     """
@@ -186,26 +342,20 @@ def row_has_geocoords(coord_cols, row):
 
 
 def query_to_kml(session, collection, user, tableid, field_specs, path, captions, host,
-                 recordsetid=None, add_header=False, strip_id=False):
+                 recordsetid=None, add_header=False, strip_id=False, progress=None):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs and send the results to a kml file at the given
-    file path.
+    file path. If given, progress is called with the number of rows
+    read after every batch.
 
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True)
+    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True,
+                            grouped_aggregation=use_grouped_aggregation(session, recordsetid=recordsetid))
 
     logger.debug('query_to_kml starting')
 
-    kmlDoc = xml.dom.minidom.Document()
-
-    kmlElement = kmlDoc.createElementNS('http://earth.google.com/kml/2.2', 'kml')
-    kmlElement.setAttribute('xmlns','http://earth.google.com/kml/2.2')
-    kmlElement = kmlDoc.appendChild(kmlElement)
-    documentElement = kmlDoc.createElement('Document')
-    documentElement = kmlElement.appendChild(documentElement)
-
     if not strip_id:
         model = models.models_by_tableid[tableid]
         table = str(getattr(model, model._id)).split('.')[0].lower() #wtfiw
@@ -214,13 +364,18 @@ def query_to_kml(session, collection, user, tableid, field_specs, path, captions
 
     coord_cols = getCoordinateColumns(field_specs, table != None)
 
-    for row in query.yield_per(1):
-        if row_has_geocoords(coord_cols, row):
-            placemarkElement = createPlacemark(kmlDoc, row, coord_cols, table, captions, host)
-            documentElement.appendChild(placemarkElement)
-
-    with open(path, 'wb') as kmlFile:
-        kmlFile.write(kmlDoc.toprettyxml('  ', newl = '\n', encoding = 'utf-8'))
+    # The document is written a placemark at a time as the rows arrive
+    # so that memory use doesn't grow with the number of results.
+    with open(path, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE) as kmlFile:
+        kmlFile.write(KML_HEAD)
+        for done, row in enumerate(query.yield_per(EXPORT_BATCH_SIZE), 1):
+            if progress is not None and done % EXPORT_BATCH_SIZE == 0:
+                progress(done)
+            if row_has_geocoords(coord_cols, row):
+                placemarkElement = createPlacemark(row, coord_cols, table, captions, host)
+                kmlFile.write(ElementTree.tostring(placemarkElement, encoding='unicode'))
+                kmlFile.write('\n')
+        kmlFile.write(KML_TAIL)
 
     logger.debug('query_to_kml finished')
 
@@ -253,53 +408,39 @@ def getCoordinateColumns(field_specs, hasId):
 
     return result
 
-def createPlacemark(kmlDoc, row, coord_cols, table, captions, host):
-  # This creates a  element for a row of data.
-    #print row
-    placemarkElement = kmlDoc.createElement('Placemark')
-    extElement = kmlDoc.createElement('ExtendedData')
-    placemarkElement.appendChild(extElement)
+KML_HEAD = ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<kml xmlns="http://earth.google.com/kml/2.2">\n'
+            '<Document>\n')
+
+KML_TAIL = '</Document>\n</kml>\n'
+
+def createPlacemark(row, coord_cols, table, captions, host):
+    # This creates a Placemark element for a row of data.
+    placemarkElement = Element('Placemark')
+    extElement = SubElement(placemarkElement, 'ExtendedData')
 
-    # Loop through the columns and create a  element for every field that has a value.
+    def add_data(name, value):
+        dataElement = SubElement(extElement, 'Data', name=name)
+        SubElement(dataElement, 'value').text = value
+
+    # Loop through the columns and create a Data element for every field.
     adj = 0 if table == None else 1
-    nameElement = kmlDoc.createElement('name')
-    nameText = kmlDoc.createTextNode(row[adj])
-    nameElement.appendChild(nameText)
-    placemarkElement.appendChild(nameElement)
+    SubElement(placemarkElement, 'name').text = str(row[adj])
     for f in range(adj, len(row)):
         if f not in coord_cols:
-            dataElement = kmlDoc.createElement('Data')
-            dataElement.setAttribute('name', captions[f-adj])
-            valueElement = kmlDoc.createElement('value')
-            dataElement.appendChild(valueElement)
-            valueText = kmlDoc.createTextNode(row[f])
-            valueElement.appendChild(valueText)
-            extElement.appendChild(dataElement)
-
-
+            add_data(captions[f-adj], str(row[f]))
 
     #display coords
-    crdElement = kmlDoc.createElement('Data')
-    crdElement.setAttribute('name', 'coordinates')
-    crdValue = kmlDoc.createElement('value')
-    crdElement.appendChild(crdValue)
     crdStr = row[coord_cols[1]] + ', ' + row[coord_cols[0]]
     if len(coord_cols) >= 4:
         crdStr += ' : ' + row[coord_cols[3]] + ', ' + row[coord_cols[2]]
     if len(coord_cols) == 5:
         crdStr += ' (' + row[coord_cols[4]] + ')'
-    crdValue.appendChild(kmlDoc.createTextNode(crdStr))
-    extElement.appendChild(crdElement)
+    add_data('coordinates', crdStr)
 
     #add the url
     if table != None:
-        urlElement = kmlDoc.createElement('Data')
-        urlElement.setAttribute('name', 'go to')
-        urlValue = kmlDoc.createElement('value')
-        urlElement.appendChild(urlValue)
-        urlText = kmlDoc.createTextNode(host + '/specify/view/' + table + '/' + str(row[0]) + '/')
-        urlValue.appendChild(urlText)
-        extElement.appendChild(urlElement)
+        add_data('go to', host + '/specify/view/' + table + '/' + str(row[0]) + '/')
 
     #add coords
     if len(coord_cols) == 5:
@@ -309,51 +450,40 @@ def createPlacemark(kmlDoc, row, coord_cols, table, captions, host):
     else:
         coord_type = 'point'
 
-
-    pointElement = kmlDoc.createElement('Point')
-    coordinates = row[coord_cols[0]] + ',' + row[coord_cols[1]]
-    coorElement = kmlDoc.createElement('coordinates')
-    coorElement.appendChild(kmlDoc.createTextNode(coordinates))
-    pointElement.appendChild(coorElement)
+    pointElement = Element('Point')
+    SubElement(pointElement, 'coordinates').text = row[coord_cols[0]] + ',' + row[coord_cols[1]]
 
     if coord_type == 'point':
-        placemarkElement.appendChild(pointElement)
+        placemarkElement.append(pointElement)
     else:
-        multiElement = kmlDoc.createElement('MultiGeometry')
-        multiElement.appendChild(pointElement)
+        multiElement = SubElement(placemarkElement, 'MultiGeometry')
+        multiElement.append(pointElement)
         if coord_type == 'line':
-            lineElement = kmlDoc.createElement('LineString')
-            tessElement = kmlDoc.createElement('tessellate')
-            tessElement.appendChild(kmlDoc.createTextNode('1'))
-            lineElement.appendChild(tessElement)
+            lineElement = SubElement(multiElement, 'LineString')
+            SubElement(lineElement, 'tessellate').text = '1'
             coordinates =  row[coord_cols[0]] + ',' + row[coord_cols[1]] + ' ' +  row[coord_cols[2]] + ',' + row[coord_cols[3]]
-            coorElement = kmlDoc.createElement('coordinates')
-            coorElement.appendChild(kmlDoc.createTextNode(coordinates))
-            lineElement.appendChild(coorElement)
-            multiElement.appendChild(lineElement)
+            SubElement(lineElement, 'coordinates').text = coordinates
         else:
-            ringElement = kmlDoc.createElement('LinearRing')
-            tessElement = kmlDoc.createElement('tessellate')
-            tessElement.appendChild(kmlDoc.createTextNode('1'))
-            ringElement.appendChild(tessElement)
+            ringElement = SubElement(multiElement, 'LinearRing')
+            SubElement(ringElement, 'tessellate').text = '1'
             coordinates = row[coord_cols[0]] + ',' + row[coord_cols[1]]
             coordinates += ' ' + row[coord_cols[2]] + ',' + row[coord_cols[1]]
             coordinates += ' ' + row[coord_cols[2]] + ',' + row[coord_cols[3]]
             coordinates += ' ' + row[coord_cols[0]] + ',' + row[coord_cols[3]]
             coordinates += ' ' + row[coord_cols[0]] + ',' + row[coord_cols[1]]
-            coorElement = kmlDoc.createElement('coordinates')
-            coorElement.appendChild(kmlDoc.createTextNode(coordinates))
-            ringElement.appendChild(coorElement)
-            multiElement.appendChild(ringElement)
-
-        placemarkElement.appendChild(multiElement)
+            SubElement(ringElement, 'coordinates').text = coordinates
 
     return placemarkElement
 
 
-def run_ephemeral_query(collection, user, spquery):
+def run_ephemeral_query(collection, user, spquery, use_result_cache=False):
     """Execute a Specify query from deserialized json and return the results
     as an array for json serialization to the web app.
+
+    use_result_cache = if True, the results may be served from the
+    result cache. Only for callers that run the same queries over and
+    over and can take results up to RESULT_CACHE_TTL seconds old, like
+    the report runner. See result_cache.
     """
     logger.info('ephemeral query: %s', spquery)
     limit = spquery.get('limit', 20)
@@ -374,7 +504,8 @@ def run_ephemeral_query(collection, user, spquery):
         field_specs = field_specs_from_json(spquery['fields'])
 
         return execute(session, collection, user, tableid, distinct, count_only,
-                       field_specs, limit, offset, recordsetid, formatauditobjs=format_audits)
+                       field_specs, limit, offset, recordsetid, formatauditobjs=format_audits,
+                       resultsession=spquery.get('resultsession', None), use_result_cache=use_result_cache)
 
 def augment_field_specs(field_specs, formatauditobjs=False):
     print("augment_field_specs ######################################")
@@ -435,55 +566,213 @@ def recordset(collection, user, user_agent, recordset_info):
 
     return new_rs_id
 
-def execute(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset, recordsetid=None, formatauditobjs=False):
-    "Build and execute a query, returning the results as a data structure for json serialization"
+def execute(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset, recordsetid=None, formatauditobjs=False, resultsession=None, use_result_cache=False):
+    """Build and execute a query, returning the results as a data structure for json serialization
+
+    resultsession = if given, the results are read from a snapshot of
+    the query's results. It is either True, to make a new snapshot, or
+    the token of a snapshot returned with earlier results of the query.
+    See execute_in_result_session.
+
+    use_result_cache = if True, the results are taken from and kept in
+    the result cache. See result_cache.
+    """
 
     set_group_concat_max_len(session)
-    query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid, formatauditobjs=formatauditobjs)
 
-    if distinct:
-        query = query.distinct()
+    if resultsession and not count_only and not distinct:
+        data = execute_in_result_session(session, collection, user, tableid, field_specs, limit, offset,
+                                         recordsetid, formatauditobjs, resultsession)
+        if data is not None:
+            return data
+
+    if use_result_cache:
+        cache_key = result_cache.result_key(
+            plan_cache.plan_key(collection, user, tableid, field_specs,
+                                distinct=bool(distinct), count_only=bool(count_only),
+                                recordsetid=recordsetid, formatauditobjs=bool(formatauditobjs)),
+            limit, offset)
+        data = result_cache.get(cache_key)
+        if data is not None:
+            logger.debug("using cached results")
+            return data
+
+    def build():
+        return build_statement(session, collection, user, tableid, distinct, count_only, field_specs, bool(limit),
+                               recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                               grouped_aggregation=grouped_aggregation)
+
+    grouped_aggregation = not count_only and use_grouped_aggregation(session, limit, offset, recordsetid)
+
+    # The statement is the same for every page of the results, so it
+    # is only built once and the offset and limit are bound for each
+    # execution.
+    key = plan_cache.plan_key(collection, user, tableid, field_specs,
+                              distinct=bool(distinct), count_only=bool(count_only), limited=bool(limit),
+                              recordsetid=recordsetid, formatauditobjs=bool(formatauditobjs),
+                              grouped_aggregation=grouped_aggregation)
+    statement = plan_cache.get_plan(session, key, build)
+
+    if use_result_cache:
+        versions = result_cache.versions_of(statement.statement)
 
     if count_only:
-        return {'count': query.count()}
+        data = {'count': plan_cache.execute_plan(session, statement).scalar()}
     else:
-        logger.debug("order by: %s", order_by_exprs)
-        query = query.order_by(*order_by_exprs).offset(offset)
-        if limit:
-            query = query.limit(limit)
+        data = {'results': [tuple(row) for row in plan_cache.execute_plan(session, statement, offset, limit)]}
 
-        return {'results': list(query)}
+    if use_result_cache:
+        result_cache.put(cache_key, versions, data)
+    return data
 
-def build_query(session, collection, user, tableid, field_specs, recordsetid=None, replace_nulls=False, formatauditobjs=False):
-    """Build a sqlalchemy query using the QueryField objects given by
-    field_specs.
+def build_statement(session, collection, user, tableid, distinct, count_only, field_specs, limited,
+                    recordsetid=None, formatauditobjs=False, grouped_aggregation=False):
+    """Build the statement executed for a query. Unless count_only, the
+    offset, and the limit if limited, are left as bind parameters. See
+    plan_cache.paged.
+    """
+    if count_only:
+        count_query = build_count_query(session, collection, user, tableid, distinct, field_specs, recordsetid=recordsetid, formatauditobjs=formatauditobjs)
+        if count_query is not None:
+            return count_query.statement
 
-    session = an sqlalchemy Session instance.
+    query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid,
+                                        formatauditobjs=formatauditobjs, grouped_aggregation=grouped_aggregation)
 
-    collection = an instance of specifyweb.specify.models.Collection.
-    Returned records will be filtered to the scope of the collection.
+    if distinct:
+        query = query.distinct()
 
-    user = an instance of specifyweb.specify.models.Specifyuser.  The
-    user will be used in the lookup process for any formatters that
-    are used.
+    if count_only:
+        return query.from_self(func.count(literal_column('*'))).statement
 
-    tableid = an integer that indicates the "base table" of the query.
-    See specify_datamodel.xml.
+    logger.debug("order by: %s", order_by_exprs)
+    return plan_cache.paged(query.order_by(*order_by_exprs).statement, limited)
 
-    field_specs = [QueryField instances] defining the fields of
-    the Specify query.
+def execute_in_result_session(session, collection, user, tableid, field_specs, limit, offset,
+                              recordsetid=None, formatauditobjs=False, token=None):
+    """Return a page of the results of a query from the result session
+    with 'token', making a new snapshot of the results if there is no
+    such session. A session sorted differently is sorted again in
+    memory. The data includes the token of the session and the number
+    of results. Returns None if the query can't be snapshotted.
 
-    recordsetid = integer id of a row from the RecordSet table. Results
-    will be filtered to items from the given record set unless None.
+    See result_sessions.
+    """
+    key = result_sessions.session_key(collection, user, tableid, field_specs,
+                                      recordsetid=recordsetid, formatauditobjs=bool(formatauditobjs))
+    sort = result_sessions.sort_spec(field_specs)
+
+    result = result_sessions.get(token, key) if isinstance(token, str) else None
+    if result is None:
+        if result_sessions.too_large(key):
+            return None
+        result = snapshot_results(session, collection, user, tableid, field_specs, recordsetid,
+                                  formatauditobjs, key, sort)
+        if result is None:
+            return None
+        result_sessions.put(result)
+
+    ids = result.ids_sorted(sort)
+    page = ids[offset:offset + limit] if limit else ids[offset:]
+    return {
+        'results': fetch_result_page(session, collection, user, tableid, field_specs, page, formatauditobjs),
+        'count': len(ids),
+        'resultsession': result.token,
+    }
+
+def snapshot_results(session, collection, user, tableid, field_specs, recordsetid, formatauditobjs, key, sort):
+    """Run the query selecting only the ids in the query's order, and
+    the sort keys of all the fields, and return them as a ResultSession,
+    or None if the records don't have a single result row each or there
+    are too many results.
+
+    The sort keys of strings are their WEIGHT_STRING, so that sorting
+    the snapshot again orders them in the database's collation.
+    """
+    formatter = ObjectFormatter(collection, user, False)
+    for fs in field_specs:
+        formatted_table = fs.fieldspec.formatted_table()
+        if fs.fieldspec.joins_to_many() or formatted_table is not None and formatter.joins_to_many(
+                formatted_table, None if fs.fieldspec.get_field() is None else fs.format_name):
+            logger.debug("not snapshotting results because %s can multiply the rows", fs)
+            return None
 
-    replace_nulls = if True, replace null values with ""
+    model = models.models_by_tableid[tableid]
+    id_field = getattr(model, model._id)
+
+    # Every field is sorted to get the expressions the database sorts
+    # it by.
+    query, order_by_exprs = build_query(session, collection, user, tableid,
+                                        [fs._replace(sort_type=1) for fs in field_specs],
+                                        recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                                        grouped_aggregation=use_grouped_aggregation(session, recordsetid=recordsetid))
+    columns = [expr.element for expr in order_by_exprs]
+    sort_keys = [func.weight_string(column) if isinstance(column.type, types.String) else column
+                 for column in columns]
+    # One row more than is kept tells whether there are too many.
+    query = query.with_entities(id_field, *sort_keys) \
+                 .order_by(*[SORT_TYPES[sort_type](columns[index]) for index, sort_type in sort]) \
+                 .limit(result_sessions.MAX_ROWS + 1)
+
+    rows = list(query.yield_per(EXPORT_BATCH_SIZE))
+    if len(rows) > result_sessions.MAX_ROWS:
+        logger.debug("not snapshotting more than %d results", result_sessions.MAX_ROWS)
+        result_sessions.mark_too_large(key)
+        return None
+
+    ids = array('q', (row[0] for row in rows))
+    ranks = result_sessions.rank_columns(rows, range(1, len(columns) + 1))
+    return result_sessions.ResultSession(key, sort, ids, ranks)
+
+def fetch_result_page(session, collection, user, tableid, field_specs, page, formatauditobjs=False):
+    "Return the result rows of the records with the ids in 'page', in that order."
+    if not page:
+        return []
+
+    def build():
+        model = models.models_by_tableid[tableid]
+        id_field = getattr(model, model._id)
+        query, __ = build_query(session, collection, user, tableid, field_specs, formatauditobjs=formatauditobjs)
+        return query.filter(id_field.in_(bindparam(PAGE_IDS_PARAM, expanding=True))).statement
+
+    key = plan_cache.plan_key(collection, user, tableid, field_specs,
+                              result_page=True, formatauditobjs=bool(formatauditobjs))
+    statement = plan_cache.get_plan(session, key, build)
+    rows = session.connection().execute(statement, {PAGE_IDS_PARAM: list(page)})
+
+    by_id = {row[0]: tuple(row) for row in rows}
+    # Records deleted since the snapshot was made are left out.
+    return [by_id[id] for id in page if id in by_id]
+
+def use_grouped_aggregation(session, limit=None, offset=0, recordsetid=None):
+    """Decide how to evaluate the aggregated to-many fields of a query
+    returning the rows from offset to offset + limit, or all the rows if
+    limit is None, restricted to the record set with recordsetid unless
+    it is None.
+
+    A correlated subquery is evaluated once per result row, which is
+    cheapest for a page of results. A grouped derived table aggregates
+    the related records of the whole table at once, which is cheaper
+    once many rows are returned.
+    """
+    expected = offset + limit if limit else None
+    if recordsetid is not None:
+        size = session.query(func.count(models.RecordSetItem.recordSetItemId)) \
+               .filter(models.RecordSetItem.RecordSetID == recordsetid).scalar()
+        expected = size if expected is None else min(expected, size)
+    return expected is None or expected >= GROUPED_AGGREGATION_MIN_ROWS
+
+def start_query(session, collection, user, tableid, recordsetid=None, replace_nulls=False, grouped_aggregation=False):
+    """Return a QueryConstruct selecting the ids of the "base table" given
+    by tableid, filtered to the scope of the collection and to the
+    record set with recordsetid unless it is None.
     """
     model = models.models_by_tableid[tableid]
     id_field = getattr(model, model._id)
 
     query = QueryConstruct(
         collection=collection,
-        objectformatter=ObjectFormatter(collection, user, replace_nulls),
+        objectformatter=ObjectFormatter(collection, user, replace_nulls, grouped_aggregation),
         query=session.query(id_field),
     )
 
@@ -497,6 +786,81 @@ def build_query(session, collection, user, tableid, field_specs, recordsetid=Non
         query = query.join(models.RecordSetItem, models.RecordSetItem.recordId == id_field) \
                 .filter(models.RecordSetItem.recordSet == recordset)
 
+    return query
+
+def build_count_query(session, collection, user, tableid, distinct, field_specs, recordsetid=None, formatauditobjs=False):
+    """Build a sqlalchemy query counting the rows the query given by the
+    arguments would return, or return None if that takes the full query.
+
+    Only the joins and predicates that affect the number of rows are
+    kept. Display columns, their formatters and aggregations are
+    dropped, keeping the joins of those that cross a to-many
+    relationship. A distinct query is counted as COUNT(DISTINCT id),
+    which is only the same when every displayed value is determined by
+    the id of the row, i.e. none of them is reached through a to-many
+    relationship.
+    """
+    model = models.models_by_tableid[tableid]
+    id_field = getattr(model, model._id)
+
+    query = start_query(session, collection, user, tableid, recordsetid)
+    formatter = query.objectformatter
+
+    for fs in field_specs:
+        formatted_table = fs.fieldspec.formatted_table()
+        path_multiplies_rows = fs.fieldspec.joins_to_many()
+        formatter_multiplies_rows = formatted_table is not None and formatter.joins_to_many(
+            formatted_table, None if fs.fieldspec.get_field() is None else fs.format_name)
+
+        if distinct:
+            # Extra rows of the same record are collapsed unless they
+            # differ in a displayed value.
+            if fs.display and (path_multiplies_rows or formatter_multiplies_rows):
+                logger.debug("counting with the full query because %s is not determined by the id", fs)
+                return None
+        elif formatter_multiplies_rows:
+            logger.debug("counting with the full query because of the formatter for %s", fs)
+            return None
+
+        if fs.has_filter():
+            query, __ = fs.add_to_query(query, formatauditobjs=formatauditobjs)
+        elif path_multiplies_rows and not distinct:
+            query = fs.fieldspec.add_joins(query)
+
+    count = func.count(sql_distinct(id_field)) if distinct else func.count(id_field)
+    logger.debug("count query: %s", query.query)
+    return query.query.with_entities(count)
+
+def build_query(session, collection, user, tableid, field_specs, recordsetid=None, replace_nulls=False, formatauditobjs=False, grouped_aggregation=False):
+    """Build a sqlalchemy query using the QueryField objects given by
+    field_specs.
+
+    session = an sqlalchemy Session instance.
+
+    collection = an instance of specifyweb.specify.models.Collection.
+    Returned records will be filtered to the scope of the collection.
+
+    user = an instance of specifyweb.specify.models.Specifyuser.  The
+    user will be used in the lookup process for any formatters that
+    are used.
+
+    tableid = an integer that indicates the "base table" of the query.
+    See specify_datamodel.xml.
+
+    field_specs = [QueryField instances] defining the fields of
+    the Specify query.
+
+    recordsetid = integer id of a row from the RecordSet table. Results
+    will be filtered to items from the given record set unless None.
+
+    replace_nulls = if True, replace null values with ""
+
+    grouped_aggregation = if True, aggregated to-many fields are
+    evaluated as grouped derived tables joined to the query instead of
+    correlated subqueries. See use_grouped_aggregation.
+    """
+    query = start_query(session, collection, user, tableid, recordsetid, replace_nulls, grouped_aggregation)
+
     order_by_exprs = []
     #augment_field_specs(field_specs, formatauditobjs)
     for fs in field_specs:
@@ -1,17 +1,20 @@
 import logging
 import re
+from collections import namedtuple
+from time import time
 
 from xml.etree import ElementTree
-from xml.sax.saxutils import quoteattr
 
 from sqlalchemy import orm, inspect
 from sqlalchemy.sql.expression import case, func, cast, literal
 from sqlalchemy.sql.functions import concat, count
 from sqlalchemy import types
 
+from django.db.models import Count, Max, Sum, signals
+
 from specifyweb.context.app_resource import get_app_resource
 from specifyweb.context.remote_prefs import get_remote_prefs
-from specifyweb.specify.models import datamodel, Spappresourcedata, Splocalecontainer, Splocalecontaineritem
+from specifyweb.specify.models import datamodel, Spappresource, Spappresourcedata, Splocalecontainer, Splocalecontaineritem
 
 from . import models
 from .group_concat import group_concat
@@ -24,10 +27,109 @@ CollectionObject_model = datamodel.get_table('CollectionObject')
 Agent_model = datamodel.get_table('Agent')
 Spauditlog_model = datamodel.get_table('SpAuditLog')
 
+class FormatterDefs(object):
+    """The data object formatter and aggregator definitions of a
+    DataObjFormatters app resource, indexed by name and by class.
+    """
+    def __init__(self, formattersXML):
+        formattersDom = ElementTree.fromstring(formattersXML)
+        formatters = formattersDom.findall('format')
+        aggregators = formattersDom.findall('aggregators/aggregator')
+        self.formatters = {attr: index_by(formatters, attr) for attr in ('name', 'class')}
+        self.aggregators = {attr: index_by(aggregators, attr) for attr in ('name', 'class')}
+
+def index_by(nodes, attr):
+    # The first definition wins, as it would with ElementTree.find.
+    index = {}
+    for node in nodes:
+        if attr in node.attrib:
+            index.setdefault(node.attrib[attr], node)
+    return index
+
+# Seconds between checks of the database for formatter definitions
+# changed by other processes. Changes made by this process are noticed
+# immediately.
+FORMATTERS_CHECK_INTERVAL = 30
+
+CachedDefs = namedtuple('CachedDefs', 'defs stamp checked')
+
+# CachedDefs keyed by (collection id, user id).
+formatter_defs_cache = {}
+
+def get_formatters_stamp():
+    """Return a value that changes whenever a DataObjFormatters app
+    resource is added, removed or saved.
+    """
+    return tuple(Spappresourcedata.objects.filter(
+        spappresource__name='DataObjFormatters'
+    ).aggregate(
+        Count('id'), Sum('version'), Max('timestampmodified')
+    ).values())
+
+def get_formatter_defs(collection, user):
+    """Return the FormatterDefs of the DataObjFormatters resource for the
+    collection and user. The cached definitions are checked against the
+    database every FORMATTERS_CHECK_INTERVAL seconds.
+    """
+    key = (collection.id, user and user.id)
+    cached = formatter_defs_cache.get(key)
+    now = time()
+    if cached is not None and now - cached.checked < FORMATTERS_CHECK_INTERVAL:
+        return cached.defs
+
+    stamp = get_formatters_stamp()
+    if cached is not None and cached.stamp == stamp:
+        formatter_defs_cache[key] = cached._replace(checked=now)
+        return cached.defs
+
+    formattersXML, _ = get_app_resource(collection, user, 'DataObjFormatters')
+    defs = FormatterDefs(formattersXML)
+    formatter_defs_cache[key] = CachedDefs(defs, stamp, now)
+    return defs
+
+def formatters_changed(sender, **kwargs):
+    formatter_defs_cache.clear()
+
+for model in (Spappresource, Spappresourcedata):
+    signals.post_save.connect(formatters_changed, sender=model)
+    signals.post_delete.connect(formatters_changed, sender=model)
+
+# Maps of table names to the formatter names given in the schema
+# configuration, keyed by discipline id, with the time they were read.
+schema_formats_cache = {}
+
+# Seconds a map is used before it is read again, to pick up changes
+# made by other processes. Changes made by this process clear the
+# cache immediately.
+SCHEMA_FORMATS_TTL = 300
+
+def get_schema_formats(discipline_id):
+    """Return a dict of the lower case table names to the formatter names
+    set for them in the schema configuration of the discipline.
+    """
+    cached = schema_formats_cache.get(discipline_id)
+    if cached is not None and time() - cached[0] < SCHEMA_FORMATS_TTL:
+        return cached[1]
+
+    formats = {}
+    for name, format in Splocalecontainer.objects.filter(
+            schematype=0, discipline_id=discipline_id
+    ).values_list('name', 'format'):
+        formats.setdefault(name.lower(), format)
+
+    schema_formats_cache[discipline_id] = (time(), formats)
+    return formats
+
+def schema_formats_changed(sender, **kwargs):
+    schema_formats_cache.clear()
+
+signals.post_save.connect(schema_formats_changed, sender=Splocalecontainer)
+signals.post_delete.connect(schema_formats_changed, sender=Splocalecontainer)
+
 class ObjectFormatter(object):
-    def __init__(self, collection, user, replace_nulls):
-        formattersXML, _ = get_app_resource(collection, user, 'DataObjFormatters')
-        self.formattersDom = ElementTree.fromstring(formattersXML)
+    def __init__(self, collection, user, replace_nulls, grouped_aggregation=False):
+        self.formatter_defs = get_formatter_defs(collection, user)
+        self.grouped_aggregation = grouped_aggregation
         self.date_format = get_date_format()
         self.date_format_year = MYSQL_TO_YEAR.get(self.date_format)
         self.date_format_month = MYSQL_TO_MONTH.get(self.date_format)
@@ -36,18 +138,10 @@ class ObjectFormatter(object):
 
     def getFormatterDef(self, specify_model, formatter_name):
         def lookup(attr, val):
-            return self.formattersDom.find('format[@%s=%s]' % (attr, quoteattr(val)))
+            return self.formatter_defs.formatters[attr].get(val)
 
         def getFormatterFromSchema():
-            try:
-                formatter_name = Splocalecontainer.objects.get(
-                    name=specify_model.name.lower,
-                    schematype=0,
-                    discipline=self.collection.discipline
-                ).format
-            except Splocalecontainer.DoesNotExist:
-                return None
-
+            formatter_name = get_schema_formats(self.collection.discipline_id).get(specify_model.name.lower())
             return formatter_name and lookup('name', formatter_name)
 
         return (formatter_name and lookup('name', formatter_name)) \
@@ -56,10 +150,34 @@ class ObjectFormatter(object):
 
     def getAggregatorDef(self, specify_model, aggregator_name):
         def lookup(attr, val):
-            return self.formattersDom.find('aggregators/aggregator[@%s=%s]' % (attr, quoteattr(val)))
+            return self.formatter_defs.aggregators[attr].get(val)
         return (aggregator_name and lookup('name', aggregator_name)) \
             or lookup('class', specify_model.classname)
 
+    def joins_to_many(self, specify_model, formatter_name, seen=()):
+        """Returns True if formatting 'specify_model' with the named
+        formatter joins a to-many relationship, which would multiply
+        the rows of the query.
+        """
+        formatterNode = self.getFormatterDef(specify_model, formatter_name)
+        if formatterNode is None or formatterNode in seen:
+            return False
+
+        for fieldNode in formatterNode.iter('field'):
+            table = specify_model
+            for name in fieldNode.text.split('.'):
+                field = table.get_field(name, strict=True)
+                if not field.is_relationship:
+                    break
+                if field.type in ('one-to-many', 'many-to-many'):
+                    return True
+                table = datamodel.get_table(field.relatedModelName, strict=True)
+            else:
+                # The path ends in a relationship, which is formatted in turn.
+                if self.joins_to_many(table, fieldNode.attrib.get('formatter', None), seen + (formatterNode,)):
+                    return True
+        return False
+
     def catalog_number_is_numeric(self):
         return self.collection.catalognumformatname == 'CatalogNumberNumeric'
 
@@ -146,7 +264,7 @@ class ObjectFormatter(object):
         aggregatorNode = self.getAggregatorDef(specify_model, aggregator_name)
         if aggregatorNode is None:
             logger.warn("aggregator is not defined")
-            return literal("<Aggregator not defined.>")
+            return query, literal("<Aggregator not defined.>")
         logger.debug("using aggregator: %s", ElementTree.tostring(aggregatorNode))
         formatter_name = aggregatorNode.attrib.get('format', None)
         separator = aggregatorNode.attrib.get('separator', ',')
@@ -156,6 +274,30 @@ class ObjectFormatter(object):
         order_by = [getattr(orm_table, order_by)] if order_by != '' else []
 
         join_column = list(inspect(getattr(orm_table, field.otherSideName)).property.local_columns)[0]
+
+        if self.grouped_aggregation:
+            # Aggregate the related records of every parent at once in a
+            # derived table grouped by the parent id and join it in. The
+            # derived table is materialized before the join, so it is
+            # limited to the parents in the scope of the collection.
+            related = orm.Query([]).select_from(orm_table)
+            parents = self.scoped_ids(inspect(rel_table).mapper.class_)
+            if parents is not None:
+                related = related.filter(join_column.in_(parents))
+            subquery = QueryConstruct(
+                collection=query.collection,
+                objectformatter=self,
+                query=related
+            )
+            subquery, formatted = self.objformat(subquery, orm_table, formatter_name)
+            grouped = subquery.query.add_columns(
+                join_column.label('parent_id'),
+                group_concat(formatted, separator, *order_by).label('aggregated'),
+            ).group_by(join_column).subquery()
+
+            query = query.outerjoin(grouped, grouped.c.parent_id == getattr(rel_table, rel_table._id))
+            return query, blank_nulls(grouped.c.aggregated)
+
         subquery = QueryConstruct(
             collection=query.collection,
             objectformatter=self,
@@ -165,7 +307,16 @@ class ObjectFormatter(object):
         )
         subquery, formatted = self.objformat(subquery, orm_table, formatter_name)
         aggregated = blank_nulls(group_concat(formatted, separator, *order_by))
-        return subquery.query.add_column(aggregated).as_scalar()
+        return query, subquery.query.add_column(aggregated).as_scalar()
+
+    def scoped_ids(self, model):
+        """Return a select of the ids of the records of 'model' in the
+        scope of the collection, or None if the model isn't scoped.
+        """
+        from .execution import filter_by_collection
+        ids = orm.Query(getattr(model, model._id))
+        scoped = filter_by_collection(model, ids, self.collection)
+        return None if scoped is ids else scoped.statement
 
     def fieldformat(self, query_field, field):
         field_spec = query_field.fieldspec
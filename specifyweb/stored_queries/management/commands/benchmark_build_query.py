@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from specifyweb.specify.models import Specifyuser, Collection
+from specifyweb.specify.load_datamodel import Datamodel, Table
+
+from specifyweb.stored_queries import models
+from specifyweb.stored_queries.execution import build_query
+from specifyweb.stored_queries.queryfield import QueryField
+
+def scan_get_table(self, tablename, strict=False):
+    tablename = tablename.lower()
+    for table in self.tables:
+        if table.name.lower() == tablename:
+            return table
+    if strict:
+        raise Exception("No table with name: %r" % tablename)
+
+def scan_get_table_by_id(self, table_id, strict=False):
+    for table in self.tables:
+        if table.tableId == table_id:
+            return table
+    if strict:
+        raise Exception("No table with id: %d" % table_id)
+
+def scan_get_field(self, fieldname, strict=False):
+    fieldname = fieldname.lower()
+    for field in self.fields + self.relationships + [self.idField]:
+        if field.name.lower() == fieldname:
+            return field
+    if strict:
+        raise Exception("Field %s not in table %s. " % (fieldname, self.name))
+
+@contextmanager
+def linear_lookups():
+    """Temporarily replace the indexed datamodel lookups with linear
+    scans of the table and field lists to provide a baseline.
+    """
+    saved = Datamodel.get_table, Datamodel.get_table_by_id, Table.get_field
+    Datamodel.get_table, Datamodel.get_table_by_id, Table.get_field = \
+        scan_get_table, scan_get_table_by_id, scan_get_field
+    try:
+        yield
+    finally:
+        Datamodel.get_table, Datamodel.get_table_by_id, Table.get_field = saved
+
+class Command(BaseCommand):
+    help = 'Times build_query for a stored query with indexed and with linear datamodel lookups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('query_id', type=int, help='id of the Spquery to build')
+        parser.add_argument('collection_id', type=int)
+        parser.add_argument('specifyuser_id', type=int)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='number of timed builds')
+
+    def handle(self, **options):
+        collection = Collection.objects.get(id=options['collection_id'])
+        user = Specifyuser.objects.get(id=options['specifyuser_id'])
+
+        with models.session_context() as session:
+            sp_query = session.query(models.SpQuery).get(options['query_id'])
+            tableid = sp_query.contextTableId
+            field_specs = [QueryField.from_spqueryfield(field)
+                           for field in sorted(sp_query.fields, key=lambda field: field.position)]
+
+            def run():
+                return self.time(session, collection, user, tableid, field_specs, options['repeat'])
+
+            with linear_lookups():
+                linear = run()
+            indexed = run()
+
+        self.stdout.write("query %d with %d fields, best of %d builds"
+                          % (options['query_id'], len(field_specs), options['repeat']))
+        self.stdout.write("linear lookups:  %8.2f ms" % (linear * 1e3))
+        self.stdout.write("indexed lookups: %8.2f ms" % (indexed * 1e3))
+        self.stdout.write("speedup:         %8.2fx" % (linear / indexed))
+
+    def time(self, session, collection, user, tableid, field_specs, repeat):
+        best = None
+        for _ in range(repeat):
+            start = default_timer()
+            build_query(session, collection, user, tableid, field_specs)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
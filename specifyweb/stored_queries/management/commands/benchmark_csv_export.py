@@ -0,0 +1,81 @@
+import csv
+import os
+import re
+import tempfile
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.stored_queries.execution import open_export_file, write_csv_rows
+
+def synthetic_rows(count, columns):
+    """Yield count rows shaped like query results: an id followed by
+    text values, some of which contain line breaks.
+    """
+    values = ['Value %d' % i if i % 7 else 'Multi\r\nline %d' % i for i in range(columns)]
+    for id in range(count):
+        yield (id,) + tuple(values)
+
+def legacy_write(path, rows):
+    """Write the rows the way query_to_csv did before exports were
+    batched. Used as the baseline of the benchmark.
+    """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv_writer = csv.writer(f)
+        for row in rows:
+            encoded = [
+                re.sub('\r|\n', ' ', str(f))
+                for f in row[1:]
+            ]
+            csv_writer.writerow(encoded)
+
+def batched_write(path, rows, compress=False):
+    with open_export_file(path, compress) as f:
+        write_csv_rows(csv.writer(f), rows, strip_id=True)
+
+class Command(BaseCommand):
+    help = 'Measures the throughput of writing query results to CSV files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='number of rows to export')
+        parser.add_argument('--columns', type=int, default=10,
+                            help='number of values per row')
+        parser.add_argument('--gzip', action='store_true',
+                            help='also time writing gzip compressed output')
+
+    def handle(self, **options):
+        rows, columns = options['rows'], options['columns']
+        if rows < 1 or columns < 1:
+            raise CommandError("rows and columns must be positive")
+
+        with tempfile.TemporaryDirectory() as directory:
+            legacy_path = os.path.join(directory, 'legacy.csv')
+            batched_path = os.path.join(directory, 'batched.csv')
+
+            legacy = self.time(legacy_write, legacy_path, synthetic_rows(rows, columns))
+            batched = self.time(batched_write, batched_path, synthetic_rows(rows, columns))
+
+            with open(legacy_path, 'rb') as a, open(batched_path, 'rb') as b:
+                if a.read() != b.read():
+                    raise CommandError("exports differ")
+
+            self.stdout.write("%d rows of %d values" % (rows, columns))
+            self.report("row at a time", rows, legacy, legacy_path)
+            self.report("batched", rows, batched, batched_path)
+
+            if options['gzip']:
+                gzip_path = batched_path + '.gz'
+                compressed = self.time(batched_write, gzip_path, synthetic_rows(rows, columns), True)
+                self.report("batched gzip", rows, compressed, gzip_path)
+
+            self.stdout.write("speedup:       %8.2fx" % (legacy / batched))
+
+    def time(self, write, *args):
+        start = default_timer()
+        write(*args)
+        return default_timer() - start
+
+    def report(self, name, rows, elapsed, path):
+        self.stdout.write("%-14s %10.0f rows/s %8.1f MB" % (
+            name + ':', rows / elapsed, os.path.getsize(path) / 1e6))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+
+from specifyweb.specify.models import Specifyuser, Collection, Spquery
+
+from specifyweb.stored_queries import models
+from specifyweb.stored_queries.profile import profile_stored_query
+
+class Command(BaseCommand):
+    help = 'Profiles stored queries, reporting their SQL, query plan, joins and timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection_id', type=int)
+        parser.add_argument('specifyuser_id', type=int)
+        parser.add_argument('query_ids', type=int, nargs='*',
+                            help='ids of the Spqueries to profile, all of the user\'s if none')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='number of rows fetched, 0 for all')
+        parser.add_argument('--offset', type=int, default=0)
+        parser.add_argument('--sql', action='store_true',
+                            help='print the SQL and EXPLAIN output of every query')
+
+    def handle(self, **options):
+        collection = Collection.objects.get(id=options['collection_id'])
+        user = Specifyuser.objects.get(id=options['specifyuser_id'])
+
+        queries = Spquery.objects.filter(specifyuser=user)
+        if options['query_ids']:
+            queries = queries.filter(id__in=options['query_ids'])
+
+        reports = []
+        for query_id, name in queries.order_by('id').values_list('id', 'name'):
+            try:
+                with models.session_context() as session:
+                    report = profile_stored_query(session, query_id, collection, user,
+                                                  options['limit'], options['offset'])
+            except Exception as e:
+                self.stderr.write("query %d %r failed: %s" % (query_id, name, e))
+                continue
+
+            reports.append((query_id, name, report))
+            if options['sql']:
+                self.print_details(query_id, name, report)
+
+        # The most expensive queries first.
+        reports.sort(key=lambda r: sum(r[2]['timings'].values()), reverse=True)
+
+        self.stdout.write("%8s %10s %10s %10s %6s %6s %8s  %s" % (
+            'id', 'total ms', 'build ms', 'exec ms', 'joins', 'corr', 'rows', 'name'))
+        for query_id, name, report in reports:
+            timings = report['timings']
+            self.stdout.write("%8d %10.1f %10.1f %10.1f %6d %6d %8d  %s" % (
+                query_id, sum(timings.values()), timings['formatters'] + timings['build'],
+                timings['execute'], report['joins'], report['correlated_subqueries'],
+                report['rows'], name))
+
+    def print_details(self, query_id, name, report):
+        self.stdout.write("query %d %r" % (query_id, name))
+        self.stdout.write(report['sql'])
+        self.stdout.write("params: %s" % report['params'])
+        for row in report['explain']:
+            self.stdout.write("  " + "  ".join("%s=%s" % item for item in row.items()))
+        self.stdout.write("timings (ms): " + ", ".join(
+            "%s %.1f" % item for item in report['timings'].items()))
+        self.stdout.write("joins %d, subqueries %d of which %d correlated, grouped aggregation %s\n" % (
+            report['joins'], report['subqueries'], report['correlated_subqueries'],
+            report['grouped_aggregation']))
@@ -0,0 +1,150 @@
+"""A process wide cache of compiled stored query statements.
+
+Building a stored query means parsing the formatters, walking every
+field and joining the tables it touches. When the same query is run
+again, e.g. to fetch the next page of results, the statement compiled
+the first time is reused with the new offset and limit.
+
+Plans depend on the app resources, which provide the object formatters
+and aggregators, and on the schema localization, which provides the
+field formatters. They are dropped whenever either changes.
+"""
+from collections import OrderedDict, namedtuple
+from time import time
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import connection
+from django.db.models import signals
+from sqlalchemy import sql, types
+
+from specifyweb.specify import models as spmodels
+
+from .queryfieldspec import QueryFieldSpec
+
+# Number of compiled plans kept in memory.
+CACHE_SIZE = 256
+
+# Seconds a plan is used before it is built again regardless.
+PLAN_TTL = 600
+
+# Seconds between checks of the database for app resources or schema
+# localization changed by other processes. Changes made by this
+# process are noticed immediately.
+STAMP_CHECK_INTERVAL = 30
+
+# The tables holding the app resources and the schema localization.
+STAMP_TABLES = ('spappresource', 'spappresourcedata',
+                'splocalecontainer', 'splocalecontaineritem', 'splocaleitemstr')
+
+OFFSET_PARAM = 'plan_offset'
+LIMIT_PARAM = 'plan_limit'
+
+Plan = namedtuple('Plan', 'statement created')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stamp = None
+_last_check = None
+
+def normalize_fieldspec(fieldspec):
+    return (fieldspec.root_table.tableId,
+            tuple(field.name for field in fieldspec.join_path),
+            fieldspec.table.tableId,
+            fieldspec.date_part,
+            fieldspec.tree_rank,
+            fieldspec.tree_field)
+
+def normalize_field(field):
+    value = field.value
+    if isinstance(value, QueryFieldSpec):
+        value = normalize_fieldspec(value)
+    return (normalize_fieldspec(field.fieldspec), field.op_num, value,
+            bool(field.negate), bool(field.display), field.format_name, field.sort_type)
+
+def plan_key(collection, user, tableid, field_specs, **options):
+    """Return the cache key of a query on 'tableid' with 'field_specs'
+    run in the context of 'collection' and 'user'. The 'options' are
+    the other arguments that shape the statement, e.g. distinct,
+    count_only or recordsetid.
+    """
+    definition = repr((tableid,
+                       sorted(options.items()),
+                       [normalize_field(fs) for fs in field_specs]))
+    return (collection.id,
+            user and user.id,
+            hashlib.sha1(definition.encode('utf-8')).hexdigest())
+
+def paged(statement, limited):
+    """Return 'statement' with its offset, and its limit if 'limited',
+    left as bind parameters to be given when the plan is executed.
+    """
+    statement = statement.offset(sql.bindparam(OFFSET_PARAM, type_=types.Integer))
+    if limited:
+        statement = statement.limit(sql.bindparam(LIMIT_PARAM, type_=types.Integer))
+    return statement
+
+def get_plan(session, key, build):
+    """Return the compiled statement cached under 'key', calling
+    'build' to make the statement if there is none.
+    """
+    check_stamp()
+    now = time()
+    with _lock:
+        plan = _cache.get(key)
+        if plan is not None and now - plan.created < PLAN_TTL:
+            _cache.move_to_end(key)
+            return plan.statement
+
+    logger.debug("building plan %s", key)
+    statement = build().compile(dialect=session.bind.dialect)
+
+    with _lock:
+        _cache[key] = Plan(statement, now)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return statement
+
+def execute_plan(session, statement, offset=0, limit=None):
+    params = {OFFSET_PARAM: offset}
+    if limit:
+        params[LIMIT_PARAM] = limit
+    return session.connection().execute(statement, params)
+
+def get_stamp():
+    """Return a value that changes whenever a row of the app resource
+    or schema localization tables is added, removed or modified.
+    """
+    cursor = connection.cursor()
+    cursor.execute("select " + ", ".join(
+        "(select count(*) from {0}), (select max(timestampmodified) from {0})".format(table)
+        for table in STAMP_TABLES))
+    return cursor.fetchone()
+
+def check_stamp():
+    global _stamp, _last_check
+    if _last_check is not None and time() - _last_check < STAMP_CHECK_INTERVAL:
+        return
+    stamp = get_stamp()
+    with _lock:
+        if stamp != _stamp:
+            if _stamp is not None:
+                logger.info("app resources or schema localization changed, dropping query plans")
+            _cache.clear()
+            _stamp = stamp
+        _last_check = time()
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+def resource_changed(sender, **kwargs):
+    clear()
+
+for model in (spmodels.Spappresource, spmodels.Spappresourcedata,
+              spmodels.Splocalecontainer, spmodels.Splocalecontaineritem, spmodels.Splocaleitemstr):
+    signals.post_save.connect(resource_changed, sender=model)
+    signals.post_delete.connect(resource_changed, sender=model)
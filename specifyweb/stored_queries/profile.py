@@ -0,0 +1,172 @@
+"""Diagnostics of slow stored queries.
+
+A query is profiled by running the same steps as execution.execute,
+timing each, and reporting the SQL that was produced together with
+what the database server makes of it.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+import logging
+logger = logging.getLogger(__name__)
+
+from sqlalchemy.sql.expression import Join, Select
+
+from ..specify.api import toJson
+from ..specify.models import Collection, datamodel
+
+from . import models, plan_cache
+from .execution import build_statement, field_specs_from_json, set_group_concat_max_len, \
+    use_grouped_aggregation
+from .explain import Explain
+from .format import ObjectFormatter
+from .queryfield import QueryField
+
+@contextmanager
+def timed(timings, name):
+    "Add the time spent in the block to timings[name], in milliseconds."
+    start = default_timer()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + (default_timer() - start) * 1e3
+
+def resolve_formatters(collection, user, field_specs):
+    """Look up the formatter or aggregator definition used by every
+    field, as building the query does, and return how many were found.
+    """
+    formatter = ObjectFormatter(collection, user, False)
+    found = 0
+    for fs in field_specs:
+        fieldspec = fs.fieldspec
+        formatted_table = fieldspec.formatted_table()
+        if formatted_table is not None:
+            definition = formatter.getFormatterDef(
+                formatted_table, None if fieldspec.get_field() is None else fs.format_name)
+        elif fieldspec.is_aggregated():
+            related_table = datamodel.get_table(fieldspec.get_field().relatedModelName, strict=True)
+            definition = formatter.getAggregatorDef(related_table, fs.format_name)
+        else:
+            continue
+        if definition is not None:
+            found += 1
+    return found
+
+def statement_stats(statement):
+    """Return (joins, subqueries, correlated) counting the joins and the
+    nested selects anywhere in 'statement', and how many of the nested
+    selects refer to a table of an enclosing select, which makes them
+    evaluated once per row of the enclosing select.
+    """
+    counts = dict(joins=0, subqueries=0, correlated=0)
+    seen = set()
+
+    def visit(element, enclosing):
+        if id(element) in seen:
+            return
+        seen.add(id(element))
+
+        if isinstance(element, Join):
+            counts['joins'] += 1
+        elif isinstance(element, Select):
+            froms = set(element.locate_all_froms())
+            if enclosing is not None:
+                counts['subqueries'] += 1
+                if froms & enclosing:
+                    counts['correlated'] += 1
+            enclosing = froms if enclosing is None else froms | enclosing
+
+        for child in element.get_children(column_collections=False):
+            visit(child, enclosing)
+
+    visit(statement, None)
+    return counts['joins'], counts['subqueries'], counts['correlated']
+
+def explain(session, statement, params):
+    "Return the rows of the server's EXPLAIN output for 'statement'."
+    result = session.connection().execute(Explain(statement), params)
+    keys = result.keys()
+    return [OrderedDict(zip(keys, row)) for row in result]
+
+def profile_query(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset,
+                  recordsetid=None, formatauditobjs=False):
+    """Build and execute a query as execute does and return a report of
+    the SQL, the database server's query plan, the number of joins and
+    subqueries and the time spent on each step in milliseconds.
+
+    The formatters are resolved separately first, so that the build
+    step mostly measures constructing the statement from the fields.
+    """
+    set_group_concat_max_len(session)
+    timings = OrderedDict()
+
+    with timed(timings, 'formatters'):
+        formatters = resolve_formatters(collection, user, field_specs)
+
+    grouped_aggregation = not count_only and use_grouped_aggregation(session, limit, offset, recordsetid)
+
+    with timed(timings, 'build'):
+        statement = build_statement(session, collection, user, tableid, distinct, count_only, field_specs,
+                                    bool(limit), recordsetid=recordsetid, formatauditobjs=formatauditobjs,
+                                    grouped_aggregation=grouped_aggregation)
+
+    with timed(timings, 'compile'):
+        compiled = statement.compile(dialect=session.bind.dialect)
+
+    params = {plan_cache.OFFSET_PARAM: offset}
+    if limit:
+        params[plan_cache.LIMIT_PARAM] = limit
+
+    with timed(timings, 'execute'):
+        rows = plan_cache.execute_plan(session, compiled, offset, limit).fetchall()
+
+    with timed(timings, 'serialize'):
+        if count_only:
+            toJson({'count': rows[0][0]})
+        else:
+            toJson({'results': [tuple(row) for row in rows]})
+
+    # EXPLAIN runs last so that it does not warm the caches for the
+    # timed execution.
+    with timed(timings, 'explain'):
+        plan = explain(session, statement, params)
+
+    joins, subqueries, correlated = statement_stats(statement)
+
+    return OrderedDict([
+        ('sql', str(compiled)),
+        ('params', compiled.construct_params(params)),
+        ('explain', plan),
+        ('timings', OrderedDict((name, round(ms, 3)) for name, ms in timings.items())),
+        ('rows', len(rows)),
+        ('fields', len(field_specs)),
+        ('formatters', formatters),
+        ('joins', joins),
+        ('subqueries', subqueries),
+        ('correlated_subqueries', correlated),
+        ('grouped_aggregation', grouped_aggregation),
+    ])
+
+def profile_ephemeral_query(collection, user, spquery):
+    """Profile a Specify query from deserialized json as
+    run_ephemeral_query would execute it.
+    """
+    logger.info('profiling ephemeral query: %s', spquery)
+    if 'collectionid' in spquery:
+        collection = Collection.objects.get(pk=spquery['collectionid'])
+
+    with models.session_context() as session:
+        field_specs = field_specs_from_json(spquery['fields'])
+        return profile_query(session, collection, user, spquery['contexttableid'],
+                             spquery['selectdistinct'], spquery['countonly'], field_specs,
+                             spquery.get('limit', 20), spquery.get('offset', 0),
+                             spquery.get('recordsetid', None),
+                             formatauditobjs=spquery.get('formatauditrecids', False))
+
+def profile_stored_query(session, query_id, collection, user, limit=20, offset=0):
+    "Profile the query from the Spquery table with the given id."
+    sp_query = session.query(models.SpQuery).get(query_id)
+    field_specs = [QueryField.from_spqueryfield(field)
+                   for field in sorted(sp_query.fields, key=lambda field: field.position)]
+    return profile_query(session, collection, user, sp_query.contextTableId,
+                         sp_query.selectDistinct, sp_query.countOnly, field_specs, limit, offset)
@@ -1,8 +1,13 @@
 import logging
 from collections import namedtuple, deque
+from time import time
 
 from sqlalchemy import orm, sql
 
+from django.conf import settings
+from django.db.models import signals, Count, Max, Sum
+
+from specifyweb.specify import models as spmodels
 from specifyweb.specify.models import datamodel
 
 from . import models
@@ -15,6 +20,60 @@ def get_treedef(collection, tree_name):
             if tree_name == 'Storage' else
             getattr(collection.discipline, tree_name.lower() + "treedef"))
 
+class TreeRanks(namedtuple('TreeRanks', 'rank_count item_ids')):
+    """The number of ranks of a tree definition and the ids of its
+    items by lower case rank name.
+    """
+    def item_id(self, rank_name):
+        return self.item_ids[rank_name.lower()]
+
+# Seconds between checks of the database for ranks changed by other
+# processes. Changes made by this process are noticed immediately.
+TREE_RANKS_CHECK_INTERVAL = 30
+
+CachedRanks = namedtuple('CachedRanks', 'ranks stamp checked')
+
+# CachedRanks keyed by (tree name, treedef id).
+tree_ranks_cache = {}
+
+def tree_ranks_stamp(treedef):
+    "Return a value that changes whenever an item of 'treedef' does."
+    return tuple(treedef.treedefitems.aggregate(
+        Count('id'), Max('timestampmodified'), Sum('version')).values())
+
+def get_tree_ranks(treedef, rank_name=None):
+    """Return the TreeRanks of 'treedef'. The cached ranks are checked
+    against the database every TREE_RANKS_CHECK_INTERVAL seconds, and
+    at once if they lack 'rank_name'.
+    """
+    key = (treedef.__class__.__name__, treedef.id)
+    cached = tree_ranks_cache.get(key)
+    now = time()
+    if cached is not None and now - cached.checked < TREE_RANKS_CHECK_INTERVAL and (
+            rank_name is None or rank_name.lower() in cached.ranks.item_ids):
+        return cached.ranks
+
+    stamp = tree_ranks_stamp(treedef)
+    if cached is not None and cached.stamp == stamp:
+        tree_ranks_cache[key] = cached._replace(checked=now)
+        return cached.ranks
+
+    items = list(treedef.treedefitems.order_by('rankid').values_list('id', 'name'))
+    item_ids = {}
+    for id, name in items:
+        item_ids.setdefault(name.lower(), id)
+    ranks = TreeRanks(len(items), item_ids)
+    tree_ranks_cache[key] = CachedRanks(ranks, stamp, now)
+    return ranks
+
+def tree_ranks_changed(sender, **kwargs):
+    tree_ranks_cache.clear()
+
+for tree in ('Taxon', 'Geography', 'Storage', 'Geologictimeperiod', 'Lithostrat'):
+    treedefitem_model = getattr(spmodels, tree + 'treedefitem')
+    signals.post_save.connect(tree_ranks_changed, sender=treedefitem_model)
+    signals.post_delete.connect(tree_ranks_changed, sender=treedefitem_model)
+
 class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter query join_cache param_count')):
     def __new__(cls, *args, **kwargs):
         kwargs['join_cache'] = dict()
@@ -26,31 +85,33 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
         assert query.collection is not None # Not sure it makes sense to query across collections
         logger.info('handling treefield %s rank: %s field: %s', table, tree_rank, tree_field)
 
+        column_name = 'name' if tree_field is None else \
+                      node._id if tree_field == 'ID' else \
+                      table.get_field(tree_field.lower()).name
+
+        if settings.TREE_RANK_JOIN_STRATEGY == 'nodenumber':
+            return query.handle_tree_field_by_nodenumber(node, table, tree_rank, column_name)
+
         treedefitem_column = table.name + 'TreeDefItemID'
 
         if (table, 'TreeRanks') in query.join_cache:
             logger.debug("using join cache for %r tree ranks.", table)
-            ancestors, treedef = query.join_cache[(table, 'TreeRanks')]
+            ancestors, ranks = query.join_cache[(table, 'TreeRanks')]
         else:
-            treedef = get_treedef(query.collection, table.name)
-            rank_count = treedef.treedefitems.count()
+            ranks = get_tree_ranks(get_treedef(query.collection, table.name), tree_rank)
 
             ancestors = [node]
-            for i in range(rank_count-1):
+            for i in range(ranks.rank_count-1):
                 ancestor = orm.aliased(node)
                 query = query.outerjoin(ancestor, ancestors[-1].ParentID == getattr(ancestor, ancestor._id))
                 ancestors.append(ancestor)
 
             logger.debug("adding to join cache for %r tree ranks.", table)
             query = query._replace(join_cache=query.join_cache.copy())
-            query.join_cache[(table, 'TreeRanks')] = (ancestors, treedef)
+            query.join_cache[(table, 'TreeRanks')] = (ancestors, ranks)
 
         query = query._replace(param_count=self.param_count+1)
-        treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=treedef.treedefitems.get(name=tree_rank).id)
-
-        column_name = 'name' if tree_field is None else \
-                      node._id if tree_field == 'ID' else \
-                      table.get_field(tree_field.lower()).name
+        treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=ranks.item_id(tree_rank))
 
         column = sql.case([
             (getattr(ancestor, treedefitem_column) == treedefitem_param, getattr(ancestor, column_name))
@@ -59,6 +120,39 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
 
         return query, column
 
+    def handle_tree_field_by_nodenumber(self, node, table, tree_rank, column_name):
+        """Join the ancestor of 'node' at 'tree_rank' as the node of that
+        rank whose nested set interval contains the node number of
+        'node', and return its column 'column_name'. Unlike joining
+        every ancestor and picking the one of the right rank, this
+        takes a single join per rank.
+        """
+        query = self
+        key = (node, 'TreeRank', tree_rank.lower())
+        if key in query.join_cache:
+            logger.debug("using join cache for %r rank %s.", table, tree_rank)
+            ancestor = query.join_cache[key]
+        else:
+            treedef = get_treedef(query.collection, table.name)
+            ranks = get_tree_ranks(treedef, tree_rank)
+
+            query = query._replace(param_count=self.param_count+1)
+            treedef_param = sql.bindparam('td_%s' % query.param_count, value=treedef.id)
+            treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=ranks.item_id(tree_rank))
+
+            ancestor = orm.aliased(node)
+            query = query.outerjoin(ancestor, sql.and_(
+                getattr(ancestor, table.name + 'TreeDefID') == treedef_param,
+                getattr(ancestor, table.name + 'TreeDefItemID') == treedefitem_param,
+                node.nodeNumber.between(ancestor.nodeNumber, ancestor.highestChildNodeNumber),
+            ))
+
+            logger.debug("adding to join cache for %r rank %s.", table, tree_rank)
+            query = query._replace(join_cache=query.join_cache.copy())
+            query.join_cache[key] = ancestor
+
+        return query, getattr(ancestor, column_name)
+
     def build_join(self, table, model, join_path):
         query = self
         path = deque(join_path)
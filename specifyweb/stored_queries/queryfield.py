@@ -32,8 +32,12 @@ class QueryField(namedtuple('QueryField', [
                    format_name = field.formatName,
                    sort_type = field.sortType)
 
-    def add_to_query(self, query, no_filter=False, formatauditobjs=False):
-        logger.info("adding field %s", self)
+    def has_filter(self):
+        "Returns True if the field restricts the rows of the query."
+        if self.fieldspec.tree_rank is None and self.fieldspec.get_field() is None:
+            # The record formatter field can't be filtered on.
+            return False
+
         value_required_for_filter = QueryOps.OPERATIONS[self.op_num] not in (
             'op_true',              # 6
             'op_false',             # 7
@@ -42,8 +46,12 @@ class QueryField(namedtuple('QueryField', [
             'op_falseornull',       # 14
         )
 
-        no_filter = no_filter or (self.value == ''
-                                  and value_required_for_filter
-                                  and not self.negate)
+        return not (self.value == ''
+                    and value_required_for_filter
+                    and not self.negate)
+
+    def add_to_query(self, query, no_filter=False, formatauditobjs=False):
+        logger.info("adding field %s", self)
+        no_filter = no_filter or not self.has_filter()
 
         return self.fieldspec.add_to_query(query, value=self.value, op_num=None if no_filter else self.op_num, negate=self.negate, formatter=self.format_name, formatauditobjs=formatauditobjs)
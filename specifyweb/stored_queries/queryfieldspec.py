@@ -2,7 +2,6 @@ import re, logging
 from collections import namedtuple, deque
 
 from sqlalchemy import orm, sql
-from django.core.exceptions import ObjectDoesNotExist
 
 from specifyweb.specify.models import datamodel
 
@@ -59,6 +58,8 @@ def make_stringid(fs, table_list):
     return table_list, fs.table.name.lower(), field_name
 
 
+TO_MANY = ('one-to-many', 'many-to-many')
+
 class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table date_part tree_rank tree_field")):
     @classmethod
     def from_path(cls, path_in, add_id=False):
@@ -173,6 +174,35 @@ class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table da
         field = self.get_field()
         return field is not None and field.is_temporal()
 
+    def is_aggregated(self):
+        "Returns True if the field aggregates the records of a relationship."
+        return self.is_relationship() and self.get_field().type != 'many-to-one'
+
+    def query_join_path(self):
+        """Returns the part of the join path that is joined into the
+        query. The last relationship of an aggregated field is
+        evaluated in a subquery instead.
+        """
+        return self.join_path[:-1] if self.is_aggregated() else self.join_path
+
+    def joins_to_many(self):
+        "Returns True if the field's joins can multiply the rows of the query."
+        return any(field.is_relationship and field.type in TO_MANY
+                   for field in self.query_join_path())
+
+    def formatted_table(self):
+        "Returns the table formatted by the object formatter for the field, if any."
+        if self.tree_rank is None and self.get_field() is None:
+            return self.root_table
+        if self.is_relationship() and not self.is_aggregated():
+            return datamodel.get_table(self.get_field().relatedModelName, strict=True)
+        return None
+
+    def add_joins(self, query):
+        "Adds the field's joins to the query without selecting or filtering anything."
+        query, __, __, __ = self.build_join(query, self.query_join_path())
+        return query.reset_joinpoint()
+
     def build_join(self, query, join_path):
         model = getattr(models, self.root_table.name)
         return query.build_join(self.root_table, model, join_path)
@@ -201,7 +231,7 @@ class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table da
                 query, orm_field = query.objectformatter.objformat(query, orm_model, formatter)
             else:
                 query, orm_model, table, field = self.build_join(query, self.join_path[:-1])
-                orm_field = query.objectformatter.aggregate(query, self.get_field(), orm_model, formatter)
+                query, orm_field = query.objectformatter.aggregate(query, self.get_field(), orm_model, formatter)
         else:
             query, orm_model, table, field = self.build_join(query, self.join_path)
 
@@ -237,19 +267,10 @@ class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table da
         return query, orm_field
 
 def get_uiformatter(collection, tablename, fieldname):
-    from specifyweb.specify.models import Splocalecontaineritem
-    from specifyweb.specify.uiformatters import get_uiformatter
+    from specifyweb.specify.uiformatters import get_registry
 
+    registry = get_registry(collection, None)
     if tablename.lower() == "collectionobject" and fieldname.lower() == "catalognumber":
-        return get_uiformatter(collection, None, collection.catalognumformatname)
-
-    try:
-        field_format = Splocalecontaineritem.objects.get(
-            container__discipline=collection.discipline,
-            container__name=tablename.lower(),
-            name=fieldname.lower(),
-            format__isnull=False).format
-    except ObjectDoesNotExist:
-        return None
-    else:
-        return get_uiformatter(collection, None, field_format)
+        return registry.get(collection.catalognumformatname)
+
+    return registry.for_field(tablename, fieldname)
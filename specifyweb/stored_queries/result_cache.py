@@ -0,0 +1,149 @@
+"""A process wide cache of query results.
+
+Reports run the same queries over and over. Their results are cached
+under the normalized query, i.e. the plan key of its fields and
+options, with the offset and limit of the page. Only callers that can
+take results up to RESULT_CACHE_TTL seconds old use the cache, so the
+interactive query builder always reads the database.
+
+Every cached result records the modification counters of the tables
+its statement reads. A counter is bumped whenever a record of its
+table is saved or deleted through Django, and again when the
+transaction commits, so a result is dropped as soon as one of its
+tables changes and a result read before the commit is not kept.
+Changes made by other processes or by bulk updates that bypass the
+signals are only picked up once the result expires after
+RESULT_CACHE_TTL seconds.
+"""
+from collections import OrderedDict, defaultdict, namedtuple
+from time import time
+import sys
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import transaction
+from django.db.models import signals
+from sqlalchemy.sql.util import find_tables
+
+from . import plan_cache
+
+# Seconds a result is used at most.
+RESULT_CACHE_TTL = 120
+
+# Approximate number of bytes of results kept in memory.
+MAX_BYTES = 64 * 1024 * 1024
+
+# Results larger than this fraction of MAX_BYTES are not cached.
+MAX_ENTRY_FRACTION = 0.125
+
+# Tables that shape the results without being read by the statement:
+# the formatters and schema localization and the tree definitions.
+DEFINITION_TABLES = plan_cache.STAMP_TABLES + tuple(
+    tree + 'treedefitem' for tree in ('taxon', 'geography', 'storage', 'geologictimeperiod', 'lithostrat'))
+
+Entry = namedtuple('Entry', 'data versions size created')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_size = 0
+
+# Modification counters by lower case table name.
+_versions = defaultdict(int)
+
+def result_key(plan_key, limit, offset):
+    return plan_key + (limit, offset)
+
+def statement_tables(statement):
+    "Return the names of the tables 'statement' reads, in lower case."
+    return {table.name.lower() for table in find_tables(statement)} | set(DEFINITION_TABLES)
+
+def estimate_size(data):
+    "Roughly the number of bytes held by the result data."
+    size = sys.getsizeof(data)
+    for value in data.values():
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            for row in value:
+                size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+    return size
+
+def freeze(data):
+    "Return 'data' with its lists of rows made immutable tuples."
+    return {name: tuple(tuple(row) for row in value) if isinstance(value, list) else value
+            for name, value in data.items()}
+
+def thaw(data):
+    """Return a copy of frozen 'data' whose lists of rows the caller may
+    modify. The rows themselves stay tuples, as execute returns them.
+    """
+    return {name: list(value) if isinstance(value, tuple) else value
+            for name, value in data.items()}
+
+def get(key):
+    "Return a copy of the cached result data under 'key', or None."
+    now = time()
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if now - entry.created >= RESULT_CACHE_TTL or any(
+                _versions[table] != version for table, version in entry.versions):
+            discard(key)
+            return None
+        _cache.move_to_end(key)
+        data = entry.data
+    return thaw(data)
+
+def versions_of(statement):
+    """Return the current modification counters of the tables read by
+    'statement'. They are taken before the statement is executed, so
+    that a change made meanwhile invalidates the result.
+    """
+    tables = sorted(statement_tables(statement))
+    with _lock:
+        return tuple((table, _versions[table]) for table in tables)
+
+def put(key, versions, data):
+    "Cache the result 'data' read with the table 'versions' under 'key'."
+    size = estimate_size(data)
+    if size > MAX_BYTES * MAX_ENTRY_FRACTION:
+        logger.debug("not caching result of %d bytes", size)
+        return
+    with _lock:
+        _store(key, Entry(freeze(data), versions, size, time()))
+
+def _store(key, entry):
+    global _size
+    if key in _cache:
+        discard(key)
+    _cache[key] = entry
+    _size += entry.size
+    while _size > MAX_BYTES:
+        discard(next(iter(_cache)))
+
+def discard(key):
+    global _size
+    entry = _cache.pop(key, None)
+    if entry is not None:
+        _size -= entry.size
+
+def clear():
+    global _size
+    with _lock:
+        _cache.clear()
+        _size = 0
+
+def bump(table):
+    with _lock:
+        _versions[table] += 1
+
+def table_changed(sender, **kwargs):
+    # Bumped at once for the changing process' own later queries, and
+    # on commit for results read meanwhile from the committed data.
+    table = sender._meta.db_table.lower()
+    bump(table)
+    transaction.on_commit(lambda: bump(table))
+
+signals.post_save.connect(table_changed)
+signals.post_delete.connect(table_changed)
@@ -0,0 +1,161 @@
+"""Snapshots of query results for paging.
+
+Paging through a large query normally runs the whole query again for
+every page with a new offset. A result session instead runs it once
+and keeps the ids of the resulting records in order. Every page is
+then read by fetching the records with the ids at the page's position.
+
+With the ids the snapshot keeps the rank of every record in each field
+of the query, as ordered by the database. Sorting the results
+differently sorts the snapshot by the ranks, in the collation of the
+database, without running the query again.
+
+The snapshot is not updated when records change, so sessions expire
+after RESULT_SESSION_TTL seconds. Sessions are kept in the memory of
+the process that created them. A request served by another process
+creates a new session.
+"""
+from array import array
+from collections import OrderedDict
+from time import time
+from uuid import uuid4
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from . import plan_cache
+
+# Seconds a snapshot of results is used.
+RESULT_SESSION_TTL = 600
+
+# Number of result sessions kept in memory.
+CACHE_SIZE = 16
+
+# Approximate number of bytes of snapshots kept in memory.
+MAX_BYTES = 32 * 1024 * 1024
+
+# Queries returning more rows than this are not snapshotted.
+MAX_ROWS = 500000
+
+class ResultSession(object):
+    """The ids of a query's results, an array('q'), in the order given
+    by 'sort', a tuple of (field index, sort type) pairs as returned by
+    sort_spec, and the 'ranks' of the records in each field, a sequence
+    of array('i') as returned by rank_columns.
+    """
+    def __init__(self, key, sort, ids, ranks=()):
+        self.token = uuid4().hex
+        self.key = key
+        self.created = time()
+        self.sort = sort
+        self.ids = ids
+        self.ranks = ranks
+        self.resorted = None
+
+    @property
+    def size(self):
+        # Room is kept for the ids of one other order.
+        return 2 * self.ids.itemsize * len(self.ids) + sum(
+            rank.itemsize * len(rank) for rank in self.ranks)
+
+    def ids_sorted(self, sort):
+        """Return the ids sorted by 'sort'. Records that are equal in
+        the sort fields stay in the order of the snapshot. The last
+        order asked for is kept.
+        """
+        if sort == self.sort:
+            return self.ids
+        resorted = self.resorted
+        if resorted is not None and resorted[0] == sort:
+            return resorted[1]
+
+        order = list(range(len(self.ids)))
+        # Sorting by the least significant field first gives the order
+        # by all the fields, as the sort is stable.
+        for index, sort_type in reversed(sort):
+            order.sort(key=self.ranks[index].__getitem__, reverse=sort_type == 2)
+        ids = array('q', (self.ids[i] for i in order))
+        self.resorted = (sort, ids)
+        return ids
+
+def rank_columns(rows, columns):
+    """Return for each of the sort key 'columns' of 'rows', given by
+    index, the dense rank of the key in every row, an array('i'), where
+    nulls come first as in MySQL. The keys compare as the database
+    orders their values, e.g. the WEIGHT_STRING of strings.
+    """
+    ranks = []
+    for column in columns:
+        values = [row[column] for row in rows]
+        positions = {value: position for position, value in enumerate(
+            sorted(set(value for value in values if value is not None)), 1)}
+        ranks.append(array('i', (0 if value is None else positions[value] for value in values)))
+    return ranks
+
+def sort_spec(field_specs):
+    "Return the sort of the query given by 'field_specs'."
+    return tuple((index, fs.sort_type) for index, fs in enumerate(field_specs) if fs.sort_type)
+
+def session_key(collection, user, tableid, field_specs, **options):
+    "Return the key of the results of a query regardless of its sort."
+    return plan_cache.plan_key(collection, user, tableid,
+                               [fs._replace(sort_type=0) for fs in field_specs], **options)
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+_size = 0
+
+# When the queries with these keys were found to have more than
+# MAX_ROWS results, so that they are not snapshotted again at once.
+_too_large = {}
+
+def get(token, key):
+    """Return the live result session with 'token' if it is of the query
+    with 'key', in any sort, or None.
+    """
+    now = time()
+    with _lock:
+        result = _sessions.get(token)
+        if result is None or result.key != key:
+            return None
+        if now - result.created >= RESULT_SESSION_TTL:
+            discard(token)
+            return None
+        _sessions.move_to_end(token)
+        return result
+
+def put(result):
+    global _size
+    with _lock:
+        _sessions[result.token] = result
+        _size += result.size
+        while len(_sessions) > CACHE_SIZE or _size > MAX_BYTES:
+            discard(next(iter(_sessions)))
+
+def discard(token):
+    global _size
+    result = _sessions.pop(token, None)
+    if result is not None:
+        _size -= result.size
+
+def too_large(key):
+    "Was the query with 'key' found to have too many results lately?"
+    with _lock:
+        found = _too_large.get(key)
+        if found is not None and time() - found >= RESULT_SESSION_TTL:
+            del _too_large[key]
+            found = None
+        return found is not None
+
+def mark_too_large(key):
+    with _lock:
+        _too_large[key] = time()
+        while len(_too_large) > CACHE_SIZE:
+            del _too_large[next(iter(_too_large))]
+
+def clear():
+    global _size
+    with _lock:
+        _sessions.clear()
+        _too_large.clear()
+        _size = 0
@@ -3,14 +3,35 @@ from sqlalchemy.ext import compiler
 
 
 class SelectIntoOutfile(Executable, ClauseElement):
-    def __init__(self, select, path):
+    def __init__(self, select, path, fields_terminated_by=',', enclosed_by='"',
+                 optionally_enclosed=True, escaped_by=None, lines_terminated_by='\n',
+                 character_set=None):
         self.select = select
         self.path = path
+        self.fields_terminated_by = fields_terminated_by
+        self.enclosed_by = enclosed_by
+        self.optionally_enclosed = optionally_enclosed
+        self.escaped_by = escaped_by
+        self.lines_terminated_by = lines_terminated_by
+        self.character_set = character_set
+
+def quote(value):
+    "Render value as a MySQL string literal."
+    escaped = value.replace('\\', '\\\\').replace("'", "\\'") \
+                   .replace('\r', '\\r').replace('\n', '\\n').replace('\0', '\\0')
+    # The statement goes through the driver's %-style parameter
+    # formatting.
+    return "'%s'" % escaped.replace('%', '%%')
 
 @compiler.compiles(SelectIntoOutfile)
 def compile(element, compiler, **kwargs):
-    return (
-        "%s INTO OUTFILE '%s' "
-        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
-        "LINES TERMINATED BY '\\n'"
-    ) % (compiler.process(element.select), element.path)
+    sql = "%s INTO OUTFILE %s " % (compiler.process(element.select), quote(element.path))
+    if element.character_set is not None:
+        sql += "CHARACTER SET %s " % element.character_set
+    sql += "FIELDS TERMINATED BY %s " % quote(element.fields_terminated_by)
+    sql += "%sENCLOSED BY %s " % ("OPTIONALLY " if element.optionally_enclosed else "",
+                                  quote(element.enclosed_by))
+    if element.escaped_by is not None:
+        sql += "ESCAPED BY %s " % quote(element.escaped_by)
+    sql += "LINES TERMINATED BY %s" % quote(element.lines_terminated_by)
+    return sql
@@ -0,0 +1,12 @@
+"""Background job functions of stored queries. See specifyweb.jobs."""
+
+from ..specify.models import Collection
+
+from .execution import do_export
+
+def export_query(run, spquery, collection_id, filename, exporttype, host=None):
+    """Export the results of the deserialized query definition
+    'spquery' to 'filename' in the depository.
+    """
+    collection = Collection.objects.get(id=collection_id)
+    do_export(spquery, collection, run.user, filename, exporttype, host, progress=run.progress)
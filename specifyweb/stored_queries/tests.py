@@ -1,9 +1,27 @@
 from sqlalchemy import orm
 from unittest import skip
 
+from array import array
+import csv
+import gzip
+import io
+import os
+import tempfile
+from xml.etree import ElementTree
+
+from django.test import TestCase, override_settings
+
 from specifyweb.specify.api_tests import ApiTests
+from specifyweb.specify import models as spmodels
 from .queryfieldspec import QueryFieldSpec
-from . import models
+from .query_construct import QueryConstruct, get_tree_ranks, tree_ranks_cache
+from .select_into_outfile import SelectIntoOutfile
+from .execution import field_specs_from_json, build_count_query, build_query, use_grouped_aggregation, execute, run_ephemeral_query, \
+    open_export_file, write_csv_rows, createPlacemark, KML_HEAD, KML_TAIL
+from .format import FormatterDefs, get_formatter_defs, get_formatters_stamp, get_schema_formats
+from .profile import statement_stats, profile_query
+from .explain import Explain
+from . import models, plan_cache, result_cache, result_sessions
 
 @skip("These tests are out of date.")
 class StoredQueriesTests(ApiTests):
@@ -278,3 +296,524 @@ class StoredQueriesTests(ApiTests):
     #     self.assertEqual(params, (7, 1, 2, 8, 1, 2))
 
 
+class PlanCacheTests(ApiTests):
+    def setUp(self):
+        super(PlanCacheTests, self).setUp()
+        plan_cache.clear()
+
+    def field_specs(self, value):
+        return field_specs_from_json([{
+            'position': 0,
+            'stringid': '1.collectionobject.catalogNumber',
+            'isrelfld': False,
+            'operstart': 1,
+            'startvalue': value,
+            'isnot': False,
+            'isdisplay': True,
+            'sorttype': 1,
+            'formatname': None,
+        }])
+
+    def key(self, value, **options):
+        return plan_cache.plan_key(self.collection, self.specifyuser, 1, self.field_specs(value), **options)
+
+    def test_key_is_normalized(self):
+        self.assertEqual(self.key('1', distinct=False), self.key('1', distinct=False))
+        self.assertNotEqual(self.key('1', distinct=False), self.key('2', distinct=False))
+        self.assertNotEqual(self.key('1', distinct=False), self.key('1', distinct=True))
+
+    def test_plan_is_reused(self):
+        built = []
+        def build():
+            built.append(True)
+            return orm.Query(models.CollectionObject.collectionObjectId).statement
+
+        with models.session_context() as session:
+            key = self.key('1')
+            first = plan_cache.get_plan(session, key, build)
+            second = plan_cache.get_plan(session, key, build)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(built), 1)
+
+    def test_app_resource_change_clears_plans(self):
+        with models.session_context() as session:
+            plan_cache.get_plan(session, self.key('1'),
+                                lambda: orm.Query(models.CollectionObject.collectionObjectId).statement)
+
+        self.assertEqual(len(plan_cache._cache), 1)
+        directory = spmodels.Spappresourcedir.objects.create(
+            collection=self.collection,
+            discipline=self.discipline,
+            ispersonal=False)
+        spmodels.Spappresource.objects.create(
+            spappresourcedir=directory,
+            name='DataObjFormatters',
+            level=0,
+            specifyuser=self.specifyuser)
+        self.assertEqual(len(plan_cache._cache), 0)
+
+
+FORMATTERS_XML = """
+<formatters>
+  <format name="Accession" title="Accession" class="edu.ku.brc.specify.datamodel.Accession">
+    <switch single="true"><fields><field>accessionNumber</field></fields></switch>
+  </format>
+  <format name="AccessionOther" title="Accession" class="edu.ku.brc.specify.datamodel.Accession">
+    <switch single="true"><fields><field>text1</field></fields></switch>
+  </format>
+  <aggregators>
+    <aggregator name="Collectors" title="Collectors" class="edu.ku.brc.specify.datamodel.Collector" separator="; " format="Collector"/>
+  </aggregators>
+</formatters>
+"""
+
+class FormatterDefsTests(ApiTests):
+    def test_index(self):
+        defs = FormatterDefs(FORMATTERS_XML)
+        self.assertEqual(defs.formatters['name']['AccessionOther'].attrib['name'], 'AccessionOther')
+        # The first definition for a class is used, as with ElementTree.find.
+        self.assertEqual(defs.formatters['class']['edu.ku.brc.specify.datamodel.Accession'].attrib['name'], 'Accession')
+        self.assertEqual(defs.aggregators['name']['Collectors'].attrib['separator'], '; ')
+        self.assertIsNone(defs.aggregators['class'].get('edu.ku.brc.specify.datamodel.Agent'))
+
+    def test_stamp_changes_with_resource(self):
+        before = get_formatters_stamp()
+        directory = spmodels.Spappresourcedir.objects.create(
+            collection=self.collection,
+            discipline=self.discipline,
+            ispersonal=False)
+        resource = spmodels.Spappresource.objects.create(
+            spappresourcedir=directory,
+            name='DataObjFormatters',
+            level=0,
+            specifyuser=self.specifyuser)
+        data = spmodels.Spappresourcedata.objects.create(
+            spappresource=resource,
+            data=FORMATTERS_XML)
+        after = get_formatters_stamp()
+        self.assertNotEqual(before, after)
+
+        data.version += 1
+        data.save()
+        self.assertNotEqual(after, get_formatters_stamp())
+
+    def test_defs_reloaded_when_resource_saved(self):
+        defs = get_formatter_defs(self.collection, self.specifyuser)
+        self.assertIs(get_formatter_defs(self.collection, self.specifyuser), defs)
+
+        directory = spmodels.Spappresourcedir.objects.create(
+            collection=self.collection,
+            discipline=self.discipline,
+            ispersonal=False)
+        resource = spmodels.Spappresource.objects.create(
+            spappresourcedir=directory,
+            name='DataObjFormatters',
+            level=0,
+            specifyuser=self.specifyuser)
+        spmodels.Spappresourcedata.objects.create(
+            spappresource=resource,
+            data=FORMATTERS_XML)
+        self.assertIsNot(get_formatter_defs(self.collection, self.specifyuser), defs)
+
+    def test_schema_formats(self):
+        spmodels.Splocalecontainer.objects.create(
+            name='accession',
+            schematype=0,
+            ishidden=False,
+            issystem=False,
+            discipline=self.discipline,
+            format='AccessionOther')
+        self.assertEqual(get_schema_formats(self.discipline.id)['accession'], 'AccessionOther')
+
+        container = spmodels.Splocalecontainer.objects.get(name='accession', discipline=self.discipline)
+        container.format = 'Accession'
+        container.save()
+        self.assertEqual(get_schema_formats(self.discipline.id)['accession'], 'Accession')
+
+
+class CountQueryTests(ApiTests):
+    def field(self, position, stringid, isrelfld=False, value='', display=True):
+        return {
+            'position': position,
+            'stringid': stringid,
+            'isrelfld': isrelfld,
+            'operstart': 1,
+            'startvalue': value,
+            'isnot': False,
+            'isdisplay': display,
+            'sorttype': 0,
+            'formatname': None,
+        }
+
+    def count_sql(self, distinct, fields):
+        with models.session_context() as session:
+            query = build_count_query(session, self.collection, self.specifyuser, 1, distinct,
+                                      field_specs_from_json(fields))
+            return None if query is None else str(query.statement)
+
+    def test_display_columns_are_dropped(self):
+        sql = self.count_sql(False, [
+            self.field(0, '1.collectionobject.catalogNumber', value='1'),
+            self.field(1, '1,9-determinations.determination.determinations', isrelfld=True),
+        ])
+        self.assertIn('count(', sql)
+        self.assertNotIn('group_concat', sql.lower())
+        self.assertIn('CatalogNumber', sql)
+
+    def test_distinct_counts_ids(self):
+        sql = self.count_sql(True, [self.field(0, '1.collectionobject.catalogNumber')])
+        self.assertIn('count(DISTINCT', sql)
+
+    def test_to_many_display_column(self):
+        fields = [self.field(0, '1,9-determinations.determination.remarks')]
+        # The join multiplies the rows so it is kept...
+        self.assertIn('determination', self.count_sql(False, fields))
+        # ...but distinct rows then depend on the displayed values.
+        self.assertIsNone(self.count_sql(True, fields))
+
+
+class ProfileTests(CountQueryTests):
+    def query_statement(self, grouped_aggregation):
+        fields = [self.field(0, '1,9-determinations.determination.determinations', isrelfld=True),
+                  self.field(1, '1,10.collectingevent.startDate')]
+        with models.session_context() as session:
+            query, __ = build_query(session, self.collection, self.specifyuser, 1,
+                                    field_specs_from_json(fields), grouped_aggregation=grouped_aggregation)
+            return query.statement
+
+    def test_correlated_subquery_counted(self):
+        joins, subqueries, correlated = statement_stats(self.query_statement(False))
+        self.assertEqual((subqueries, correlated), (1, 1))
+        self.assertGreaterEqual(joins, 1)
+
+    def test_grouped_subquery_not_correlated(self):
+        joins, subqueries, correlated = statement_stats(self.query_statement(True))
+        self.assertEqual((subqueries, correlated), (1, 0))
+
+    def test_explain_compiles(self):
+        sql = str(Explain(self.query_statement(False)).compile(dialect=models.engine.dialect))
+        self.assertTrue(sql.startswith('EXPLAIN SELECT'))
+
+    def test_profile_query(self):
+        fields = field_specs_from_json([self.field(0, '1.collectionobject.catalogNumber')])
+        with models.session_context() as session:
+            report = profile_query(session, self.collection, self.specifyuser, 1, False, False,
+                                   fields, 20, 0)
+        self.assertEqual(report['rows'], len(self.collectionobjects))
+        self.assertEqual(list(report['timings']),
+                         ['formatters', 'build', 'compile', 'execute', 'serialize', 'explain'])
+        self.assertTrue(report['explain'])
+        self.assertIn('SELECT', report['sql'])
+
+
+class TreeRankJoinTests(ApiTests):
+    def setUp(self):
+        super(TreeRankJoinTests, self).setUp()
+        self.geographytreedef.treedefitems.create(name="Continent", rankid="100")
+        self.geographytreedef.treedefitems.create(name="Country", rankid="200")
+
+    def tree_field_sql(self, *ranks):
+        query = QueryConstruct(
+            collection=self.collection,
+            objectformatter=None,
+            query=orm.Query(models.Geography.geographyId),
+        )
+        table = spmodels.datamodel.get_table('Geography')
+        for rank in ranks:
+            query, column = query.handle_tree_field(models.Geography, table, rank, None)
+            query = query.add_columns(column)
+        return str(query.query)
+
+    def test_tree_ranks_are_cached(self):
+        ranks = get_tree_ranks(self.geographytreedef)
+        self.assertEqual(ranks.rank_count, 3)
+        self.assertIs(ranks, get_tree_ranks(self.geographytreedef))
+
+        self.geographytreedef.treedefitems.create(name="State", rankid="300")
+        ranks = get_tree_ranks(self.geographytreedef)
+        self.assertEqual(ranks.rank_count, 4)
+        self.assertEqual(ranks.item_id('state'), self.geographytreedef.treedefitems.get(name="State").id)
+
+    def test_tree_ranks_changed_elsewhere(self):
+        ranks = get_tree_ranks(self.geographytreedef)
+        cached = dict(tree_ranks_cache)
+        self.geographytreedef.treedefitems.create(name="County", rankid="400")
+        # As in another process, which doesn't get the signal.
+        tree_ranks_cache.update(cached)
+        self.assertIs(get_tree_ranks(self.geographytreedef), ranks)
+
+        ranks = get_tree_ranks(self.geographytreedef, 'County')
+        self.assertEqual(ranks.rank_count, 4)
+        self.assertEqual(ranks.item_id('county'), self.geographytreedef.treedefitems.get(name="County").id)
+
+    @override_settings(TREE_RANK_JOIN_STRATEGY='ancestors')
+    def test_ancestors_strategy(self):
+        sql = self.tree_field_sql('Continent', 'Country')
+        self.assertEqual(sql.count('LEFT OUTER JOIN'), 2)
+        self.assertIn('CASE', sql)
+
+    @override_settings(TREE_RANK_JOIN_STRATEGY='nodenumber')
+    def test_nodenumber_strategy(self):
+        sql = self.tree_field_sql('Continent', 'Country', 'Country')
+        self.assertEqual(sql.count('LEFT OUTER JOIN'), 2)
+        self.assertEqual(sql.count('BETWEEN'), 2)
+        self.assertNotIn('CASE', sql)
+
+
+class AggregationStrategyTests(CountQueryTests):
+    def query_sql(self, grouped_aggregation):
+        fields = [self.field(0, '1,9-determinations.determination.determinations', isrelfld=True)]
+        with models.session_context() as session:
+            query, __ = build_query(session, self.collection, self.specifyuser, 1,
+                                    field_specs_from_json(fields), grouped_aggregation=grouped_aggregation)
+            return str(query.statement)
+
+    def test_correlated(self):
+        sql = self.query_sql(False)
+        self.assertIn('GROUP_CONCAT', sql)
+        self.assertNotIn('GROUP BY', sql)
+
+    def test_grouped(self):
+        sql = self.query_sql(True)
+        self.assertIn('GROUP_CONCAT', sql)
+        self.assertIn('GROUP BY', sql)
+        self.assertIn('LEFT OUTER JOIN (SELECT', sql)
+        # The determinations are only grouped for the collection objects
+        # of the collection.
+        self.assertIn('IN (SELECT', sql)
+        self.assertIn('CollectionID', sql)
+
+    def test_strategy_choice(self):
+        with models.session_context() as session:
+            self.assertFalse(use_grouped_aggregation(session, limit=20, offset=0))
+            self.assertTrue(use_grouped_aggregation(session, limit=500, offset=600))
+            self.assertTrue(use_grouped_aggregation(session))
+
+
+class ResultSessionTests(CountQueryTests):
+    def setUp(self):
+        super(ResultSessionTests, self).setUp()
+        result_sessions.clear()
+
+    def fields(self, sort_type):
+        field = self.field(0, '1.collectionobject.catalogNumber')
+        field['sorttype'] = sort_type
+        return field_specs_from_json([field])
+
+    def run_query(self, sort_type, limit, offset, resultsession=None):
+        with models.session_context() as session:
+            return execute(session, self.collection, self.specifyuser, 1, False, False,
+                           self.fields(sort_type), limit, offset, resultsession=resultsession)
+
+    def test_pages_match_query(self):
+        first = self.run_query(2, 2, 0, resultsession=True)
+        self.assertEqual(first['count'], len(self.collectionobjects))
+        token = first['resultsession']
+
+        pages = [first['results']] + [self.run_query(2, 2, offset, resultsession=token)['results']
+                                      for offset in (2, 4)]
+        self.assertEqual([row for page in pages for row in page], self.run_query(2, 0, 0)['results'])
+        self.assertEqual(self.run_query(2, 2, 2, resultsession=token)['resultsession'], token)
+
+    def test_resort_in_snapshot(self):
+        token = self.run_query(1, 0, 0, resultsession=True)['resultsession']
+        data = self.run_query(2, 0, 0, resultsession=token)
+        self.assertEqual(data['resultsession'], token)
+        self.assertEqual(data['results'], self.run_query(2, 0, 0)['results'])
+        self.assertEqual(self.run_query(0, 0, 0, resultsession=token)['count'], len(self.collectionobjects))
+
+    def test_resort_does_not_run_query(self):
+        token = self.run_query(1, 0, 0, resultsession=True)['resultsession']
+        spmodels.Collectionobject.objects.create(collection=self.collection, catalognumber="num-new")
+        data = self.run_query(2, 0, 0, resultsession=token)
+        self.assertEqual(data['resultsession'], token)
+        self.assertEqual(data['count'], len(self.collectionobjects))
+
+    def test_other_query_gets_new_session(self):
+        token = self.run_query(1, 0, 0, resultsession=True)['resultsession']
+        with models.session_context() as session:
+            data = execute(session, self.collection, self.specifyuser, 1, False, False,
+                           field_specs_from_json([self.field(0, '1.collectionobject.catalogNumber', value='num-1')]),
+                           0, 0, resultsession=token)
+        self.assertNotEqual(data['resultsession'], token)
+        self.assertEqual(data['count'], 1)
+
+    def test_too_many_results(self):
+        saved = result_sessions.MAX_ROWS
+        result_sessions.MAX_ROWS = len(self.collectionobjects) - 1
+        try:
+            data = self.run_query(1, 2, 0, resultsession=True)
+            self.assertNotIn('resultsession', data)
+            self.assertEqual(len(data['results']), 2)
+            key = result_sessions.session_key(self.collection, self.specifyuser, 1, self.fields(1),
+                                              recordsetid=None, formatauditobjs=False)
+            self.assertTrue(result_sessions.too_large(key))
+        finally:
+            result_sessions.MAX_ROWS = saved
+
+    def test_rank_columns(self):
+        rows = [(10, b'b', 3), (11, None, 1), (12, b'a', 3), (13, b'b', None)]
+        ranks = result_sessions.rank_columns(rows, (1, 2))
+        self.assertEqual([list(rank) for rank in ranks], [[2, 0, 1, 2], [2, 1, 2, 0]])
+        result = result_sessions.ResultSession(('key',), (), array('q', [row[0] for row in rows]), ranks)
+        # Nulls sort first ascending and last descending, as in MySQL.
+        self.assertEqual(list(result.ids_sorted(((0, 1),))), [11, 12, 10, 13])
+        self.assertEqual(list(result.ids_sorted(((0, 2), (1, 1)))), [13, 10, 12, 11])
+
+    def test_memory_cap(self):
+        sessions = [result_sessions.ResultSession(('key', i), (), array('q', range(100))) for i in range(3)]
+        saved = result_sessions.MAX_BYTES
+        result_sessions.MAX_BYTES = sessions[0].size * 2
+        try:
+            for result in sessions:
+                result_sessions.put(result)
+            self.assertIsNone(result_sessions.get(sessions[0].token, ('key', 0)))
+            self.assertIs(result_sessions.get(sessions[2].token, ('key', 2)), sessions[2])
+        finally:
+            result_sessions.MAX_BYTES = saved
+
+
+class ResultCacheTests(CountQueryTests):
+    def setUp(self):
+        super(ResultCacheTests, self).setUp()
+        result_cache.clear()
+
+    def run_query(self, count_only=False):
+        return run_ephemeral_query(self.collection, self.specifyuser, {
+            'contexttableid': 1,
+            'selectdistinct': False,
+            'countonly': count_only,
+            'fields': [self.field(0, '1.collectionobject.catalogNumber')],
+            'limit': 20,
+            'offset': 0,
+        }, use_result_cache=True)
+
+    def test_not_cached_by_default(self):
+        first = run_ephemeral_query(self.collection, self.specifyuser, {
+            'contexttableid': 1,
+            'selectdistinct': False,
+            'countonly': False,
+            'fields': [self.field(0, '1.collectionobject.catalogNumber')],
+            'limit': 20,
+            'offset': 0,
+        })
+        spmodels.Collectionobject.objects.update(catalognumber="renumbered")
+        self.assertNotEqual(self.run_query(), first)
+
+    def test_cached_until_table_changes(self):
+        first = self.run_query()
+        # A bulk update sends no signals, so the cached result is kept.
+        spmodels.Collectionobject.objects.update(catalognumber="renumbered")
+        self.assertEqual(self.run_query(), first)
+        self.assertEqual(len(first['results']), len(self.collectionobjects))
+
+        spmodels.Collectionobject.objects.create(collection=self.collection, catalognumber="num-new")
+        second = self.run_query()
+        self.assertEqual(len(second['results']), len(self.collectionobjects) + 1)
+
+    def test_cached_result_is_copied(self):
+        self.run_query()['results'].clear()
+        self.assertEqual(len(self.run_query()['results']), len(self.collectionobjects))
+
+    def test_unrelated_change_keeps_result(self):
+        first = self.run_query()
+        spmodels.Agent.objects.create(agenttype=0, division=self.division, lastname="Other")
+        spmodels.Collectionobject.objects.update(catalognumber="renumbered")
+        self.assertEqual(self.run_query(), first)
+
+    def test_statement_tables(self):
+        with models.session_context() as session:
+            query, __ = build_query(session, self.collection, self.specifyuser, 1,
+                                    field_specs_from_json([self.field(0, '1,10.collectingevent.startDate')]))
+        tables = result_cache.statement_tables(query.statement)
+        self.assertIn('collectionobject', tables)
+        self.assertIn('collectingevent', tables)
+        self.assertIn('spappresourcedata', tables)
+
+    def test_memory_cap(self):
+        data = {'results': [(i, 'value %d' % i) for i in range(10)]}
+        size = result_cache.estimate_size(data)
+        saved = result_cache.MAX_BYTES
+        result_cache.MAX_BYTES = int(size * 8.5)
+        try:
+            for i in range(9):
+                result_cache.put(('key', i), (), data)
+            self.assertIsNone(result_cache.get(('key', 0)))
+            self.assertEqual(result_cache.get(('key', 8)), data)
+        finally:
+            result_cache.MAX_BYTES = saved
+
+
+class CsvExportTests(TestCase):
+    rows = [
+        (1, 'plain', 'two\r\nlines', None),
+        (2, 'comma, quoted', 'line\nbreak', 3),
+        (3, 'skipped', '', ''),
+    ]
+
+    def write(self, **kwargs):
+        f = io.StringIO(newline='')
+        write_csv_rows(csv.writer(f), self.rows, **kwargs)
+        return f.getvalue()
+
+    def test_line_breaks_replaced(self):
+        self.assertEqual(
+            self.write(strip_id=True, row_filter=lambda row: row[0] != 3, batch_size=1),
+            'plain,two  lines,None\r\n"comma, quoted",line break,3\r\n')
+
+    def test_batches_do_not_change_output(self):
+        self.assertEqual(self.write(batch_size=1), self.write(batch_size=1000))
+
+    def test_gzip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.csv.gz')
+            with open_export_file(path, compress=True) as f:
+                write_csv_rows(csv.writer(f), self.rows)
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), self.write())
+
+
+class KmlPlacemarkTests(TestCase):
+    def test_point(self):
+        row = (7, 'Lawrence', '-95.2', '38.9')
+        placemark = createPlacemark(row, [2, 3], 'locality', ['Name', 'Long', 'Lat'], 'http://host')
+        self.assertEqual(placemark.find('name').text, 'Lawrence')
+        self.assertEqual(placemark.find('Point/coordinates').text, '-95.2,38.9')
+        data = {d.get('name'): d.find('value').text for d in placemark.iter('Data')}
+        self.assertEqual(data['Name'], 'Lawrence')
+        self.assertEqual(data['coordinates'], '38.9, -95.2')
+        self.assertEqual(data['go to'], 'http://host/specify/view/locality/7/')
+
+    def test_line(self):
+        row = ('Road', '1', '2', '3', '4')
+        placemark = createPlacemark(row, [1, 2, 3, 4], None, ['Name'], 'http://host')
+        self.assertEqual(placemark.find('MultiGeometry/LineString/coordinates').text, '1,2 3,4')
+        self.assertEqual(placemark.find('MultiGeometry/Point/coordinates').text, '1,2')
+
+    def test_document(self):
+        placemark = createPlacemark(('A & B', '1', '2'), [1, 2], None, ['Name'], 'http://host')
+        kml = KML_HEAD + ElementTree.tostring(placemark, encoding='unicode') + '\n' + KML_TAIL
+        document = ElementTree.fromstring(kml.encode('utf-8'))
+        self.assertEqual(document.find('{http://earth.google.com/kml/2.2}Document/'
+                                       '{http://earth.google.com/kml/2.2}Placemark/'
+                                       '{http://earth.google.com/kml/2.2}name').text, 'A & B')
+
+
+class SelectIntoOutfileTests(TestCase):
+    def compile(self, **kwargs):
+        select = orm.Query(models.CollectionObject.collectionObjectId).statement
+        return str(SelectIntoOutfile(select, '/tmp/out%.csv', **kwargs).compile(dialect=models.engine.dialect))
+
+    def test_defaults(self):
+        self.assertTrue(self.compile().endswith(
+            "INTO OUTFILE '/tmp/out%%.csv' "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n'"))
+
+    def test_csv_options(self):
+        sql = self.compile(enclosed_by='', optionally_enclosed=False, escaped_by='',
+                           lines_terminated_by='\r\n', character_set='utf8mb4')
+        self.assertTrue(sql.endswith(
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' ENCLOSED BY '' "
+            "ESCAPED BY '' LINES TERMINATED BY '\\r\\n'"))
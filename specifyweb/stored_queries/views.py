@@ -1,6 +1,5 @@
 import logging
 import json
-from threading import Thread
 from datetime import datetime
 
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseForbidden
@@ -10,10 +9,12 @@ from django.views.decorators.cache import never_cache
 from ..specify.models import Collection
 from ..specify.api import toJson, uri_for_model
 from ..specify.views import login_maybe_required, apply_access_control
+from ..jobs.queue import enqueue
 
 from . import models
 from .queryfield import QueryField
-from .execution import execute, run_ephemeral_query, do_export, recordset
+from .execution import execute, run_ephemeral_query, recordset
+from .profile import profile_ephemeral_query
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +41,8 @@ def query(request, id):
                        for field in sorted(sp_query.fields, key=lambda field: field.position)]
 
         data = execute(session, request.specify_collection, request.specify_user,
-                       tableid, distinct, count_only, field_specs, limit, offset)
+                       tableid, distinct, count_only, field_specs, limit, offset,
+                       resultsession=request.GET.get('resultsession', None))
 
     return HttpResponse(toJson(data), content_type='application/json')
 
@@ -56,6 +58,22 @@ def ephemeral(request):
     data = run_ephemeral_query(request.specify_collection, request.specify_user, spquery)
     return HttpResponse(toJson(data), content_type='application/json')
 
+@require_POST
+@login_maybe_required
+@never_cache
+def explain(request):
+    """Profile the query given like for ephemeral, returning the SQL,
+    the database server's EXPLAIN output and where the time went.
+    """
+    if not request.specify_user.is_admin():
+        return HttpResponseForbidden()
+    try:
+        spquery = json.load(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(e)
+    data = profile_ephemeral_query(request.specify_collection, request.specify_user, spquery)
+    return HttpResponse(toJson(data), content_type='application/json')
+
 
 @require_POST
 @login_maybe_required
@@ -75,10 +93,11 @@ def export_csv(request):
         collection = request.specify_collection
 
     filename = 'query_results_%s.csv' % datetime.now().isoformat()
+    if spquery.get('compress', False):
+        filename += '.gz'
 
-    thread = Thread(target=do_export, args=(spquery, collection, request.specify_user, filename, 'csv', None))
-    thread.daemon = True
-    thread.start()
+    enqueue(request.specify_user, 'query-export', spquery=spquery, collection_id=collection.id,
+            filename=filename, exporttype='csv')
     return HttpResponse('OK', content_type='text/plain')
 
 @require_POST
@@ -103,9 +122,8 @@ def export_kml(request):
 
     filename = 'query_results_%s.kml' % datetime.now().isoformat()
 
-    thread = Thread(target=do_export, args=(spquery, collection, request.specify_user, filename, 'kml', the_host))
-    thread.daemon = True
-    thread.start()
+    enqueue(request.specify_user, 'query-export', spquery=spquery, collection_id=collection.id,
+            filename=filename, exporttype='kml', host=the_host)
     return HttpResponse('OK', content_type='text/plain')
 
 @require_POST
@@ -17,6 +17,7 @@ from .report_runner import urls as report_urls
 from .interactions import urls as interaction_urls
 from .notifications import urls as notification_urls
 from .export import urls as export_urls
+from .jobs import urls as job_urls
 
 urlpatterns = [
     url(r'^favicon.ico', RedirectView.as_view(url='/static/img/fav_icon.png')),
@@ -57,5 +58,6 @@ urlpatterns = [
     url(r'^interactions/', include(interaction_urls)),
     url(r'^notifications/', include(notification_urls)),
     url(r'^export/', include(export_urls)),
+    url(r'^jobs/', include(job_urls)),
     # url(r'^testcontext/', include()),
 ]